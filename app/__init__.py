@@ -1,3 +1,4 @@
+import os
 from flask import Flask
 from app.model import db, User, Status
 from werkzeug.security import generate_password_hash
@@ -10,17 +11,53 @@ login_manager = LoginManager()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from a small per-process cache of (id, username, role), see app/user_cache.py
+    from app.user_cache import load_cached_user
+    return load_cached_user(int(user_id))
+
 def create_app():
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clients.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.secret_key = 'health-app'
 
+    # Database url, pool size and SQLite pragmas come from the environment, see app/database.py
+    from app.database import configure_database, init_database_engine
+    configure_database(app)
+
     db.init_app(app)
+    init_database_engine(app, db)
     migrate = Migrate(app, db)
 
 
+    # last_login timestamps are written in batches by a background thread
+    from app.logins import last_login_buffer
+    last_login_buffer.init_app(app)
+
+    # Password hashing settings and the cap on how many requests hash at once
+    from app.passwords import password_hasher
+    password_hasher.init_app(app)
+
+    # Per-request timings, /metrics and the slow query log
+    from app.metrics import request_metrics
+    request_metrics.init_app(app)
+
+    # With TRAFFIC_LOG set every request is appended to that file for `flask replay-traffic`, see app/traffic.py
+    from app.traffic import traffic_recorder
+    app.config['TRAFFIC_LOG'] = os.environ.get('TRAFFIC_LOG')
+    app.config['TRAFFIC_SAMPLE'] = os.environ.get('TRAFFIC_SAMPLE', 1.0)
+    traffic_recorder.init_app(app)
+
+    # The bearer token the profile site's mirror presents to read /api/changes, the feed is off without one
+    app.config['CHANGE_FEED_TOKEN'] = os.environ.get('CHANGE_FEED_TOKEN')
+
+    # Status names are read once and resolved in memory, see app/statuses.py
+    from app.statuses import status_registry
+    status_registry.init_app(app)
+
+    # Cache changes are shared between the gunicorn workers through the database, see app/invalidation.py
+    from app.invalidation import invalidation_bus
+    invalidation_bus.init_app(app)
+
     login_manager.init_app(app)
     login_manager.login_view = 'main.login'
 
@@ -31,9 +68,17 @@ def create_app():
     from app.api.routes import api
     app.register_blueprint(api, url_prefix='/api')
 
+    from app.commands import register_commands
+    register_commands(app)
 
-    # Configure CORS for the public api - get client profile
+
+    # Configure CORS for the public api - get client profile and the change feed
     CORS(app, resources={
+        r"/api/changes": {
+            "origins": ["https://cemaexternalsite.netlify.app"],
+            "methods": ["GET"],
+            "allow_headers": ["Content-Type", "Authorization"]
+        },
         r"/api/client/*": {
             "origins": ["https://cemaexternalsite.netlify.app/"],  # Replace with your frontend URL
             "methods": ["GET"],
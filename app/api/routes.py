@@ -1,9 +1,21 @@
-from flask import Blueprint, jsonify, request, current_app
-from app.model import Client, Program, Enrollment, Appointment, db
+from flask import Blueprint, jsonify, request, current_app, Response
+from app.model import Client, Enrollment, Appointment, db
+from app.stats import invalidate_dashboard_stats
+from app.profiles import get_client_profile_json, invalidate_client_profile, PROFILE_QUERY_COUNT
+from app.search import search_clients_ranked, client_search_filters, parse_limit
+from app.enrollments import bulk_enroll, MAX_BULK_ENROLLMENT_ITEMS
+from flask_login import current_user
+from app.snapshots import snapshot_range, program_snapshot_range
+from app.pagination import encode_cursor, decode_cursor, parse_page_size, InvalidCursor
+from app.querybudget import query_budget
+from app.catalog import get_program_catalog
+from app.statuses import StatusId, status_name
+from app.changes import read_changes, CHANGE_QUERY_COUNT, DEFAULT_FEED_PAGE_SIZE, MAX_FEED_PAGE_SIZE
 from datetime import datetime, timedelta, date
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from functools import wraps
 from flask_cors import cross_origin
+import hmac
 
 def public_route(func):
     @wraps(func)
@@ -11,12 +23,39 @@ def public_route(func):
         return func(*args, **kwargs)
     return decorated
 
+# The json endpoints answer a missing login with a 401 the api client can handle, not a redirect to the login page
+def api_login_required(func):
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Login required'}), 401
+        return func(*args, **kwargs)
+    return decorated
+
+# The change feed returns every client's contact details, so only the mirror that holds CHANGE_FEED_TOKEN may read it
+# It sends the token as `Authorization: Bearer <token>`; without a token configured the feed is off
+# The token is a server-side secret: the mirror reads the feed from its backend or build step, never from the
+# public site's JavaScript, where every visitor could read the token and with it every client's details
+# CORS preflights (OPTIONS) carry no Authorization header, they are answered by cross_origin before this runs
+def feed_token_required(func):
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        token = current_app.config.get('CHANGE_FEED_TOKEN')
+        if not token:
+            return jsonify({'error': 'The change feed is not enabled'}), 403
+        scheme, _, presented = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(presented.strip().encode(), token.encode()):
+            return jsonify({'error': 'A valid change feed token is required'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return func(*args, **kwargs)
+    return decorated
+
 api = Blueprint('api', __name__, url_prefix='/api')
 
 
 """   Search for clients @ api.route('/clients/search')
-This is a get request that takes in a search term
-It then returns a list of clients that match the search criteria.
+This is a get request that takes in a search term and an optional limit
+It then returns a list of clients that match the search criteria, best matches first.
+The search term is matched by word prefix against the client's name, phone and email
 It returns the client id, name, email, gender, phone, age, and the programs they are enrolled in 
 It also returns the user that registered the client
 """
@@ -26,7 +65,8 @@ def search_clients():
     if not query:
         return jsonify([])
 
-    results = Client.query.filter(Client.full_name.ilike(f"%{query}%")).all()
+    limit = parse_limit(request.args.get('limit'))
+    results = search_clients_ranked(query, limit=limit)
     return jsonify([
         {'id': client.id, 'name': client.full_name, 'email': client.email}
         for client in results
@@ -36,14 +76,17 @@ def search_clients():
 
 """   Get all programs @ api.route('/programs')
 This is a get request that returns a list of all programs
+The ETag is the catalog version, so clients can revalidate with If-None-Match and get a 304
 """
 @api.route('/programs')
 def get_programs():
-    programs = Program.query.all()
-    return jsonify([
+    catalog = get_program_catalog()
+    response = jsonify([
         {'id': program.id, 'name': program.name}
-        for program in programs
+        for program in catalog
     ])
+    response.set_etag(catalog.etag)
+    return response.make_conditional(request)
 
 
 """   Get all enrollments for a client @ api.route('/clients/<int:client_id>/enrollments')
@@ -51,12 +94,16 @@ This is a get request that takes in a client id
 It then returns a list of all enrollments for the client
 """
 @api.route('/clients/<int:client_id>/enrollments', methods=['GET'])
+@query_budget(2) # The client, then the enrollments with their program
 def get_client_enrollments(client_id):
-    client = Client.query.get(client_id)
+    client = db.session.get(Client, client_id)
     if not client:
         return jsonify({'error': 'Client not found'}), 404
 
-    enrollments = Enrollment.query.filter_by(client_id=client_id).all()
+    # The program is joined in instead of a lazy load per enrollment, the status name comes from the registry
+    enrollments = Enrollment.query.options(
+        joinedload(Enrollment.program)
+    ).filter_by(client_id=client_id).all()
     
     result = []
     for enrollment in enrollments:
@@ -64,7 +111,7 @@ def get_client_enrollments(client_id):
         result.append({
             'programName': program.name if program else 'N/A',
             'date': enrollment.enrollment_date.strftime('%Y-%m-%d') if enrollment.enrollment_date else 'N/A',
-            'status': enrollment.status.name if enrollment.status else 'N/A'
+            'status': status_name(enrollment.status_id)
         })
     
     return jsonify(result)
@@ -90,29 +137,28 @@ def enroll_client(client_id):
     conflicts = Enrollment.query.filter(
         Enrollment.client_id == client_id,
         Enrollment.program_id.in_(program_ids),
-        Enrollment.status_id == 1  # active enrollments
+        Enrollment.status_id == StatusId.ENROLLED
     ).all()
 
-    if conflicts:
-        conflict_program_ids = [e.program_id for e in conflicts]
+    # The programs come from the catalog, checked against the current version since this is a write
+    catalog = get_program_catalog(fresh=True)
 
-        # Fetch program names in one query
-        conflict_programs = Program.query.filter(Program.id.in_(conflict_program_ids)).all()
-        conflict_names = [p.name for p in conflict_programs]
-            
+    if conflicts:
+        conflict_program_ids = {e.program_id for e in conflicts}
+        conflict_names = [p.name for p in catalog if p.id in conflict_program_ids]
 
         return jsonify({'success': False, 'message': f'Client already enrolled in the following program(s): {conflict_names}'}), 400
 
     try:
         for program_id in program_ids:
-            program = Program.query.get(program_id)
+            program = catalog.get(int(program_id))
             if not program:
                 return jsonify({'success': False, 'message': f'Program not found: {program_id}'}), 404
 
             enrollment = Enrollment(
                 client_id=client_id,
                 program_id=program_id,
-                status_id=1,  # assuming 1 is active
+                status_id=StatusId.ENROLLED,
                 enrollment_date=datetime.now(),
                 start_date=datetime.now(),
                 end_date=datetime.now() + timedelta(weeks=program.duration)
@@ -120,6 +166,8 @@ def enroll_client(client_id):
             db.session.add(enrollment)
 
         db.session.commit()
+        invalidate_dashboard_stats()
+        invalidate_client_profile(client_id)
         return jsonify({'success': True, 'message': 'Enrollment successful'}), 200
 
     except Exception as e:
@@ -127,55 +175,134 @@ def enroll_client(client_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+"""   Bulk enroll clients @ api.route('/enrollments/bulk', methods=['POST'])
+This is a post request that takes in a list of items, each with a clientId and a programId
+It enrolls every valid pair in one transaction and returns a result for every item
+    - enrolled, invalid, duplicate, client_not_found, program_not_found or already_enrolled
+It requires the user to be logged in
+"""
+@api.route('/enrollments/bulk', methods=['POST'])
+@api_login_required
+def bulk_enroll_clients():
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'No enrollments given'}), 400
+
+    if len(items) > MAX_BULK_ENROLLMENT_ITEMS:
+        return jsonify({'success': False, 'message': f'At most {MAX_BULK_ENROLLMENT_ITEMS} enrollments can be sent at once'}), 400
+
+    try:
+        results, client_ids = bulk_enroll(items)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in bulk_enroll_clients: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    if client_ids:
+        invalidate_dashboard_stats()
+        for client_id in client_ids:
+            invalidate_client_profile(client_id)
+
+    return jsonify({
+        'success': True,
+        'enrolled': len([r for r in results if r['result'] == 'enrolled']),
+        'results': results
+    }), 200
+
+
+"""   Get trends @ api.route('/trends')
+This is a get request that returns the daily snapshots between two dates (from, to as YYYY-MM-DD)
+It defaults to the last year, and returns one program's history when a program id is given
+It requires the user to be logged in
+"""
+@api.route('/trends')
+@api_login_required
+def get_trends():
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=365)
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    program_id = request.args.get('program', type=int)
+    if program_id:
+        snapshots = program_snapshot_range(program_id, start, end)
+    else:
+        snapshots = snapshot_range(start, end)
+
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'program': program_id,
+        'days': [
+            {
+                'day': snapshot.day.isoformat(),
+                'active_enrollments': snapshot.active_enrollments,
+                'completed_enrollments': snapshot.completed_enrollments,
+                'dropped_enrollments': snapshot.dropped_enrollments,
+                'appointments': snapshot.appointments,
+                **({} if program_id else {
+                    'total_clients': snapshot.total_clients,
+                    'new_clients': snapshot.new_clients,
+                    'active_users': snapshot.active_users,
+                }),
+            }
+            for snapshot in snapshots
+        ]
+    })
+
+
 """   Search for clients @ api.route('/search-clients')
 This is a get request that takes in a search term, program id, and age
-It then returns a list of clients that match the search criteria.
+It then returns a page of clients that match the search criteria, ordered by client id.
 It returns the client id, name, email, gender, phone, age, and the programs they are enrolled in 
 It also returns the user that registered the client
+The page size is set with 'limit' and the next page is fetched by passing the returned 'next' cursor as 'cursor'
 """
 @api.route('/search-clients')
+@query_budget(5) # FTS check, page ids, clients with their registering user, enrollments (batched)
 def search_clients_api():
     search_term = request.args.get('q', '')
     program_id = request.args.get('program', '')
     age = request.args.get('age', '')
+    page_size = parse_page_size(request.args.get('limit'))
+
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+        after_id = int(after.get('id', 0)) if after else None
+    except (InvalidCursor, TypeError, ValueError):
+        return jsonify({'error': f"Invalid cursor: {request.args.get('cursor')}"}), 400
 
     try:
         """
-        This is the query that gets the clients, 
-            - their enrollments, 
-            - the programs they are enrolled in, 
-            - the status of the enrollments, 
-            - and the user that registered the client
+        Phase 1 gets the ids of the clients on this page
+            - only the client id is selected, using the indexed filters
+            - one extra id is fetched to know whether there is a next page
         """
-        query = db.session.query(Client).options(
-            joinedload(Client.enrollments).joinedload(Enrollment.program),
-            joinedload(Client.enrollments).joinedload(Enrollment.status),
-            joinedload(Client.registered_by_user) # This is the user that registered the client
+        id_query = db.session.query(Client.id).filter(
+            *client_search_filters(search_term, program_id, age)
         )
+        if after_id is not None:
+            id_query = id_query.filter(Client.id > after_id)
+        page_ids = [row.id for row in id_query.order_by(Client.id).limit(page_size + 1)]
 
-        if search_term:
-            query = query.filter(Client.full_name.ilike(f"%{search_term}%"))
-
-        if program_id:
-            query = query.join(Client.enrollments).filter(Enrollment.program_id == program_id)
-
-        if age:
-            try:
-                ageLower, ageUpper = map(int, age.split('-'))
+        has_next = len(page_ids) > page_size
+        page_ids = page_ids[:page_size]
 
-                today = date.today()
-                
-                # Person just turned age_upper -> born 'today - age_upper years'
-                dob_start = today - timedelta(days=ageUpper * 365)
-
-                # Person is about to turn age_lower -> born 'today - age_lower years'
-                dob_end = today - timedelta(days=(ageLower + 1) * 365)
-
-                query = query.filter(Client.date_of_birth.between(dob_start, dob_end))
-            except ValueError:
-                pass
-
-        clients = query.all()
+        """
+        Phase 2 loads just the clients on this page with
+            - their enrollments and the programs they are enrolled in (one batched query)
+            - and the user that registered the client
+        """
+        clients = []
+        if page_ids:
+            clients = db.session.query(Client).options(
+                selectinload(Client.enrollments).joinedload(Enrollment.program),
+                joinedload(Client.registered_by_user) # This is the user that registered the client
+            ).filter(Client.id.in_(page_ids)).order_by(Client.id).all()
 
         return jsonify({
             
@@ -191,7 +318,7 @@ def search_clients_api():
                     'enrollments': [
                         {
                             'program': enrollment.program.name,
-                            'status': enrollment.status.name,
+                            'status': status_name(enrollment.status_id),
                             'start_date': enrollment.start_date.isoformat(),
                             'end_date': enrollment.end_date.isoformat()
                         }
@@ -199,7 +326,8 @@ def search_clients_api():
                     ]
                 }
                 for client in clients
-            ]
+            ],
+            'next': encode_cursor(id=page_ids[-1]) if has_next else None
         })
 
     except Exception as e:
@@ -210,49 +338,48 @@ def search_clients_api():
 """   Get client profile @ api.route('/client/<int:client_id>', methods=['GET'])
 This api exposes the client profile to the frontend
 It returns the client profile, their enrollments, their dropped enrollments, and their appointments
+Responses carry a strong ETag, so clients can revalidate with If-None-Match and get a 304
 """
 @api.route('/client/<int:client_id>', methods=['GET'])
 @public_route
 @cross_origin(origin='https://cemaexternalsite.netlify.app/') 
+@query_budget(PROFILE_QUERY_COUNT) # Only on a cache miss
 def get_client_profile_api(client_id):
-    client = Client.query.get_or_404(client_id)
-
-    enrollments = Enrollment.query.filter_by(client_id=client_id, status_id=1).all()
-    dropped_enrollments = Enrollment.query.filter_by(client_id=client_id, status_id=3).all()
-    appointments = Appointment.query.filter_by(client_id=client_id).all()
-
-    data = {
-        'id': client.id,
-        'name': client.full_name,
-        'gender': client.gender,
-        'email': client.email,
-        'phone': client.phone,
-        'registered_at': client.registered_at.strftime('%Y-%m-%d'),
-        'active_enrollments': [
-            {
-                'program': e.program.name,
-                'status': e.status.name,
-                'start_date': e.start_date.strftime('%Y-%m-%d'),
-                'end_date': e.end_date.strftime('%Y-%m-%d'),
-            } for e in enrollments
-        ],
-        'dropped_enrollments': [
-            {
-                'program': e.program.name,
-                'status': e.status.name,
-                'start_date': e.start_date.strftime('%Y-%m-%d'),
-                'end_date': e.end_date.strftime('%Y-%m-%d'),
-            } for e in dropped_enrollments
-        ],
-        'appointments': [
-            {
-                'date': a.date.strftime('%Y-%m-%d'),
-                'status': a.status.name,
-                'doctor': a.doctor.full_name if a.doctor else 'N/A'
-            } for a in appointments
-        ]
-    }
+    # The encoded profile is cached per client until the client, their enrollments or appointments change
+    cached = get_client_profile_json(client_id)
+    if cached is None:
+        return jsonify({'error': 'Client not found'}), 404
 
-    return jsonify(data)
+    body, etag = cached
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Answers If-None-Match with a 304 and no body
+    return response.make_conditional(request)
 
 
+"""   Get changes @ api.route('/changes', methods=['GET'])
+This api is the change feed for the external profile site (see app/changes.py)
+It takes the cursor from the previous page (since) and a page size (limit)
+It requires the change feed token (CHANGE_FEED_TOKEN) as a bearer token, so it is meant for server-side consumers
+It returns the changed clients, enrollments and appointments since that cursor and the cursor to continue from
+Without since it starts from the beginning of the log, which is how a mirror is first filled
+"""
+@api.route('/changes', methods=['GET'])
+@cross_origin(origins=['https://cemaexternalsite.netlify.app'], methods=['GET'],
+              allow_headers=['Authorization', 'Content-Type'])
+@feed_token_required
+@query_budget(CHANGE_QUERY_COUNT)
+def get_changes():
+    try:
+        since = decode_cursor(request.args.get('since')) or {}
+        since_seq = int(since.get('seq', 0))
+    except (InvalidCursor, TypeError, ValueError):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    limit = parse_page_size(request.args.get('limit'), default=DEFAULT_FEED_PAGE_SIZE, maximum=MAX_FEED_PAGE_SIZE)
+
+    changes, last_seq, has_more = read_changes(since_seq, limit)
+    return jsonify({
+        'changes': changes,
+        'cursor': encode_cursor(seq=last_seq),
+        'has_more': has_more
+    })
@@ -0,0 +1,292 @@
+import io
+import os
+import secrets
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import multiprocessing
+from datetime import date, timedelta
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from app.database import install_pragmas, sqlite_pragmas
+from app.model import db, User, Client, Program, Enrollment, Appointment
+
+
+# Database contention benchmark
+# Runs writer and reader processes (like gunicorn workers) against a copy of the database,
+# once with SQLite's defaults (rollback journal, synchronous=FULL) and once with the engine profile
+# from app/database.py, and reports throughput, p95 latency and "database is locked" errors
+# The application's database is only copied, never written
+
+DEFAULT_PRAGMAS = [('journal_mode', 'DELETE'), ('synchronous', 'FULL')]
+
+READ_SQL = text(
+    "SELECT (SELECT count(*) FROM clients), (SELECT count(*) FROM enrollments WHERE status_id = 1), "
+    "(SELECT count(*) FROM bench_writes)"
+)
+WRITE_SQL = text("INSERT INTO bench_writes (worker, payload) VALUES (:worker, :payload)")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def _worker(path, pragmas, role, worker, seconds):
+    engine = install_pragmas(create_engine(f'sqlite:///{path}'), pragmas)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if role == 'write':
+                    conn.execute(WRITE_SQL, {'worker': worker, 'payload': 'x' * 200})
+                else:
+                    conn.execute(READ_SQL).one()
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    engine.dispose()
+    return role, len(latencies), errors, latencies
+
+
+def _prepare_copy(source, directory, name):
+    path = os.path.join(directory, name)
+    # The backup api also copies pages that are still in the source's WAL file
+    src, conn = sqlite3.connect(source), sqlite3.connect(path)
+    src.backup(conn)
+    src.close()
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.execute('CREATE TABLE IF NOT EXISTS bench_writes '
+                 '(id INTEGER PRIMARY KEY, worker INTEGER, payload TEXT)')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def run_contention_benchmark(source, writers=2, readers=4, seconds=5):
+    """
+    Returns {profile: {'writes': n, 'reads': n, 'write_errors': n, 'read_errors': n,
+                       'write_p95': seconds, 'read_p95': seconds, 'seconds': seconds}}
+    """
+    profiles = [('default', DEFAULT_PRAGMAS), ('tuned', sqlite_pragmas(source))]
+    results = {}
+    # spawn, so the benchmark processes do not inherit the app's open connections
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pragmas in profiles:
+            path = _prepare_copy(source, directory, f'{name}.db')
+            jobs = [(path, pragmas, 'write', i, seconds) for i in range(writers)]
+            jobs += [(path, pragmas, 'read', i, seconds) for i in range(readers)]
+            with context.Pool(len(jobs)) as pool:
+                outcomes = pool.starmap(_worker, jobs)
+
+            result = {'seconds': seconds}
+            for role in ('write', 'read'):
+                latencies = [l for r, _, _, ls in outcomes if r == role for l in ls]
+                result[f'{role}s'] = sum(n for r, n, _, _ in outcomes if r == role)
+                result[f'{role}_errors'] = sum(e for r, _, e, _ in outcomes if r == role)
+                result[f'{role}_p95'] = percentile(latencies, 95)
+            results[name] = result
+    return results
+
+
+# Route benchmark suite
+# Drives the routes of the main and api blueprints through the Flask test client against the configured
+# database (seed one with `flask seed-dataset` first) and records per route:
+#   p50/p95/p99 latency, SQL statements per request (median), peak Python memory (tracemalloc) and status
+# Requests run with warm caches after a few warmup requests, the memory pass is separate because
+# tracemalloc slows everything down
+# Results are saved as a JSON baseline and later runs are compared against it, see `flask benchmark-routes`
+# Routes that destroy the data the suite relies on (logout, deletes, remove enrollment) are not driven
+
+SKIPPED_ROUTES = {
+    'static': 'static files',
+    'main.logout': 'ends the benchmark session',
+    'main.delete_user': 'deletes data',
+    'main.delete_program': 'deletes data',
+    'main.remove_enrollment': 'deletes data',
+}
+MEMORY_ITERATIONS = 3
+
+# p95 and peak memory may grow by this share before a route counts as regressed,
+# and by at least these absolute amounts (to ignore noise on very fast routes)
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_MS = 2.0
+MIN_REGRESSION_KB = 256
+
+
+def benchmark_samples():
+    """Ids the scenarios use: the client with the most enrollments, a program, an admin and some clients"""
+    admin_id = db.session.scalar(select(User.id).where(User.role == 'admin').order_by(User.id).limit(1))
+    client_id = db.session.scalar(
+        select(Enrollment.client_id).group_by(Enrollment.client_id).order_by(func.count().desc()).limit(1)
+    ) or db.session.scalar(select(Client.id).limit(1))
+    return {
+        'admin_id': admin_id,
+        'client_id': client_id,
+        'client_ids': db.session.scalars(select(Client.id).order_by(Client.id.desc()).limit(200)).all(),
+        'program_id': db.session.scalar(select(Program.id).order_by(Program.id).limit(1)),
+        'program_ids': db.session.scalars(select(Program.id).order_by(Program.id)).all(),
+        'token': str(int(time.time())),
+    }
+
+
+def route_scenarios(sample):
+    """
+    [(name, endpoint, request)] where request(i) returns (method, url, options for the test client)
+    An endpoint can have several scenarios (e.g. GET and POST); anonymous ones run without the admin session
+    """
+    client_id, program_id, token = sample['client_id'], sample['program_id'], sample['token']
+    client_ids, program_ids = sample['client_ids'], sample['program_ids']
+
+    def get(url):
+        return lambda i: ('GET', url, {})
+
+    def import_csv(i):
+        rows = ''.join(f'Bench,Import{token}{i}{n},1990-01-01,female,0700{n:06d},bench{token}{i}{n}@example.com\n'
+                       for n in range(10))
+        csv_file = (io.BytesIO(('first_name,last_name,date_of_birth,gender,phone,email\n' + rows).encode()),
+                    'clients.csv')
+        return 'POST', '/admin/clients/import', {'data': {'file': csv_file}, 'content_type': 'multipart/form-data'}
+
+    program_form = {'program_name': 'TB', 'description': 'A TB program',
+                    'start_date': (date.today() + timedelta(days=30)).isoformat(), 'duration': '10'}
+
+    return [
+        ('index', 'main.index', get('/')),
+        ('login GET', 'main.login', lambda i: ('GET', '/login', {'anonymous': True})),
+        ('login POST', 'main.login', lambda i: ('POST', '/login', {
+            'anonymous': True, 'data': {'username': 'admin', 'password': 'admin123'}})),
+        ('create program', 'main.create_program', get('/create-program')),
+        ('add program', 'main.add_program', lambda i: ('POST', '/add-program', {
+            'data': {**program_form, 'program_name': f'Bench {token} {i}'}})),
+        ('register client GET', 'main.register_client', get('/register-client')),
+        ('register client POST', 'main.register_client', lambda i: ('POST', '/register-client', {'data': {
+            'first_name': 'Bench', 'last_name': f'Client{token}{i}', 'date_of_birth': '1990-01-01',
+            'gender': 'female', 'phone': '0700000000', 'email': f'bench{token}{i}@example.com'}})),
+        ('enroll client page', 'main.enroll_client', get('/enroll-client')),
+        ('search client page', 'main.search_client', get('/search-client')),
+        ('client profile', 'main.client_profile', get(f'/client/{client_id}')),
+        ('view clients', 'main.view_clients', get('/admin/clients')),
+        ('import clients', 'main.import_clients_upload', import_csv),
+        ('export clients', 'main.export_data', get('/admin/export/clients?q=wanjiru')),
+        ('edit client GET', 'main.edit_client', get(f'/edit-client/{client_id}')),
+        ('manage users', 'main.manage_users', get('/manage-users')),
+        ('add user', 'main.add_user', lambda i: ('POST', '/add-user', {'data': {
+            'username': f'bench{token}{i}', 'email': f'bench{token}{i}@example.com',
+            'password': 'bench123', 'role': 'doctor', 'phone': '0700000000'}})),
+        ('view user', 'main.view_user', get(f'/view-user?user_id={sample["admin_id"]}')),
+        ('reports', 'main.reports', get('/reports')),
+        ('metrics', 'main.metrics', get('/metrics')),
+        ('edit program GET', 'main.edit_program', get(f'/edit-program/{program_id}')),
+        ('api search clients', 'api.search_clients', get('/api/clients/search?q=wan')),
+        ('api programs', 'api.get_programs', get('/api/programs')),
+        ('api client enrollments', 'api.get_client_enrollments', get(f'/api/clients/{client_id}/enrollments')),
+        ('api enroll client', 'api.enroll_client', lambda i: ('POST', f'/api/clients/{client_ids[i % len(client_ids)]}/enroll', {
+            'json': {'programIds': [program_ids[i % len(program_ids)]]}})),
+        ('api bulk enroll', 'api.bulk_enroll_clients', lambda i: ('POST', '/api/enrollments/bulk', {'json': {'items': [
+            {'clientId': client_ids[(i + n) % len(client_ids)], 'programId': program_ids[(i * 7 + n) % len(program_ids)]}
+            for n in range(50)]}})),
+        ('api trends', 'api.get_trends', get('/api/trends')),
+        ('api search clients paged', 'api.search_clients_api', get('/api/search-clients?q=a')),
+        ('api search clients by program', 'api.search_clients_api', get(f'/api/search-clients?program={program_id}')),
+        ('api client profile', 'api.get_client_profile_api', get(f'/api/client/{client_id}')),
+        ('api changes', 'api.get_changes', lambda i: ('GET', '/api/changes', {
+            'headers': {'Authorization': f'Bearer {sample["feed_token"]}'}})),
+    ]
+
+
+def _issue(http, anonymous_http, request):
+    method, url, options = request
+    options = dict(options)
+    target = anonymous_http if options.pop('anonymous', False) else http
+    response = target.open(url, method=method, **options)
+    response.get_data()  # streamed pages are rendered while the body is read
+    return response.status_code
+
+
+def run_route_benchmarks(app, iterations=20, warmup=2, only=None):
+    """Returns ({name: result}, [uncovered endpoints]) for the route scenarios"""
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+
+    app.config.update(WTF_CSRF_ENABLED=False, QUERY_BUDGET_MODE='off')
+    app.config['CHANGE_FEED_TOKEN'] = app.config.get('CHANGE_FEED_TOKEN') or secrets.token_urlsafe()
+    with app.app_context():
+        sample = benchmark_samples()
+    sample['feed_token'] = app.config['CHANGE_FEED_TOKEN']
+    scenarios = [s for s in route_scenarios(sample) if not only or s[0] in only or s[1] in only]
+
+    http, anonymous_http = app.test_client(), app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = str(sample['admin_id'])
+
+    results = {}
+    event.listen(Engine, 'before_cursor_execute', count_statement)
+    try:
+        for name, endpoint, request in scenarios:
+            for i in range(warmup):
+                _issue(http, anonymous_http, request(iterations + MEMORY_ITERATIONS + i))
+
+            latencies, counts, statuses = [], [], set()
+            for i in range(iterations):
+                before = statements[0]
+                started = time.perf_counter()
+                statuses.add(_issue(http, anonymous_http, request(i)))
+                latencies.append(time.perf_counter() - started)
+                counts.append(statements[0] - before)
+
+            tracemalloc.start()
+            for i in range(MEMORY_ITERATIONS):
+                _issue(http, anonymous_http, request(iterations + i))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {
+                'endpoint': endpoint,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'queries': sorted(counts)[len(counts) // 2],
+                'peak_kb': round(peak / 1024, 1),
+                'statuses': sorted(statuses),
+            }
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_statement)
+
+    covered = {endpoint for _, endpoint, _ in route_scenarios(sample)} | set(SKIPPED_ROUTES)
+    uncovered = sorted({rule.endpoint for rule in app.url_map.iter_rules()} - covered)
+    return results, uncovered
+
+
+def dataset_counts(app):
+    with app.app_context():
+        return {model.__tablename__: db.session.scalar(select(func.count()).select_from(model))
+                for model in (User, Client, Program, Enrollment, Appointment)}
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns a list of (name, message) for every route that got slower, ran more queries or used more memory"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get('routes', {}).get(name)
+        if base is None:
+            continue
+        if (current['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+                and current['p95_ms'] - base['p95_ms'] >= MIN_REGRESSION_MS):
+            regressions.append((name, f"p95 {base['p95_ms']}ms -> {current['p95_ms']}ms"))
+        if current['queries'] > base['queries']:
+            regressions.append((name, f"queries {base['queries']} -> {current['queries']}"))
+        if (current['peak_kb'] > base['peak_kb'] * (1 + tolerance)
+                and current['peak_kb'] - base['peak_kb'] >= MIN_REGRESSION_KB):
+            regressions.append((name, f"peak memory {base['peak_kb']}KB -> {current['peak_kb']}KB"))
+        if current['statuses'] != base['statuses']:
+            regressions.append((name, f"statuses {base['statuses']} -> {current['statuses']}"))
+    return regressions
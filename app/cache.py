@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# TTL cache
+# A small thread safe in-process cache where every entry expires `ttl` seconds after it was set
+# Each gunicorn worker has its own copy, so writers must call invalidate()/clear() after a commit
+# and readers must be fine with values that are at most `ttl` seconds old in the other workers
+class TTLCache:
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if self.maxsize and key not in self._data and len(self._data) >= self.maxsize:
+                self._evict()
+            self._data[key] = (value, expires_at)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        # Drop expired entries first, then the entry that expires soonest
+        now = time.monotonic()
+        for key in [k for k, (_, expires_at) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            del self._data[min(self._data, key=lambda k: self._data[k][1])]
+
+
+# LRU cache with memory accounting
+# Values are bytes (serialized responses) so their size is known exactly
+# The cache holds at most `max_entries` values and `max_bytes` bytes, evicting the least recently used first
+# `generation` moves on with every invalidate()/clear(): a caller reads it before loading a value and passes it
+# to set(), which drops the value if something was invalidated in the meantime (it may have been loaded stale)
+class LRUBytesCache:
+
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, body, etag, generation=None):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old[0])
+            self._data[key] = (body, etag)
+            self.current_bytes += size
+            while len(self._data) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, (evicted_body, _) = self._data.popitem(last=False)
+                self.current_bytes -= len(evicted_body)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from types import MappingProxyType
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from app.model import db, Program, CacheVersion
+from app.invalidation import invalidation_bus
+
+
+# Program catalog
+# The programs change rarely but are listed on several pages (create program, search client) and by /api/programs,
+# so each worker keeps an immutable snapshot of the whole table, tagged with the version it was loaded at
+#   - every flush that adds, changes or deletes a Program bumps the 'programs' row in cache_versions
+#     in the same transaction, so the version always matches the committed table
+#   - a worker reads that one row at most every PROGRAM_CATALOG_CHECK_SECONDS (default 1) and reloads the snapshot
+#     when the version moved; the worker that made the change drops its snapshot as soon as the commit succeeds
+#   - the invalidation bus (see app/invalidation.py) drops the snapshot as soon as a program change reaches
+#     the worker, the version check covers writes made without it
+#   - the snapshot is never changed in place, a reload builds a new one, so a request can keep using the one it got
+#   - the entries are plain named tuples, not ORM instances, so they can be shared between threads
+# /api/programs uses the version as its ETag
+
+PROGRAMS_VERSION = 'programs'
+DEFAULT_CHECK_SECONDS = 1.0
+
+ProgramEntry = namedtuple('ProgramEntry', ['id', 'name', 'description', 'start_date', 'duration'])
+
+
+class ProgramCatalog:
+    """The programs at one version, in id order"""
+
+    __slots__ = ('version', 'programs', 'by_id')
+
+    def __init__(self, version, programs):
+        self.version = version
+        self.programs = tuple(programs)
+        self.by_id = MappingProxyType({program.id: program for program in self.programs})
+
+    @property
+    def etag(self):
+        return f'programs-{self.version}'
+
+    def get(self, program_id):
+        return self.by_id.get(program_id)
+
+    def __iter__(self):
+        return iter(self.programs)
+
+    def __len__(self):
+        return len(self.programs)
+
+
+_catalog = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def catalog_version():
+    return db.session.scalar(select(CacheVersion.version).where(CacheVersion.name == PROGRAMS_VERSION)) or 0
+
+
+def load_program_catalog(version):
+    rows = db.session.execute(
+        select(Program.id, Program.name, Program.description, Program.start_date, Program.duration)
+        .order_by(Program.id)
+    ).all()
+    return ProgramCatalog(version, (ProgramEntry(*row) for row in rows))
+
+
+def get_program_catalog(fresh=False):
+    """
+    Returns this worker's program catalog snapshot
+    fresh=True always checks the version first, for writes that must not act on a deleted program
+    """
+    global _catalog, _checked_at
+    catalog = _catalog
+    now = time.monotonic()
+    interval = current_app.config.get('PROGRAM_CATALOG_CHECK_SECONDS', DEFAULT_CHECK_SECONDS)
+    if catalog is not None and not fresh and now - _checked_at < interval:
+        return catalog
+
+    version = catalog_version()
+    if catalog is None or catalog.version != version:
+        with _lock:
+            if _catalog is None or _catalog.version != version:
+                _catalog = load_program_catalog(version)
+            catalog = _catalog
+    _checked_at = now
+    return catalog
+
+
+def bump_catalog_version(session=None):
+    """Moves the programs version on in the session's transaction, for changes made without the ORM"""
+    session = session or db.session
+    statement = insert(CacheVersion).values(name=PROGRAMS_VERSION, version=1, updated_at=datetime.utcnow())
+    session.execute(statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': CacheVersion.version + 1, 'updated_at': statement.excluded.updated_at},
+    ))
+    session.info['program_catalog_changed'] = True
+
+
+def clear_program_catalog():
+    global _catalog
+    _catalog = None
+
+
+invalidation_bus.subscribe('program', lambda program_id: clear_program_catalog())
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_program_change(session, flush_context):
+    # Covers add_program, edit_program and delete_program, and any other ORM write to the programs
+    if session.info.get('program_catalog_changed'):
+        return
+    if any(isinstance(obj, Program) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        bump_catalog_version(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_after_commit(session):
+    if session.info.pop('program_catalog_changed', False):
+        clear_program_catalog()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('program_catalog_changed', None)
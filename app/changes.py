@@ -0,0 +1,157 @@
+from sqlalchemy import func, select, text
+from app.model import db, User, Client, Enrollment, Appointment, ChangeLog
+from app.catalog import get_program_catalog
+from app.statuses import status_name
+
+
+# Change feed
+# /api/changes lets the external profile site keep a mirror of the clients, enrollments and appointments
+# in sync without fetching every profile again
+#   - the change_log table gets a row for every insert, update and delete (written by triggers, so bulk inserts
+#     and imports are included), and the rows already in the database were logged when the table was created
+#   - enrollments and appointments show their program name and doctor username, so renaming or deleting a program
+#     or a user logs an upsert for each enrollment and appointment that shows it
+#   - a page is the next `limit` log rows after the cursor; a row changed several times in a page is sent once,
+#     with its current state, in the position of its last change
+#   - upserts carry the current fields of the row (the same fields as the public profile), deletes only the ids
+#   - the cursor is the seq of the last log row read, so a client that stores it can resume at any time;
+#     reading from no cursor replays the whole log, which is how a mirror is first filled
+# Loading a page runs at most four queries: the log rows, then the clients, enrollments and appointments on it
+# Program and status names come from the program catalog (which may check its version and reload, two more queries)
+# and the status registry
+
+ENTITIES = ('client', 'enrollment', 'appointment')
+UPSERT, DELETE = 'upsert', 'delete'
+
+DEFAULT_FEED_PAGE_SIZE = 500
+MAX_FEED_PAGE_SIZE = 2000
+CHANGE_QUERY_COUNT = 6
+
+
+def _load_clients(ids):
+    rows = db.session.execute(
+        select(Client.id, Client.full_name, Client.gender, Client.email, Client.phone, Client.registered_at)
+        .where(Client.id.in_(ids))
+    ).all()
+    return {row.id: {
+        'name': row.full_name,
+        'gender': row.gender,
+        'email': row.email,
+        'phone': row.phone,
+        'registered_at': row.registered_at.strftime('%Y-%m-%d') if row.registered_at else None,
+    } for row in rows}
+
+
+def _load_enrollments(ids):
+    catalog = get_program_catalog()
+    rows = db.session.execute(
+        select(Enrollment.id, Enrollment.client_id, Enrollment.program_id, Enrollment.status_id,
+               Enrollment.start_date, Enrollment.end_date)
+        .where(Enrollment.id.in_(ids))
+    ).all()
+    result = {}
+    for row in rows:
+        program = catalog.get(row.program_id)
+        result[row.id] = {
+            'client_id': row.client_id,
+            'program_id': row.program_id,
+            'program': program.name if program else None,
+            'status': status_name(row.status_id),
+            'start_date': row.start_date.strftime('%Y-%m-%d') if row.start_date else None,
+            'end_date': row.end_date.strftime('%Y-%m-%d') if row.end_date else None,
+        }
+    return result
+
+
+def _load_appointments(ids):
+    catalog = get_program_catalog()
+    rows = db.session.execute(
+        select(Appointment.id, Appointment.client_id, Appointment.program_id, Appointment.status_id,
+               Appointment.appointment_date, Appointment.doctor_id, User.username)
+        .outerjoin(User, User.id == Appointment.doctor_id)
+        .where(Appointment.id.in_(ids))
+    ).all()
+    result = {}
+    for row in rows:
+        program = catalog.get(row.program_id)
+        result[row.id] = {
+            'client_id': row.client_id,
+            'program_id': row.program_id,
+            'program': program.name if program else None,
+            'date': row.appointment_date.strftime('%Y-%m-%d') if row.appointment_date else None,
+            'status': status_name(row.status_id),
+            'doctor_id': row.doctor_id,
+            'doctor': row.username or 'N/A',
+        }
+    return result
+
+
+LOADERS = {'client': _load_clients, 'enrollment': _load_enrollments, 'appointment': _load_appointments}
+
+
+def read_changes(since_seq, limit):
+    """
+    Returns (changes, last_seq, has_more) for the log rows after since_seq
+    last_seq is the cursor for the next page (since_seq when nothing changed)
+    """
+    rows = db.session.execute(
+        select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.client_id, ChangeLog.op)
+        .where(ChangeLog.seq > since_seq)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], since_seq, False
+
+    # Only the last change of each row in the page counts, in the order of those last changes
+    latest = {}
+    for row in rows:
+        key = (row.entity, row.entity_id)
+        latest.pop(key, None)
+        latest[key] = row
+
+    # The page may hold the rows logged for a program rename, so make sure the names are the committed ones
+    get_program_catalog(fresh=True)
+    current = {}
+    for entity in ENTITIES:
+        ids = [entity_id for (e, entity_id), row in latest.items() if e == entity and row.op != DELETE]
+        current[entity] = LOADERS[entity](ids) if ids else {}
+
+    changes = []
+    for (entity, entity_id), row in latest.items():
+        data = current[entity].get(entity_id)
+        if data is None:
+            # Deleted, or deleted again after this page's last change to it
+            change = {'type': entity, 'id': entity_id, 'op': DELETE}
+            if entity != 'client':
+                change['client_id'] = row.client_id
+        else:
+            change = {'type': entity, 'id': entity_id, 'op': UPSERT, 'data': data}
+        changes.append(change)
+    return changes, rows[-1].seq, has_more
+
+
+def change_log_available():
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': ChangeLog.__tablename__}
+    ).first() is not None
+
+
+def log_rows_after(max_ids):
+    """
+    Appends an upsert for every row with an id above max_ids[table], for rows written with the triggers dropped
+    (see app/seed.py); max_ids is {'clients': id, 'enrollments': id, 'appointments': id}
+    """
+    for entity, model, client_column in [('client', Client, Client.id),
+                                         ('enrollment', Enrollment, Enrollment.client_id),
+                                         ('appointment', Appointment, Appointment.client_id)]:
+        db.session.execute(ChangeLog.__table__.insert().from_select(
+            ['entity', 'entity_id', 'client_id', 'op', 'changed_at'],
+            select(db.literal(entity), model.id, client_column, db.literal(UPSERT), func.current_timestamp())
+            .where(model.id > max_ids.get(model.__tablename__, 0))
+            .order_by(model.id)
+        ))
+    db.session.commit()
@@ -0,0 +1,454 @@
+import json
+import threading
+import time
+import click
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import OperationalError
+from app.model import db, User, Client, Program, Enrollment, Appointment, DailySnapshot, DailyProgramSnapshot
+from app.importer import import_clients, detect_format, FORMATS, DEFAULT_BATCH_SIZE
+from app.stats import invalidate_dashboard_stats
+from app.reports import refresh_rollups, rollups_available
+from app.snapshots import take_daily_snapshot, take_missing_snapshots
+from app.exporter import stream_export, EXPORTS, FORMATS as EXPORT_FORMATS
+from app.passwords import password_hasher
+from app.benchmarks import (percentile, run_contention_benchmark, run_route_benchmarks, compare_to_baseline, dataset_counts,
+                            DEFAULT_TOLERANCE, SKIPPED_ROUTES)
+from app.traffic import read_traffic, replay_traffic
+from app.statuses import StatusId
+from app.invalidation import invalidation_bus
+from app.seed import seed_dataset, DEFAULT_VOLUMES, DEFAULT_SEED, DEFAULT_BATCH_SIZE as SEED_BATCH_SIZE
+from werkzeug.security import check_password_hash
+
+
+# Hot queries
+# These are the lookups the busiest routes run on every request
+# Each one is (route, description, statement) and must be answered from an index
+# tests/test_query_plans.py fails the build when one of them does not, flask check-query-plans checks a live database
+def hot_queries():
+    now = datetime.utcnow()
+    return [
+        ('main.index', 'active enrollments count',
+            select(func.count()).select_from(Enrollment).where(Enrollment.status_id == StatusId.ENROLLED)),
+        ('main.index', 'active users count',
+            select(func.count()).select_from(User).where(User.last_login >= now - timedelta(days=7))),
+        ('main.index', 'admin users count',
+            select(func.count()).select_from(User).where(User.role == 'admin')),
+        ('main.index', 'new users count',
+            select(func.count()).select_from(User).where(User.created_at >= now - timedelta(days=1))),
+        ('main.login', 'user by username',
+            select(User).where(User.username == 'admin').limit(1)),
+        ('main.client_profile', 'client enrollments by status',
+            select(Enrollment).where(Enrollment.client_id == 1, Enrollment.status_id == StatusId.ENROLLED)),
+        ('main.client_profile', 'client appointments',
+            select(Appointment).where(Appointment.client_id == 1)),
+        ('api.enroll_client', 'active enrollment conflicts',
+            select(Enrollment).where(
+                Enrollment.client_id == 1,
+                Enrollment.program_id.in_([1, 2]),
+                Enrollment.status_id == StatusId.ENROLLED
+            )),
+        ('api.search_clients_api', 'clients by age band',
+            select(Client).where(Client.date_of_birth.between(now.date() - timedelta(days=365 * 30),
+                                                              now.date() - timedelta(days=365 * 20)))),
+        ('api.search_clients_api', 'clients by program',
+            select(Client).join(Client.enrollments).where(Enrollment.program_id == 1)),
+        ('main.create_program', 'program by id',
+            select(Program).where(Program.id == 1)),
+        ('api.get_trends', 'daily snapshots by range',
+            select(DailySnapshot).where(DailySnapshot.day >= now.date() - timedelta(days=365))),
+        ('api.get_trends', 'program snapshots by range',
+            select(DailyProgramSnapshot).where(DailyProgramSnapshot.program_id == 1,
+                                               DailyProgramSnapshot.day >= now.date() - timedelta(days=365))),
+        ('flask snapshot-daily', 'appointments per program for a day',
+            select(Appointment.program_id, func.count()).where(Appointment.appointment_date == now.date())
+            .group_by(Appointment.program_id)),
+        ('flask snapshot-daily', 'clients registered in a day',
+            select(func.count()).select_from(Client).where(Client.registered_at >= now - timedelta(days=1))),
+    ]
+
+
+def explain_query_plan(statement):
+    """
+    Runs EXPLAIN QUERY PLAN for a statement and returns the plan's detail lines
+    Bound values do not change SQLite's plan so every parameter is sent as NULL
+    """
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(None for _ in (compiled.positiontup or ()))
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+    return [row[-1] for row in rows]
+
+
+def full_table_scans(plan):
+    # "SCAN clients" is a full table scan, "SCAN users USING COVERING INDEX ..." only reads an index
+    return [detail for detail in plan if detail.startswith('SCAN ') and ' INDEX ' not in detail]
+
+
+"""   Check query plans @ flask check-query-plans
+This command explains every hot query against the configured database
+It fails (exit code 1) if any of them comes back as a full table scan
+"""
+@click.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print the full plan of every query.')
+def check_query_plans(verbose):
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Query plans can only be checked on SQLite.')
+
+    failures = 0
+    for route, description, statement in hot_queries():
+        plan = explain_query_plan(statement)
+        scans = full_table_scans(plan)
+        failures += bool(scans)
+
+        click.echo(f"{'FAIL' if scans else 'ok  '} {route}: {description}")
+        for detail in (plan if verbose else scans):
+            click.echo(f"       {detail}")
+
+    if failures:
+        raise click.ClickException(f'{failures} hot quer{"y" if failures == 1 else "ies"} ran a full table scan.')
+
+
+"""   Check GET writes @ flask check-get-writes
+This command checks that the writes a GET view can make go to the writer engine while its reads use
+the read-only one (see app/database.py): a flush, an ORM bulk update and the cache_changes rows written on commit
+Every write is rolled back, nothing in the database changes
+"""
+@click.command('check-get-writes')
+def check_get_writes():
+    app = current_app._get_current_object()
+    reader = app.extensions.get('db_reader')
+    client = db.session.scalars(select(Client).order_by(Client.id).limit(1)).first()
+    db.session.remove()
+    if reader is None or client is None:
+        raise click.ClickException('The check needs read routing (DB_READ_ROUTING) and at least one client.')
+
+    def flush(session):
+        session.get(Client, client.id).full_name += ' '
+        session.flush()
+
+    def bulk_update(session):
+        session.execute(update(Client), [{'id': client.id, 'full_name': client.full_name}])
+
+    def cache_changes(session):
+        if not invalidation_bus.enabled:
+            return 'skip'
+        invalidation_bus.publish('client', client.id, session=session)
+        invalidation_bus.write_changes(session)
+
+    failures = 0
+    with app.test_request_context(app.url_map.bind('localhost').build('main.index'), method='GET'):
+        if db.session.get_bind(clause=select(Client.id)) is not reader:
+            failures += 1
+            click.echo('FAIL select: not sent to the read-only engine')
+        for name, write in [('flush', flush), ('bulk update', bulk_update), ('cache changes', cache_changes)]:
+            try:
+                result = write(db.session)
+                click.echo(f"{result or 'ok  '} {name}")
+            except OperationalError as e:
+                failures += 1
+                click.echo(f'FAIL {name}: {e.orig}')
+            finally:
+                db.session.rollback()
+                db.session.info.pop('cache_changes', None)
+        db.session.remove()
+
+    if failures:
+        raise click.ClickException(f'{failures} check{"" if failures == 1 else "s"} failed.')
+
+
+"""   Import clients @ flask import-clients <path>
+This command imports clients from a CSV or JSONL file (use - for stdin)
+Records are validated like the client registration form and inserted in batches
+Rejected records are listed at the end, and can be written to a JSONL file with --rejects
+"""
+@click.command('import-clients')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='File format, detected from the extension by default.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Clients inserted per transaction.')
+@click.option('--registered-by', help='Username recorded as registering the clients (defaults to the first admin).')
+@click.option('--rejects', type=click.File('w'), help='Write rejected records and their errors to this JSONL file.')
+def import_clients_command(path, fmt, batch_size, registered_by, rejects):
+    if registered_by:
+        user = User.query.filter_by(username=registered_by).first()
+    else:
+        user = User.query.filter_by(role='admin').order_by(User.id).first()
+    if user is None:
+        raise click.ClickException('No user found to record as registering the clients.')
+
+    def on_reject(line_number, record, errors):
+        if rejects:
+            rejects.write(json.dumps({'line': line_number, 'record': record, 'errors': errors}) + '\n')
+
+    fmt = fmt or detect_format(path)
+    if path == '-':
+        result = import_clients(click.get_text_stream('stdin'), fmt, registered_by=user.id,
+                                batch_size=batch_size, on_reject=on_reject)
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            result = import_clients(stream, fmt, registered_by=user.id,
+                                    batch_size=batch_size, on_reject=on_reject)
+    invalidate_dashboard_stats()
+
+    for rejection in result['rejections']:
+        click.echo(f"line {rejection['line']}: {rejection['errors']}")
+    click.echo(f"Imported {result['imported']} clients, rejected {result['rejected']}.")
+
+
+"""   Export data @ flask export <entity>
+This command streams clients, enrollments or appointments to a file (or stdout) as CSV or NDJSON
+The rows can be filtered like the client search and the output gzip compressed
+"""
+@click.command('export')
+@click.argument('entity', type=click.Choice(list(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True)
+@click.option('--gzip', 'gzip', is_flag=True, help='Gzip compress the output.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Output file, stdout by default.')
+@click.option('-q', 'search_term', default='', help='Only clients whose name, phone or email match.')
+@click.option('--program', 'program_id', default='', help='Only clients enrolled in this program id.')
+@click.option('--age', default='', help='Only clients in this age band, e.g. 19-30.')
+def export_command(entity, fmt, gzip, output, search_term, program_id, age):
+    for chunk in stream_export(entity, fmt=fmt, gzip=gzip,
+                               search_term=search_term, program_id=program_id, age=age):
+        output.write(chunk)
+
+
+"""   Refresh reports @ flask refresh-reports
+The report rollups are kept up to date by triggers, this command rebuilds them from scratch
+Use it after loading data with the triggers disabled or on a database that is not SQLite
+"""
+@click.command('refresh-reports')
+def refresh_reports_command():
+    if not rollups_available():
+        raise click.ClickException('The report rollup tables do not exist, run flask db upgrade first.')
+    refresh_rollups()
+    click.echo('Report rollups rebuilt.')
+
+
+"""   Daily snapshot @ flask snapshot-daily
+This command writes the daily snapshot rows used for the dashboard trends
+It is meant to run nightly (e.g. from cron, see app/snapshots.py) and can be re-run, the day's rows are replaced
+Without --date it also snapshots every day missed since the last snapshot, so /api/trends has no gaps
+"""
+@click.command('snapshot-daily')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), help='Day to snapshot, today by default.')
+def snapshot_daily_command(day):
+    if day:
+        days = [take_daily_snapshot(day.date())]
+    else:
+        days = take_missing_snapshots()
+    if len(days) > 1:
+        click.echo(f'Backfilled {len(days) - 1} missed day{"" if len(days) == 2 else "s"} from {days[0].isoformat()}.')
+    click.echo(f'Snapshot written for {days[-1].isoformat()}.')
+
+
+"""   Seed dataset @ flask seed-dataset
+This command adds a generated dataset (programs, doctors, clients, enrollments, appointments) for benchmarks
+The same --seed always generates the same rows (see app/seed.py)
+Point DATABASE_URL at a scratch database and run flask db upgrade first, the rows are added to what is there
+"""
+@click.command('seed-dataset')
+@click.option('--programs', default=DEFAULT_VOLUMES['programs'], show_default=True)
+@click.option('--doctors', default=DEFAULT_VOLUMES['doctors'], show_default=True)
+@click.option('--clients', default=DEFAULT_VOLUMES['clients'], show_default=True)
+@click.option('--enrollments', default=DEFAULT_VOLUMES['enrollments'], show_default=True)
+@click.option('--appointments', default=DEFAULT_VOLUMES['appointments'], show_default=True)
+@click.option('--seed', default=DEFAULT_SEED, show_default=True, help='Random seed, the same seed gives the same data.')
+@click.option('--batch-size', default=SEED_BATCH_SIZE, show_default=True, help='Rows inserted per transaction.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def seed_dataset_command(programs, doctors, clients, enrollments, appointments, seed, batch_size, yes):
+    if not yes:
+        click.confirm(f'Add {clients} clients, {enrollments} enrollments and {appointments} appointments '
+                      f'to {db.engine.url}?', abort=True)
+
+    def progress(table, rows, seconds):
+        if rows is None:
+            click.echo(f'{table} rebuilt in {seconds:.1f}s')
+        else:
+            click.echo(f'{table:<13}{rows:>10} rows in {seconds:6.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)')
+
+    started = time.perf_counter()
+    seed_dataset({'programs': programs, 'doctors': doctors, 'clients': clients,
+                  'enrollments': enrollments, 'appointments': appointments},
+                 seed=seed, batch_size=batch_size, progress=progress)
+    invalidate_dashboard_stats()
+    click.echo(f'Seeded in {time.perf_counter() - started:.1f}s.')
+
+
+def run_login_benchmark(verify, concurrency, logins, password_hash):
+    """
+    Runs `logins` password checks from `concurrency` threads (the login requests)
+    while a probe thread measures how long a small piece of other work (an api request) takes
+    Returns (logins per second, p95 login seconds, p95 probe seconds)
+    """
+    login_times, probe_times = [], []
+    done = threading.Event()
+
+    def login(_):
+        started = time.perf_counter()
+        verify(password_hash, 'benchmark-password')
+        login_times.append(time.perf_counter() - started)
+
+    def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            sum(i * i for i in range(20000))
+            probe_times.append(time.perf_counter() - started)
+            time.sleep(0.005)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+    return logins / elapsed, percentile(login_times, 95), percentile(probe_times, 95)
+
+
+"""   Benchmark logins @ flask benchmark-logins
+This command measures password checks per second and latency with several concurrent logins
+It compares checking without a limit with the bounded hashing of app/passwords.py (PASSWORD_HASH_CONCURRENCY)
+and reports how slow other work gets during the burst (probe p95)
+Nothing is written to the database
+"""
+@click.command('benchmark-logins')
+@click.option('--concurrency', default='1,4,16', show_default=True, help='Comma separated numbers of concurrent logins.')
+@click.option('--logins', default=32, show_default=True, help='Logins per run.')
+@click.option('--method', help='Hashing method to benchmark, PASSWORD_HASH_METHOD by default.')
+def benchmark_logins_command(concurrency, logins, method):
+    if method:
+        password_hasher.set_method(method)
+    password_hash = password_hasher.hash('benchmark-password')
+    click.echo(f'method {password_hasher.prefix}, at most {password_hasher.concurrency} hashing at once')
+    click.echo(f"{'mode':<10}{'threads':>8}{'logins/s':>10}{'login p95':>11}{'probe p95':>11}")
+
+    modes = [('unbounded', check_password_hash), ('bounded', password_hasher.verify)]
+    for threads in [int(n) for n in concurrency.split(',')]:
+        for mode, verify in modes:
+            rate, login_p95, probe_p95 = run_login_benchmark(verify, threads, logins, password_hash)
+            click.echo(f'{mode:<10}{threads:>8}{rate:>10.1f}{login_p95 * 1000:>9.0f}ms{probe_p95 * 1000:>9.1f}ms')
+
+
+"""   Benchmark contention @ flask benchmark-contention
+This command runs writer and reader processes against a copy of the database
+with SQLite's default settings and with the engine profile from app/database.py (see app/benchmarks.py)
+"""
+@click.command('benchmark-contention')
+@click.option('--writers', default=2, show_default=True, help='Writer processes.')
+@click.option('--readers', default=4, show_default=True, help='Reader processes.')
+@click.option('--seconds', default=5, show_default=True, help='Duration of each run.')
+def benchmark_contention_command(writers, readers, seconds):
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('The contention benchmark only runs on SQLite.')
+    results = run_contention_benchmark(db.engine.url.database, writers=writers, readers=readers, seconds=seconds)
+
+    click.echo(f"{'profile':<9}{'writes/s':>10}{'write p95':>11}{'locked':>8}{'reads/s':>10}{'read p95':>10}{'locked':>8}")
+    for profile, r in results.items():
+        click.echo(f"{profile:<9}{r['writes'] / seconds:>10.0f}{r['write_p95'] * 1000:>9.1f}ms{r['write_errors']:>8}"
+                   f"{r['reads'] / seconds:>10.0f}{r['read_p95'] * 1000:>8.1f}ms{r['read_errors']:>8}")
+
+
+"""   Benchmark routes @ flask benchmark-routes
+This command drives the main and api routes through the test client (see app/benchmarks.py)
+and prints latency percentiles, SQL statements and peak memory per route
+With --save the results become the baseline, otherwise they are compared with the baseline (if there is one)
+and the command fails when a route regressed
+Run it against a seeded copy of the database, the write routes add rows
+"""
+@click.command('benchmark-routes')
+@click.option('--iterations', default=20, show_default=True, help='Measured requests per route.')
+@click.option('--warmup', default=2, show_default=True, help='Unmeasured requests per route first.')
+@click.option('--baseline', 'baseline_path', default='benchmark-baseline.json', show_default=True,
+              type=click.Path(dir_okay=False), help='Baseline JSON file.')
+@click.option('--save', is_flag=True, help='Save the results as the new baseline.')
+@click.option('--tolerance', default=DEFAULT_TOLERANCE, show_default=True, help='Allowed p95/memory growth.')
+@click.option('--route', 'routes', multiple=True, help='Only these scenarios or endpoints (repeatable).')
+def benchmark_routes_command(iterations, warmup, baseline_path, save, tolerance, routes):
+    app = current_app._get_current_object()
+    results, uncovered = run_route_benchmarks(app, iterations=iterations, warmup=warmup, only=set(routes))
+
+    click.echo(f"{'route':<32}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'peak':>10}  status")
+    for name, r in results.items():
+        click.echo(f"{name:<32}{r['p50_ms']:>7.1f}ms{r['p95_ms']:>7.1f}ms{r['p99_ms']:>7.1f}ms"
+                   f"{r['queries']:>9}{r['peak_kb']:>8.0f}KB  {','.join(map(str, r['statuses']))}")
+    for endpoint in uncovered:
+        click.echo(f'not benchmarked: {endpoint}')
+    click.echo(f"skipped: {', '.join(sorted(SKIPPED_ROUTES))}")
+
+    if save:
+        with open(baseline_path, 'w') as f:
+            json.dump({'created_at': datetime.utcnow().isoformat(), 'iterations': iterations,
+                       'dataset': dataset_counts(app), 'routes': results}, f, indent=2)
+        click.echo(f'Baseline saved to {baseline_path}.')
+        return
+
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        click.echo(f'No baseline at {baseline_path}, run with --save to create one.')
+        return
+
+    # The write scenarios add a few rows every run, so only a real change in volume is reported
+    counts, recorded = dataset_counts(app), baseline.get('dataset', {})
+    if any(abs(counts[table] - recorded.get(table, 0)) > max(100, counts[table] // 100) for table in counts):
+        click.echo(f'Warning: the baseline was recorded on a different dataset ({recorded}, now {counts}).')
+    regressions = compare_to_baseline(results, baseline, tolerance=tolerance)
+    for name, message in regressions:
+        click.echo(f'REGRESSION {name}: {message}')
+    if regressions:
+        raise click.ClickException(f'{len(regressions)} regression{"" if len(regressions) == 1 else "s"} '
+                                   f'against {baseline_path}.')
+    click.echo(f'No regressions against {baseline_path}.')
+
+
+"""   Replay traffic @ flask replay-traffic
+This command replays a log recorded with TRAFFIC_LOG (see app/traffic.py) and prints throughput,
+latency percentiles and error rates per endpoint
+By default the requests go through the test client in this process; with --target they are sent to a running
+server instead, e.g. a local `gunicorn -w 4 --threads 4 run:app` started with the same DATABASE_URL,
+so worker and thread counts can be compared on the same traffic mix
+Replay against a copy of the database, the recorded writes are sent again
+Change feed requests carry --feed-token, CHANGE_FEED_TOKEN by default, which must be the token the target expects
+"""
+@click.command('replay-traffic')
+@click.argument('log_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--concurrency', default=8, show_default=True, help='Requests in flight at once.')
+@click.option('--speedup', default=1.0, show_default=True, help='Replay speed factor, 0 sends as fast as possible.')
+@click.option('--target', help='Base url of a running server, e.g. http://127.0.0.1:8000.')
+@click.option('--limit', type=int, help='Only the first N recorded requests.')
+@click.option('--feed-token', help="The target's change feed token, CHANGE_FEED_TOKEN by default.")
+def replay_traffic_command(log_path, concurrency, speedup, target, limit, feed_token):
+    records = read_traffic(log_path, limit)
+    if not records:
+        raise click.ClickException(f'No requests recorded in {log_path}.')
+
+    app = current_app._get_current_object()
+    summary, endpoints = replay_traffic(app, records, concurrency=concurrency, speedup=speedup, target_url=target,
+                                        feed_token=feed_token)
+
+    click.echo(f"{'endpoint':<36}{'requests':>9}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'5xx':>6}{'4xx':>6}")
+    for endpoint, r in endpoints.items():
+        click.echo(f"{endpoint:<36}{r['requests']:>9}{r['per_second']:>9.1f}{r['p50_ms']:>7.1f}ms"
+                   f"{r['p95_ms']:>7.1f}ms{r['p99_ms']:>7.1f}ms{r['errors']:>6}{r['client_errors']:>6}")
+    error_rate = summary['errors'] / summary['requests'] if summary['requests'] else 0.0
+    click.echo(f"{summary['requests']} requests in {summary['seconds']}s: {summary['per_second']} req/s, "
+               f"{error_rate:.1%} errors ({target or 'test client'}, concurrency {concurrency}, speedup {speedup})")
+
+
+def register_commands(app):
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(check_get_writes)
+    app.cli.add_command(import_clients_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(refresh_reports_command)
+    app.cli.add_command(snapshot_daily_command)
+    app.cli.add_command(seed_dataset_command)
+    app.cli.add_command(benchmark_logins_command)
+    app.cli.add_command(benchmark_contention_command)
+    app.cli.add_command(benchmark_routes_command)
+    app.cli.add_command(replay_traffic_command)
@@ -0,0 +1,165 @@
+import os
+import re
+from urllib.parse import quote
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import SelectBase
+
+
+# Database engine profile
+# The engine is configured from environment variables so each deployment can be tuned without code changes
+#   DATABASE_URL           database url (default sqlite:///clients.db in the instance folder)
+#   SQLITE_JOURNAL_MODE    WAL lets readers run while a writer commits (default WAL)
+#   SQLITE_SYNCHRONOUS     NORMAL only syncs at checkpoints, which is safe with WAL (default NORMAL)
+#   SQLITE_BUSY_TIMEOUT    milliseconds to wait for a lock before "database is locked" (default 5000)
+#   SQLITE_CACHE_SIZE_KB   page cache per connection (default: the database size, between 8MB and 64MB)
+#   SQLITE_MMAP_SIZE       bytes of the file to memory map (default: twice the database size, at least 64MB)
+#   SQLITE_TEMP_STORE      where temp tables and sort spills go (default MEMORY)
+#   DB_POOL_SIZE           connections kept per worker process (default GUNICORN_THREADS + 1, the +1 is
+#                          for the last_login flusher thread)
+#   DB_MAX_OVERFLOW        extra connections allowed under load (default 2)
+#   DB_POOL_TIMEOUT        seconds to wait for a free connection (default 10)
+#   DB_READ_ROUTING        0 turns off the read-only connections described below (default 1)
+# Setting a SQLITE_* variable to an empty string leaves that pragma at SQLite's default
+# The pragmas are applied to every new connection, gunicorn workers each build their own pool after forking
+#
+# Read routing
+# GET and HEAD requests to the main and api blueprints read through a second pool of read-only connections
+# (opened with mode=ro and PRAGMA query_only), so they never take a write lock or queue behind a long write
+# such as a client import; with WAL they see every transaction committed before their query starts
+# Only SELECT statements (and text() that starts with SELECT) go to the reader, anything else - a flush,
+# an insert/update/delete, an ORM bulk write, which gets here without a statement - goes to the writer engine,
+# so a GET view that commits keeps working; a view that has to read its own writes can call use_writer()
+
+DEFAULT_DATABASE_URL = 'sqlite:///clients.db'
+
+MIN_CACHE_SIZE_KB = 8 * 1024
+MAX_CACHE_SIZE_KB = 64 * 1024
+MIN_MMAP_SIZE = 64 * 1024 * 1024
+
+
+def database_url(environ=os.environ):
+    return environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+
+
+def sqlite_pragmas(db_path=None, environ=os.environ):
+    """
+    Returns the [(pragma, value)] to run on every new SQLite connection
+    The cache and mmap defaults are sized from the database file when it exists
+    """
+    db_size = os.path.getsize(db_path) if db_path and os.path.exists(db_path) else 0
+    defaults = {
+        'SQLITE_JOURNAL_MODE': 'WAL',
+        'SQLITE_SYNCHRONOUS': 'NORMAL',
+        'SQLITE_BUSY_TIMEOUT': '5000',
+        'SQLITE_CACHE_SIZE_KB': str(min(max(db_size // 1024, MIN_CACHE_SIZE_KB), MAX_CACHE_SIZE_KB)),
+        'SQLITE_MMAP_SIZE': str(max(db_size * 2, MIN_MMAP_SIZE)),
+        'SQLITE_TEMP_STORE': 'MEMORY',
+    }
+    pragmas = []
+    for env_name, pragma in [
+        ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+        ('SQLITE_SYNCHRONOUS', 'synchronous'),
+        ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+        ('SQLITE_CACHE_SIZE_KB', 'cache_size'),
+        ('SQLITE_MMAP_SIZE', 'mmap_size'),
+        ('SQLITE_TEMP_STORE', 'temp_store'),
+    ]:
+        value = environ.get(env_name, defaults[env_name]).strip()
+        if not value:
+            continue
+        if pragma == 'cache_size':
+            value = f'-{int(value)}'  # a negative cache_size is in KiB rather than pages
+        pragmas.append((pragma, value))
+    return pragmas
+
+
+def pool_options(environ=os.environ):
+    threads = int(environ.get('GUNICORN_THREADS', 1))
+    return {
+        'pool_size': int(environ.get('DB_POOL_SIZE', threads + 1)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 2)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+
+
+READ_METHODS = ('GET', 'HEAD')
+READ_BLUEPRINTS = ('main', 'api')
+READ_SQL = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+
+def install_pragmas(engine, pragmas):
+    """Runs the pragmas on every connection the engine opens"""
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas:
+                cursor.execute(f'PRAGMA {pragma}={value}')
+        finally:
+            cursor.close()
+
+    return engine
+
+
+class RoutingSession(Session):
+    """Session that sends the reads of GET requests to the read-only engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and is_read_statement(clause):
+            reader = _request_reader()
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def is_read_statement(clause):
+    """True only for statements that cannot write, None (no statement) counts as a write"""
+    if isinstance(clause, SelectBase):
+        return True
+    return isinstance(clause, TextClause) and READ_SQL.match(clause.text) is not None
+
+
+def _request_reader():
+    if not has_request_context() or g.get('db_use_writer'):
+        return None
+    if request.method not in READ_METHODS or request.blueprint not in READ_BLUEPRINTS:
+        return None
+    return current_app.extensions.get('db_reader')
+
+
+def use_writer():
+    """Sends the rest of this request's queries to the writer engine"""
+    g.db_use_writer = True
+
+
+def create_reader_engine(db_path, environ=os.environ):
+    pragmas = [(pragma, value) for pragma, value in sqlite_pragmas(db_path, environ)
+               if pragma not in ('journal_mode', 'synchronous')]
+    engine = create_engine(f'sqlite:///file:{quote(db_path)}?mode=ro&uri=true', **pool_options(environ))
+    return install_pragmas(engine, pragmas + [('query_only', '1')])
+
+
+def configure_database(app, environ=os.environ):
+    """Sets the database url and pool options, call before db.init_app(app)"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url(environ)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update(pool_options(environ))
+
+
+def init_database_engine(app, db, environ=os.environ):
+    """Installs the SQLite pragmas on the app's engine and creates the read-only engine, call after db.init_app(app)"""
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            install_pragmas(engine, sqlite_pragmas(engine.url.database, environ))
+            if environ.get('DB_READ_ROUTING', '1') != '0':
+                # Open the writer first so the file exists and is in WAL mode before any read-only connection,
+                # then close it again so gunicorn workers do not inherit the connection when they fork
+                engine.connect().close()
+                engine.dispose()
+                app.extensions['db_reader'] = create_reader_engine(engine.url.database, environ)
+    return engine
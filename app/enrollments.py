@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+from sqlalchemy import insert, select
+from app.model import db, Client, Enrollment
+from app.catalog import get_program_catalog
+from app.invalidation import invalidation_bus
+from app.statuses import StatusId
+
+
+# Bulk enrollment
+# Enrolls many (client, program) pairs in one transaction with a fixed number of queries:
+#   1. the programs, from the program catalog (one version check, see app/catalog.py)
+#   2. the clients, with one IN query
+#   3. the active enrollments that would conflict, with one IN query
+#   4. one executemany INSERT for every accepted pair
+# Every item gets its own result so the caller can see which pairs were skipped and why
+
+MAX_BULK_ENROLLMENT_ITEMS = 5000
+
+# Per item results
+ENROLLED = 'enrolled'
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+CLIENT_NOT_FOUND = 'client_not_found'
+PROGRAM_NOT_FOUND = 'program_not_found'
+ALREADY_ENROLLED = 'already_enrolled'
+
+
+def _parse_pair(item):
+    if not isinstance(item, dict):
+        return None
+    try:
+        return int(item['clientId']), int(item['programId'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def bulk_enroll(items):
+    """
+    Takes a list of {'clientId': .., 'programId': ..} items
+    Returns (results, enrolled_client_ids) where results has one entry per item, in order
+    The caller is responsible for committing the session
+    """
+    pairs = [_parse_pair(item) for item in items]
+    valid_pairs = {pair for pair in pairs if pair is not None}
+    client_ids = {client_id for client_id, _ in valid_pairs}
+    program_ids = {program_id for _, program_id in valid_pairs}
+
+    programs = {}
+    existing_clients = set()
+    active = set()
+    if valid_pairs:
+        catalog = get_program_catalog(fresh=True)
+        programs = {program.id: program.duration for program in map(catalog.get, program_ids) if program is not None}
+
+        existing_clients = set(db.session.scalars(
+            select(Client.id).where(Client.id.in_(client_ids))
+        ))
+
+        # Filtering on both id lists can return a few extra pairs, they are matched exactly below
+        active = set(db.session.execute(
+            select(Enrollment.client_id, Enrollment.program_id).where(
+                Enrollment.client_id.in_(client_ids),
+                Enrollment.program_id.in_(program_ids),
+                Enrollment.status_id == StatusId.ENROLLED
+            )
+        ).all())
+
+    today = date.today()
+    results = []
+    rows = []
+    seen = set()
+    for item, pair in zip(items, pairs):
+        if pair is None:
+            results.append({'item': item, 'result': INVALID})
+            continue
+
+        client_id, program_id = pair
+        result = {'clientId': client_id, 'programId': program_id}
+        if pair in seen:
+            result['result'] = DUPLICATE
+        elif client_id not in existing_clients:
+            result['result'] = CLIENT_NOT_FOUND
+        elif program_id not in programs:
+            result['result'] = PROGRAM_NOT_FOUND
+        elif pair in active:
+            result['result'] = ALREADY_ENROLLED
+        else:
+            result['result'] = ENROLLED
+            rows.append({
+                'client_id': client_id,
+                'program_id': program_id,
+                'status_id': StatusId.ENROLLED,
+                'enrollment_date': today,
+                'start_date': today,
+                'end_date': today + timedelta(weeks=programs[program_id]),
+            })
+        seen.add(pair)
+        results.append(result)
+
+    if rows:
+        db.session.execute(insert(Enrollment), rows)
+        # Core inserts are not seen by the session, so the changes are published for the other workers
+        invalidation_bus.publish('enrollment')
+        for row in rows:
+            invalidation_bus.publish('client', row['client_id'])
+
+    return results, {row['client_id'] for row in rows}
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from sqlalchemy import select
+from app.model import db, Client, Enrollment, Appointment
+from app.search import client_search_filters
+
+
+# Streaming exports
+# Clients, enrollments and appointments are exported as CSV or NDJSON without loading the table into memory
+#   - only the exported columns are selected (no ORM objects)
+#   - rows are fetched from a server side cursor in partitions of EXPORT_BATCH_SIZE (yield_per)
+#   - every partition is encoded and handed on as one chunk, optionally gzip compressed
+# The rows can be filtered with the same criteria as the client search (name, program and age band)
+
+EXPORT_BATCH_SIZE = 1000
+FORMATS = ('csv', 'ndjson')
+
+# The columns of every export, in output order
+EXPORTS = {
+    'clients': (
+        Client.id, Client.full_name, Client.date_of_birth, Client.gender,
+        Client.phone, Client.email, Client.registered_at, Client.registered_by,
+    ),
+    'enrollments': (
+        Enrollment.id, Enrollment.client_id, Enrollment.program_id, Enrollment.status_id,
+        Enrollment.enrollment_date, Enrollment.start_date, Enrollment.end_date, Enrollment.notes,
+    ),
+    'appointments': (
+        Appointment.id, Appointment.client_id, Appointment.doctor_id, Appointment.program_id,
+        Appointment.appointment_date, Appointment.status_id, Appointment.notes,
+    ),
+}
+
+
+def export_statement(entity, search_term='', program_id='', age=''):
+    columns = EXPORTS[entity]
+    model = columns[0].class_
+    statement = select(*columns).order_by(model.id)
+
+    filters = client_search_filters(search_term, program_id, age)
+    if filters:
+        if model is Client:
+            statement = statement.where(*filters)
+        else:
+            statement = statement.where(model.client_id.in_(select(Client.id).where(*filters)))
+    return statement
+
+
+def export_header(entity):
+    return [column.key for column in EXPORTS[entity]]
+
+
+def iter_partitions(statement):
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(header, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(header, partitions):
+    for rows in partitions:
+        yield ''.join(
+            json.dumps({key: _json_value(value) for key, value in zip(header, row)}) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(entity, fmt='csv', gzip=False, search_term='', program_id='', age=''):
+    """
+    Returns a generator of encoded chunks for an export
+    The caller must keep an application context (and the database session) open while it is consumed
+    """
+    header = export_header(entity)
+    partitions = iter_partitions(export_statement(entity, search_term, program_id, age))
+    chunks = iter_ndjson(header, partitions) if fmt == 'ndjson' else iter_csv(header, partitions)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+def export_filename(entity, fmt='csv', gzip=False):
+    return f"{entity}-{date.today().isoformat()}.{fmt}{'.gz' if gzip else ''}"
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from wtforms import Form
 from wtforms import StringField, IntegerField, SubmitField, PasswordField, DateField, SelectField
 from wtforms.validators import DataRequired, Length, Email, Regexp
 
@@ -17,6 +18,19 @@ class ClientRegistrationForm(FlaskForm):
     submit = SubmitField("Register")
     
 
+# Client Import Form
+# This form validates one row of a bulk client import (flask import-clients / the admin upload)
+# It reuses the registration form's fields so imported clients follow exactly the same rules
+# It is a plain WTForms form, so it needs no request or CSRF token
+class ClientImportForm(Form):
+    first_name = ClientRegistrationForm.first_name
+    last_name = ClientRegistrationForm.last_name
+    date_of_birth = ClientRegistrationForm.date_of_birth
+    gender = ClientRegistrationForm.gender
+    phone = ClientRegistrationForm.phone
+    email = ClientRegistrationForm.email
+
+
 # Login Form
 # This form is used to login a user
 # The form validators used here are DataRequired and Length
@@ -0,0 +1,126 @@
+import csv
+import json
+from datetime import datetime
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+from app.forms import ClientImportForm
+from app.model import db, Client
+from app.invalidation import invalidation_bus
+
+
+# Bulk client import
+# Reads clients from a CSV or JSONL stream one record at a time, so memory use does not grow with the file
+# Every record is validated with ClientImportForm (the same rules as the registration form)
+# Valid records are inserted in batches, and every batch is committed in its own transaction
+# Rejected records are reported with their line number and errors
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 500
+
+# Only the first rejections are kept in the result, the rest are counted
+MAX_REPORTED_REJECTIONS = 100
+
+# Columns read from each record
+FIELDS = ('first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'email')
+
+
+def detect_format(filename):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_records(stream, fmt):
+    """
+    Yields (line_number, record) for every record in a text stream
+    A JSONL line that is not a JSON object is yielded as a string so it can be rejected
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, line
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def validate_record(record):
+    """
+    Returns (values, errors) for one record
+    values are the Client columns to insert, errors maps a field to its messages
+    """
+    if not isinstance(record, dict):
+        return None, {'record': ['Not a valid record']}
+
+    data = {field: str(record.get(field) or '').strip() for field in FIELDS}
+
+    # A single full_name column is accepted in place of first_name and last_name
+    if not data['first_name'] and not data['last_name'] and record.get('full_name'):
+        first, _, last = str(record['full_name']).strip().partition(' ')
+        data['first_name'], data['last_name'] = first, last.strip()
+
+    data['gender'] = data['gender'].lower()
+
+    form = ClientImportForm(formdata=MultiDict(data))
+    if not form.validate():
+        return None, form.errors
+
+    return {
+        'full_name': f"{form.first_name.data} {form.last_name.data}",
+        'date_of_birth': form.date_of_birth.data,
+        'gender': form.gender.data,
+        'phone': form.phone.data,
+        'email': form.email.data,
+    }, None
+
+
+def import_clients(stream, fmt, registered_by, batch_size=DEFAULT_BATCH_SIZE, on_reject=None):
+    """
+    Imports clients from a text stream and returns a summary
+        {'imported': n, 'rejected': n, 'rejections': [{'line': n, 'errors': {...}}, ...]}
+    on_reject(line_number, record, errors) is called for every rejected record
+    """
+    imported = 0
+    rejected = 0
+    rejections = []
+    batch = []
+
+    def flush():
+        nonlocal imported
+        if batch:
+            db.session.execute(insert(Client), batch)
+            invalidation_bus.publish('dashboard')  # new clients have no cached profile, only the counts change
+            db.session.commit()
+            imported += len(batch)
+            batch.clear()
+
+    try:
+        for line_number, record in iter_records(stream, fmt):
+            values, errors = validate_record(record)
+            if errors:
+                rejected += 1
+                if len(rejections) < MAX_REPORTED_REJECTIONS:
+                    rejections.append({'line': line_number, 'errors': errors})
+                if on_reject:
+                    on_reject(line_number, record, errors)
+                continue
+
+            values['registered_by'] = registered_by
+            values['registered_at'] = datetime.utcnow()
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {'imported': imported, 'rejected': rejected, 'rejections': rejections}
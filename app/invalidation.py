@@ -0,0 +1,208 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+from app.model import db, User, Client, Program, Enrollment, Appointment, CacheChange
+
+
+# Cross-worker cache invalidation
+# Every gunicorn worker keeps its own caches (logged in users, dashboard stats, client profiles, program catalog),
+# so a write served by one worker has to reach the caches of the others
+#   - changes to users, clients, enrollments, appointments and programs made through the ORM are collected on flush,
+#     other writes call invalidation_bus.publish(entity, id); they are written to the cache_changes table
+#     in the same transaction as the change itself, so a rolled back write publishes nothing
+#   - after the commit the worker that made the change applies it to its own caches straight away
+#   - before each request the other workers run PRAGMA data_version on a connection of their own, which only
+#     changes when another connection committed something; only then do they read the cache_changes rows
+#     after the last seq they applied and evict the affected keys
+#   - the log keeps the last INVALIDATION_LOG_SIZE (default 10000) changes, a worker that has fallen further behind
+#     clears its caches entirely
+#   - INVALIDATION_POLL_SECONDS (default 0, every request) spaces the polls out on busy workers
+# Caches register what to evict with invalidation_bus.subscribe(entity, handler), the handler gets the entity id,
+# or None when every entity of that type may have changed
+# The TTLs of the caches stay as a backstop, for writes made outside the app (e.g. with the sqlite3 shell)
+
+DEFAULT_POLL_SECONDS = 0
+DEFAULT_LOG_SIZE = 10_000
+
+invalidation_logger = logging.getLogger('app.invalidation')
+
+
+def changes_for(obj):
+    """The (entity, id) pairs a change to an ORM instance invalidates"""
+    if isinstance(obj, User):
+        return [('user', obj.id)]
+    if isinstance(obj, Client):
+        return [('client', obj.id)]
+    if isinstance(obj, Enrollment):
+        return [('enrollment', obj.id), ('client', obj.client_id)]
+    if isinstance(obj, Appointment):
+        return [('client', obj.client_id)]
+    if isinstance(obj, Program):
+        return [('program', obj.id)]
+    return []
+
+
+class InvalidationBus:
+
+    def __init__(self):
+        self.enabled = False
+        self.poll_seconds = DEFAULT_POLL_SECONDS
+        self.log_size = DEFAULT_LOG_SIZE
+        self._handlers = {}  # entity -> [handler]
+        self._lock = threading.Lock()
+        self._db_path = None
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._last_seq = None
+        self._polled_at = 0.0
+
+    def init_app(self, app):
+        self.poll_seconds = app.config.get('INVALIDATION_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+        self.log_size = app.config.get('INVALIDATION_LOG_SIZE', DEFAULT_LOG_SIZE)
+        with app.app_context():
+            engine = db.engine
+            if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+                return
+            exists = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': CacheChange.__tablename__}
+            ).first()
+            db.session.remove()
+            if exists is None:
+                invalidation_logger.warning('No %s table (run flask db upgrade), caches are not shared between workers',
+                                            CacheChange.__tablename__)
+                return
+            self._db_path = engine.url.database
+        self.enabled = True
+        app.before_request(self._poll_before_request)
+
+    def subscribe(self, entity, handler):
+        self._handlers.setdefault(entity, []).append(handler)
+
+    def publish(self, entity, entity_id=None, session=None):
+        """Records a change, it is written when the session commits"""
+        if self.enabled:
+            (session or db.session).info.setdefault('cache_changes', set()).add((entity, entity_id))
+
+    def write_changes(self, session):
+        """Inserts the changes collected in the session into cache_changes, runs before every commit"""
+        if not self.enabled:
+            return
+        # The commit flushes after this hook, so flush here to collect the pending ORM changes first
+        session.flush()
+        changes = session.info.get('cache_changes')
+        if not changes:
+            return
+        # Core statements on the table, an ORM bulk insert reaches Session.get_bind without a statement to route by
+        table = CacheChange.__table__
+        now = datetime.utcnow()
+        session.execute(table.insert(), [
+            {'entity': entity, 'entity_id': entity_id, 'changed_at': now} for entity, entity_id in changes
+        ])
+        session.execute(table.delete().where(
+            table.c.seq <= select(func.max(table.c.seq)).scalar_subquery() - self.log_size
+        ))
+
+    def apply(self, entity, entity_id):
+        for handler in self._handlers.get(entity, ()):
+            try:
+                handler(entity_id)
+            except Exception:
+                invalidation_logger.exception('Invalidating %s %s failed', entity, entity_id)
+
+    def clear_all(self):
+        for entity in self._handlers:
+            self.apply(entity, None)
+
+    def _connection(self):
+        # A connection of this worker's own that never writes, so its data_version moves with every other commit
+        # A new worker process starts from the current end of the log
+        if self._pid != os.getpid():
+            self._conn = None
+            self._pid = os.getpid()
+            self._last_seq = None
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{quote(self._db_path)}?mode=ro', uri=True, check_same_thread=False)
+            self._data_version = None
+        return self._conn
+
+    def _poll_before_request(self):
+        self.poll()
+
+    def poll(self):
+        """Applies the changes other workers committed since the last poll, returns how many"""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        if self.poll_seconds and now - self._polled_at < self.poll_seconds:
+            return 0
+        # Another thread of this worker is already polling
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            self._polled_at = now
+            conn = self._connection()
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return 0
+            self._data_version = data_version
+
+            if self._last_seq is None:
+                # Anything committed before this worker started is already in what it loads
+                self._last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM cache_changes').fetchone()[0]
+                return 0
+            rows = conn.execute(
+                'SELECT seq, entity, entity_id FROM cache_changes WHERE seq > ? ORDER BY seq', (self._last_seq,)
+            ).fetchall()
+            if not rows:
+                return 0
+
+            # seq has no gaps, so a jump means the rows this worker missed were already deleted from the log
+            if rows[0][0] > self._last_seq + 1:
+                invalidation_logger.info('Missed %d cache changes, clearing every cache', rows[0][0] - self._last_seq - 1)
+                self.clear_all()
+            for entity, entity_id in dict.fromkeys((entity, entity_id) for _, entity, entity_id in rows):
+                self.apply(entity, entity_id)
+            self._last_seq = rows[-1][0]
+            return len(rows)
+        except sqlite3.Error as e:
+            invalidation_logger.warning('Polling cache changes failed: %s', e)
+            self._conn = None
+            return 0
+        finally:
+            self._lock.release()
+
+
+invalidation_bus = InvalidationBus()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    if not invalidation_bus.enabled:
+        return
+    changes = session.info.setdefault('cache_changes', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changes.update(changes_for(obj))
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_changes(session):
+    invalidation_bus.write_changes(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    for entity, entity_id in session.info.pop('cache_changes', ()):
+        invalidation_bus.apply(entity, entity_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('cache_changes', None)
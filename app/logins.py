@@ -0,0 +1,94 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import update
+from app.model import db, User
+
+
+# Write-behind last_login updates
+# A successful login used to commit users.last_login straight away, taking SQLite's write lock for every login
+# Logins now only record the timestamp in memory, and a background thread writes all pending timestamps
+# in one transaction (a single executemany UPDATE) every LAST_LOGIN_FLUSH_INTERVAL seconds and at shutdown
+# Readers that count recent logins use pending_logins() so they stay accurate before the flush
+# Setting LAST_LOGIN_FLUSH_INTERVAL to 0 writes the timestamp during the login request as before
+
+DEFAULT_FLUSH_INTERVAL = 5  # seconds
+
+
+class LastLoginBuffer:
+
+    def __init__(self):
+        self.app = None
+        self.interval = DEFAULT_FLUSH_INTERVAL
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LAST_LOGIN_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        atexit.register(self.flush)
+
+    def record(self, user_id, when=None):
+        when = when or datetime.utcnow()
+        if not self.interval:
+            db.session.execute(update(User).where(User.id == user_id).values(last_login=when))
+            db.session.commit()
+            return
+
+        with self._lock:
+            self._pending[user_id] = when
+        self._ensure_thread()
+
+    def pending_logins(self):
+        """Returns {user_id: last_login} for the logins that have not been written yet"""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Writes every pending timestamp in one transaction, returns how many users were updated"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+
+        try:
+            with self.app.app_context():
+                db.session.execute(
+                    update(User),
+                    [{'id': user_id, 'last_login': when} for user_id, when in pending.items()]
+                )
+                db.session.commit()
+        except Exception:
+            # Put the timestamps back (unless a newer login came in) so the next flush retries them
+            with self._lock:
+                for user_id, when in pending.items():
+                    if user_id not in self._pending or self._pending[user_id] < when:
+                        self._pending[user_id] = when
+            if self.app is not None:
+                self.app.logger.exception('Could not write last_login timestamps')
+            return 0
+        return len(pending)
+
+    def _ensure_thread(self):
+        # gunicorn forks workers after the app is created, threads do not survive a fork,
+        # so every process starts its own flusher the first time it records a login
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='last-login-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+last_login_buffer = LastLoginBuffer()
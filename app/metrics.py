@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from collections import deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Request metrics
+# Every request records its wall time, number of SQL statements, SQL time, response size and status
+# into in-memory histograms per endpoint, which are served in Prometheus text format at /metrics
+#   - every response gets a Server-Timing header (app and db time), visible in the browser's network tab
+#   - statements slower than SLOW_QUERY_MS (default 100) are logged to the 'app.slow_queries' logger
+#     and the last SLOW_QUERY_LOG_SIZE (default 100) are kept for recent_slow_queries()
+#   - streamed pages (stream_page, exports) are measured up to the first byte, the rendering that
+#     happens while streaming is not included
+# Each gunicorn worker keeps its own histograms, so a scrape shows the worker that answered it
+# (its pid is in the `worker` label)
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_SLOW_QUERY_LOG_SIZE = 100
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (512, 2048, 8192, 32768, 131072, 524288, 2097152)
+QUANTILES = (0.5, 0.95, 0.99)
+
+slow_query_logger = logging.getLogger('app.slow_queries')
+
+
+class Histogram:
+    """Cumulative bucket counts like a Prometheus histogram, with quantiles estimated from the buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket that holds the q-th observation (as histogram_quantile does)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.slow_query_ms = DEFAULT_SLOW_QUERY_MS
+        self._lock = threading.Lock()
+        self._requests = {}    # (endpoint, method, status) -> count
+        self._histograms = {}  # (metric, endpoint) -> Histogram
+        self._slow_queries = deque(maxlen=DEFAULT_SLOW_QUERY_LOG_SIZE)
+        self._slow_query_total = 0
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+        self._slow_queries = deque(maxlen=app.config.get('SLOW_QUERY_LOG_SIZE', DEFAULT_SLOW_QUERY_LOG_SIZE))
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        # Listens on every engine (the writer and the read-only engine)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        statements, sql_seconds = g.get('sql_statements', 0), g.get('sql_seconds', 0.0)
+
+        with self._lock:
+            key = (endpoint, request.method, response.status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe('request_duration_seconds', endpoint, DURATION_BUCKETS, elapsed)
+            self._observe('request_sql_statements', endpoint, COUNT_BUCKETS, statements)
+            self._observe('request_sql_duration_seconds', endpoint, DURATION_BUCKETS, sql_seconds)
+            if response.content_length is not None:
+                self._observe('response_size_bytes', endpoint, SIZE_BUCKETS, response.content_length)
+
+        response.headers.add(
+            'Server-Timing',
+            f'app;dur={elapsed * 1000:.1f}, db;dur={sql_seconds * 1000:.1f};desc="{statements} queries"'
+        )
+        return response
+
+    def _observe(self, metric, endpoint, buckets, value):
+        histogram = self._histograms.get((metric, endpoint))
+        if histogram is None:
+            histogram = self._histograms[(metric, endpoint)] = Histogram(buckets)
+        histogram.observe(value)
+
+    def record_statement(self, statement, seconds, executemany=False):
+        if has_request_context():
+            g.sql_statements = g.get('sql_statements', 0) + 1
+            g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+
+        # A batch of rows sent with executemany is expected to take a while, it is not a slow query
+        if not executemany and seconds * 1000 >= self.slow_query_ms:
+            endpoint = request.endpoint if has_request_context() else None
+            with self._lock:
+                self._slow_query_total += 1
+                self._slow_queries.append({
+                    'at': time.time(), 'endpoint': endpoint, 'ms': round(seconds * 1000, 1), 'statement': statement,
+                })
+            slow_query_logger.warning('Slow query (%.1fms) in %s: %s', seconds * 1000, endpoint, statement)
+
+    def recent_slow_queries(self):
+        with self._lock:
+            return list(self._slow_queries)
+
+    def render_prometheus(self, worker):
+        """The metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP app_requests_total Requests by endpoint, method and status.',
+                      '# TYPE app_requests_total counter']
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'app_requests_total{{worker="{worker}",endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}"}} {count}')
+
+            for metric, help_text in [
+                ('request_duration_seconds', 'Request wall time.'),
+                ('request_sql_statements', 'SQL statements per request.'),
+                ('request_sql_duration_seconds', 'SQL time per request.'),
+                ('response_size_bytes', 'Response body size (not streamed responses).'),
+            ]:
+                lines += [f'# HELP app_{metric} {help_text}', f'# TYPE app_{metric} histogram']
+                for (name, endpoint), histogram in sorted(self._histograms.items()):
+                    if name != metric:
+                        continue
+                    labels = f'worker="{worker}",endpoint="{endpoint}"'
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'app_{metric}_bucket{{{labels},le="{bound}"}} {total}')
+                    lines.append(f'app_{metric}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'app_{metric}_count{{{labels}}} {histogram.count}')
+
+            lines += ['# HELP app_request_duration_quantile_seconds p50/p95/p99 request wall time, '
+                      'estimated from the histogram.',
+                      '# TYPE app_request_duration_quantile_seconds gauge']
+            for (name, endpoint), histogram in sorted(self._histograms.items()):
+                if name != 'request_duration_seconds':
+                    continue
+                for q in QUANTILES:
+                    lines.append(f'app_request_duration_quantile_seconds{{worker="{worker}",endpoint="{endpoint}",'
+                                 f'quantile="{q}"}} {histogram.quantile(q):.6f}')
+
+            lines += [f'# HELP app_slow_queries_total Statements slower than {self.slow_query_ms}ms.',
+                      '# TYPE app_slow_queries_total counter',
+                      f'app_slow_queries_total{{worker="{worker}"}} {self._slow_query_total}']
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, so a statement that fails does not leave a start time behind
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None:
+        request_metrics.record_statement(statement, time.perf_counter() - started, executemany)
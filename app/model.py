@@ -4,8 +4,10 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
+from app.database import RoutingSession
 
-db = SQLAlchemy()
+# GET requests read through read-only connections, see app/database.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # User model
 # This is the model for the users of the application
@@ -14,6 +16,14 @@ db = SQLAlchemy()
 # It also has a relationship to the appointments that it has created
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # login looks users up by username
+        db.Index('ix_users_username', 'username'),
+        # dashboard counts of active, admin and new users
+        db.Index('ix_users_last_login', 'last_login'),
+        db.Index('ix_users_created_at', 'created_at'),
+        db.Index('ix_users_role', 'role'),
+    )
 
     ROLES = ['admin', 'doctor', 'client']
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -51,6 +61,12 @@ class User(UserMixin, db.Model):
 # It also has a relationship to the enrollments that I have created
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        # age band filter on the client search
+        db.Index('ix_clients_date_of_birth', 'date_of_birth'),
+        # clients registered per day (daily snapshots)
+        db.Index('ix_clients_registered_at', 'registered_at'),
+    )
 
     id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, autoincrement=True)
     full_name = db.Column(db.String(100), nullable=False)
@@ -148,6 +164,14 @@ class Status(db.Model):
 # It also has a relationship to the status of the enrollment
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
+    __table_args__ = (
+        # a client's enrollments by status (client profile, duplicate enrollment check)
+        db.Index('ix_enrollments_client_status', 'client_id', 'status_id'),
+        # a program's enrollments by status (program filter on the client search)
+        db.Index('ix_enrollments_program_status', 'program_id', 'status_id', 'client_id'),
+        # dashboard count of active enrollments
+        db.Index('ix_enrollments_status', 'status_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
@@ -215,6 +239,12 @@ class Notification(db.Model):
 # It also has a relationship to the program that the appointment is for
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # a client's appointments (client profile)
+        db.Index('ix_appointments_client_date', 'client_id', 'appointment_date'),
+        # appointments per day (daily snapshots)
+        db.Index('ix_appointments_date_program', 'appointment_date', 'program_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
@@ -255,3 +285,89 @@ class Appointment(db.Model):
     )
 
 
+# Daily snapshot model
+# This is one row per day with the system wide counters, written by the daily snapshot job (flask snapshot-daily)
+# The enrollment counts are as they were when the snapshot was taken, the other counts are for that day
+class DailySnapshot(db.Model):
+    __tablename__ = 'daily_snapshots'
+
+    day = db.Column(db.Date, primary_key=True)
+    total_clients = db.Column(db.Integer, nullable=False, default=0)
+    new_clients = db.Column(db.Integer, nullable=False, default=0)
+    active_users = db.Column(db.Integer, nullable=False, default=0)  # logged in within the 7 days up to this day
+    active_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    completed_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    dropped_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    appointments = db.Column(db.Integer, nullable=False, default=0)  # appointments booked for this day
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DailySnapshot {self.day}>"
+
+
+# Daily program snapshot model
+# This is one row per day per program, written by the daily snapshot job
+# The primary key starts with the program so a program's history is a single index range
+class DailyProgramSnapshot(db.Model):
+    __tablename__ = 'daily_program_snapshots'
+
+    program_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    active_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    completed_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    dropped_enrollments = db.Column(db.Integer, nullable=False, default=0)
+    appointments = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DailyProgramSnapshot {self.program_id} {self.day}>"
+
+
+# Cache version model
+# One row per cached catalog (e.g. 'programs') with a version that is bumped in the same transaction
+# as every change to what it caches, so each gunicorn worker can tell its copy is stale with one primary key read
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CacheVersion {self.name} {self.version}>"
+
+
+# Cache change model
+# One row per committed change that cached data depends on: the entity type ('user', 'client', ...) and its id
+# (no id means every entity of that type). seq only ever grows, each worker remembers the last seq it has applied
+# The table is a short rolling log for cache invalidation, old rows are deleted as new ones are written
+class CacheChange(db.Model):
+    __tablename__ = 'cache_changes'
+    __table_args__ = {'sqlite_autoincrement': True}  # never reuse a seq, even after the oldest rows are deleted
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CacheChange {self.seq} {self.entity} {self.entity_id}>"
+
+
+# Change log model
+# One row per insert, update or delete of a client, enrollment or appointment, written by triggers in the same
+# transaction as the change (see the add_change_log migration); rows are only ever appended
+# client_id is the client the row belongs to, so a mirror can file deletes without looking the row up
+# The public change feed (/api/changes) is read from here
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}  # the feed cursor is a seq, it must never be reused
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(20), nullable=False)  # client, enrollment or appointment
+    entity_id = db.Column(db.Integer, nullable=False)
+    client_id = db.Column(db.Integer)
+    op = db.Column(db.String(10), nullable=False)  # upsert or delete
+    changed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<ChangeLog {self.seq} {self.op} {self.entity} {self.entity_id}>"
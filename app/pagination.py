@@ -0,0 +1,85 @@
+import base64
+import json
+
+
+# Keyset pagination helpers
+# A cursor is the sort key of the last row on a page, encoded so clients treat it as an opaque string
+# The next page is fetched with "WHERE key > cursor ORDER BY key LIMIT size", which stays fast on any page
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(**key):
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+    if not isinstance(key, dict):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    return key
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+# Page number pagination for the server rendered admin tables
+# There is no COUNT query and no total: the page reads one row past its end, and that row (when there is one)
+# is what shows the "Next" link, so rows committed by any worker or import are always reachable
+# The rows are streamed, so has_next is only known once the template has looped over PageInfo.rows()
+class PageInfo:
+
+    def __init__(self, page, per_page):
+        self.page = page
+        self.per_page = per_page
+        self.has_next = False
+
+    @property
+    def offset(self):
+        return (self.page - 1) * self.per_page
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+    def rows(self, query):
+        """Yields the rows of this page from an ordered query and sets has_next from the look-ahead row"""
+        for n, row in enumerate(query.offset(self.offset).limit(self.per_page + 1)):
+            if n == self.per_page:
+                self.has_next = True
+                break
+            yield row
+
+
+def parse_page(args, default_per_page=50, max_per_page=200):
+    try:
+        page = max(1, int(args.get('page', 1)))
+    except (TypeError, ValueError):
+        page = 1
+    per_page = parse_page_size(args.get('per_page'), default=default_per_page, maximum=max_per_page)
+    return PageInfo(page, per_page)
@@ -0,0 +1,101 @@
+import os
+import threading
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+# Password hashing
+# Hashing and checking passwords is deliberately slow (scrypt by default), and it runs in the request thread:
+# a burst of logins could have every thread of a worker hashing at once and leave none for the api
+#   - the hashing method and cost come from PASSWORD_HASH_METHOD (any method werkzeug understands,
+#     e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:1000000')
+#   - at most PASSWORD_HASH_CONCURRENCY threads of a worker process hash at the same time (default
+#     GUNICORN_THREADS - 1, at least 1), so with gthread workers one thread is always left for other requests;
+#     a login over the limit waits PASSWORD_HASH_WAIT seconds for a slot and then gets PasswordHashingBusy
+#   - this only bounds how many threads are busy hashing, it does not free them: the request that hashes still
+#     waits for its hash, and a sync worker (one thread) is tied up for the whole hash either way
+#   - a successful login with a hash made by an older method or cost is rehashed with the current one
+#     (see needs_rehash), so changing PASSWORD_HASH_METHOD upgrades users as they log in
+
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+DEFAULT_HASH_WAIT = 5  # seconds
+
+
+def default_hash_concurrency(environ=os.environ):
+    return max(1, int(environ.get('GUNICORN_THREADS', 1)) - 1)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when every hashing slot of this process stayed taken for PASSWORD_HASH_WAIT seconds"""
+
+
+class PasswordHasher:
+
+    def __init__(self):
+        self.method = DEFAULT_HASH_METHOD
+        self.concurrency = default_hash_concurrency()
+        self.wait = DEFAULT_HASH_WAIT
+        self._prefix = None
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def init_app(self, app):
+        self.set_method(app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD))
+        self.set_concurrency(app.config.get('PASSWORD_HASH_CONCURRENCY', default_hash_concurrency()))
+        self.wait = app.config.get('PASSWORD_HASH_WAIT', DEFAULT_HASH_WAIT)
+
+    def set_method(self, method):
+        """Hashes from now on with method, hashes made with anything else then need a rehash"""
+        self.method = method
+        self._prefix = None
+
+    def set_concurrency(self, concurrency):
+        if int(concurrency) < 1:
+            raise ValueError(f'PASSWORD_HASH_CONCURRENCY must be at least 1, not {concurrency!r}')
+        self.concurrency = int(concurrency)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    @property
+    def prefix(self):
+        """The method part ('scrypt:32768:8:1') of hashes made with the current settings"""
+        if self._prefix is None:
+            # werkzeug fills in default costs ('scrypt' -> 'scrypt:32768:8:1'), so ask it rather than parse
+            self._prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+        return self._prefix
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def _run(self, func, *args):
+        slots = self._slots
+        if not slots.acquire(timeout=self.wait):
+            raise PasswordHashingBusy()
+        try:
+            return func(*args)
+        finally:
+            slots.release()
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(user, password):
+    """
+    Checks a user's password and upgrades the stored hash if it was made with older settings
+    The new hash is added to the session, the caller commits it
+    """
+    if not password_hasher.verify(user.password_hash, password):
+        return False
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        current_app.logger.info('Rehashed password for user %s', user.id)
+    return True
@@ -0,0 +1,168 @@
+import hashlib
+from flask import abort, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app.cache import LRUBytesCache
+from app.model import db, Client, Enrollment, Appointment
+from app.invalidation import invalidation_bus
+from app.statuses import StatusId, status_name
+
+
+# Client profile loader
+# Shared by the client profile page (main.client_profile) and the public profile api (api.get_client_profile_api)
+# It loads the client with everything the profile shows in a fixed number of queries:
+#   1. the client and the user that registered them
+#   2. all of the client's enrollments with their program
+#   3. all of the client's appointments with their program and doctor
+# Status names come from the status registry (app/statuses.py), the status table is never joined
+# The enrollments are then split by status in Python, so the query count does not grow with the history
+
+PROFILE_QUERY_COUNT = 3
+
+
+def load_client_profile(client_id):
+    client = db.session.query(Client).options(
+        joinedload(Client.registered_by_user),
+        selectinload(Client.enrollments).joinedload(Enrollment.program),
+        selectinload(Client.appointments).options(
+            joinedload(Appointment.program),
+            joinedload(Appointment.doctor),
+        ),
+    ).filter(Client.id == client_id).one_or_none()
+
+    if client is None:
+        return None
+
+    enrollments = [e for e in client.enrollments if e.status_id == StatusId.ENROLLED]
+    completed_enrollments = [e for e in client.enrollments if e.status_id == StatusId.COMPLETED]
+    dropped_enrollments = [e for e in client.enrollments if e.status_id == StatusId.DROPPED]
+
+    return {
+        'client': client,
+        'enrollments': enrollments,
+        'completed_enrollments': completed_enrollments,
+        'dropped_enrollments': dropped_enrollments,
+        'appointments': sorted(client.appointments, key=lambda a: a.appointment_date),
+    }
+
+
+def load_client_profile_or_404(client_id):
+    profile = load_client_profile(client_id)
+    if profile is None:
+        abort(404)
+    return profile
+
+
+# Serialized profile cache
+# The public profile api (api.get_client_profile_api) keeps the encoded JSON of every profile it serves
+# Repeat reads skip the ORM and the JSON encoding, and a matching If-None-Match gets a 304
+# Every view that changes a client, their enrollments or their appointments calls invalidate_client_profile(),
+# and the other workers evict the profile from the invalidation bus
+# A profile also embeds program names and doctor usernames, so views that change or delete a program or a user
+# clear the whole cache with invalidate_client_profile(None)
+
+_profile_cache = None
+
+
+def get_profile_cache():
+    global _profile_cache
+    if _profile_cache is None:
+        _profile_cache = LRUBytesCache(
+            max_entries=current_app.config.get('PROFILE_CACHE_MAX_ENTRIES', 1024),
+            max_bytes=current_app.config.get('PROFILE_CACHE_MAX_BYTES', 8 * 1024 * 1024),
+        )
+    return _profile_cache
+
+
+def serialize_client_profile(profile):
+    client = profile['client']
+    return {
+        'id': client.id,
+        'name': client.full_name,
+        'gender': client.gender,
+        'email': client.email,
+        'phone': client.phone,
+        'registered_at': client.registered_at.strftime('%Y-%m-%d'),
+        'active_enrollments': [
+            {
+                'program': e.program.name,
+                'status': status_name(e.status_id),
+                'start_date': e.start_date.strftime('%Y-%m-%d'),
+                'end_date': e.end_date.strftime('%Y-%m-%d'),
+            } for e in profile['enrollments']
+        ],
+        'dropped_enrollments': [
+            {
+                'program': e.program.name,
+                'status': status_name(e.status_id),
+                'start_date': e.start_date.strftime('%Y-%m-%d'),
+                'end_date': e.end_date.strftime('%Y-%m-%d'),
+            } for e in profile['dropped_enrollments']
+        ],
+        'appointments': [
+            {
+                'date': a.appointment_date.strftime('%Y-%m-%d'),
+                'status': status_name(a.status_id),
+                'doctor': a.doctor.username if a.doctor else 'N/A'
+            } for a in profile['appointments']
+        ]
+    }
+
+
+def get_client_profile_json(client_id):
+    """
+    Returns (body, etag) for a client's public profile, or None if the client does not exist
+    The body is the exact bytes jsonify sends for the profile and the etag is a hash of it
+    """
+    cache = get_profile_cache()
+    entry = cache.get(client_id)
+    if entry is not None:
+        return entry
+
+    # An invalidation that lands while the profile loads means it may already be stale, so it is not cached
+    generation = cache.generation
+    profile = load_client_profile(client_id)
+    if profile is None:
+        return None
+
+    body = current_app.json.response(serialize_client_profile(profile)).get_data()
+    etag = hashlib.sha1(body).hexdigest()
+    cache.set(client_id, body, etag, generation=generation)
+    return body, etag
+
+
+def invalidate_client_profile(client_id):
+    if _profile_cache is None:
+        return
+    if client_id is None:
+        _profile_cache.clear()
+    else:
+        _profile_cache.invalidate(int(client_id))
+
+
+# Changes committed by other workers (see app/invalidation.py)
+# Program and user changes can rename what any profile shows, so they clear the whole cache
+invalidation_bus.subscribe('client', invalidate_client_profile)
+invalidation_bus.subscribe('program', lambda program_id: invalidate_client_profile(None))
+invalidation_bus.subscribe('user', lambda user_id: invalidate_client_profile(None))
+
+
+# Appointments have no views of their own yet, so their changes are picked up from the session
+# The client ids are collected on flush and only evicted once the transaction commits
+@event.listens_for(Session, 'after_flush')
+def _collect_appointment_changes(session, flush_context):
+    changed = session.info.setdefault('changed_profile_ids', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Appointment):
+            changed.add(obj.client_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_appointment_changes(session):
+    for client_id in session.info.pop('changed_profile_ids', ()):
+        invalidate_client_profile(client_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_appointment_changes(session):
+    session.info.pop('changed_profile_ids', None)
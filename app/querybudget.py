@@ -0,0 +1,145 @@
+import contextvars
+import functools
+import logging
+import os
+import re
+import traceback
+from collections import Counter
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Query budgets
+# A view (or any block of code) can declare how many SQL statements it is allowed to run:
+#
+#     @query_budget(3)
+#     def client_profile(client_id): ...
+#
+#     with query_budget(2):
+#         ...
+#
+# A budget is broken when more statements run than allowed, or when the same statement shape
+# (the SQL with IN lists collapsed) runs repeat_threshold times or more, which is what a lazy load
+# inside a loop (N+1) looks like. The report lists the offending statement and where it was issued from
+# QUERY_BUDGET_MODE decides what happens: 'raise' (default when testing) raises QueryBudgetExceeded,
+# 'log' (default in debug mode) logs a warning to the 'app.query_budget' logger, and 'off' (default otherwise)
+# skips the counting altogether, so production requests pay nothing
+# tests/test_query_budgets.py requests every budgeted GET route under pytest (where the mode is 'raise')
+# and fails if one is over budget
+
+DEFAULT_REPEAT_THRESHOLD = 3
+STACK_DEPTH = 6
+
+budget_logger = logging.getLogger('app.query_budget')
+
+_active_budgets = contextvars.ContextVar('active_query_budgets', default=())
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block runs more statements than its budget or repeats a statement (N+1)"""
+
+
+def budget_mode():
+    if not has_app_context():
+        return 'off'
+    mode = current_app.config.get('QUERY_BUDGET_MODE')
+    if mode:
+        return mode
+    if current_app.testing:
+        return 'raise'
+    return 'log' if current_app.debug else 'off'
+
+
+def statement_shape(statement):
+    # Expanded IN lists differ only in the number of placeholders
+    shape = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', statement)
+    return ' '.join(shape.split())
+
+
+def _app_stack():
+    # Only the frames from this application, innermost last, without this module
+    frames = [frame for frame in traceback.extract_stack()[:-1]
+              if frame.filename.startswith(_APP_DIR) and frame.filename != __file__]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+class QueryBudget:
+    """Context manager and decorator that counts the SQL statements run inside it"""
+
+    def __init__(self, max_statements=None, repeat_threshold=DEFAULT_REPEAT_THRESHOLD, name=None, mode=None):
+        self.max_statements = max_statements
+        self.repeat_threshold = repeat_threshold
+        self.name = name
+        self.mode = mode
+        self.statements = []  # [(statement, stack)]
+        self._token = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, statement):
+        self.statements.append((statement, _app_stack()))
+
+    def violations(self):
+        """[(message, statement, stack)] for everything that broke the budget"""
+        found = []
+        if self.max_statements is not None and self.count > self.max_statements:
+            statement, stack = self.statements[self.max_statements]
+            found.append((f'ran {self.count} statements, budget is {self.max_statements}; '
+                          f'first statement over budget', statement, stack))
+
+        shapes = Counter(statement_shape(statement) for statement, _ in self.statements)
+        for shape, times in shapes.items():
+            if self.repeat_threshold and times >= self.repeat_threshold:
+                # The stack of the second run points at the loop
+                repeats = [(s, stack) for s, stack in self.statements if statement_shape(s) == shape]
+                statement, stack = repeats[1]
+                found.append((f'ran the same statement {times} times (N+1)', statement, stack))
+        return found
+
+    def report(self):
+        lines = [f'Query budget exceeded in {self.name or "block"}:']
+        for message, statement, stack in self.violations():
+            lines += [f'  {message}', f'    {statement}', '  issued from:', stack.rstrip()]
+        return '\n'.join(lines)
+
+    def __enter__(self):
+        self.statements = []
+        self._token = _active_budgets.set(_active_budgets.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_budgets.reset(self._token)
+        if exc_type is not None or not self.violations():
+            return False
+
+        mode = self.mode or budget_mode()
+        if mode == 'raise':
+            raise QueryBudgetExceeded(self.report())
+        if mode == 'log':
+            budget_logger.warning(self.report())
+        return False
+
+    def __call__(self, f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if (self.mode or budget_mode()) == 'off':
+                return f(*args, **kwargs)
+            # A new budget per call, so concurrent requests do not share counts
+            with QueryBudget(self.max_statements, self.repeat_threshold, self.name or f.__name__, self.mode):
+                return f(*args, **kwargs)
+        decorated_function.query_budget = self.max_statements
+        return decorated_function
+
+
+def query_budget(max_statements=None, repeat_threshold=DEFAULT_REPEAT_THRESHOLD, name=None, mode=None):
+    return QueryBudget(max_statements, repeat_threshold, name=name, mode=mode)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for budget in _active_budgets.get():
+        budget.record(statement)
@@ -0,0 +1,167 @@
+from array import array
+from datetime import date
+from sqlalchemy import text
+from app.model import db, Program
+from app.statuses import StatusId
+
+
+# Program reports
+# The reports page is built from three small rollups instead of the enrollment and client tables:
+#   report_program_status        enrollments per program and status
+#   report_program_demographics  enrollments per program, status, client gender and client birth year
+#   report_registrations         clients registered per month
+# The rollups are materialized tables kept up to date by triggers (see the add_report_rollup_tables migration,
+# and update_registration_rollup_on_edit for changes to registered_at)
+# so every write adjusts just the counts it touches and a page view reads a few hundred rows at most
+# When the rollup tables are missing the same GROUP BY queries run against the live tables instead
+
+# status for enrollment
+ENROLLED, COMPLETED, DROPPED = StatusId.ENROLLED, StatusId.COMPLETED, StatusId.DROPPED
+
+# Age bands in years, matching the client search filter
+AGE_BANDS = [(0, 18), (19, 30), (31, 50), (51, None)]
+GENDERS = ['male', 'female', 'unknown']
+
+# Months shown in the registration trend
+TREND_MONTHS = 12
+
+# Each rollup as (table, rollup query, live GROUP BY query)
+PROGRAM_STATUS = (
+    'report_program_status',
+    "SELECT program_id, status_id, enrollments FROM report_program_status WHERE enrollments > 0",
+    "SELECT program_id, status_id, COUNT(*) FROM enrollments GROUP BY program_id, status_id",
+)
+PROGRAM_DEMOGRAPHICS = (
+    'report_program_demographics',
+    "SELECT program_id, status_id, gender, birth_year, enrollments FROM report_program_demographics WHERE enrollments > 0",
+    """
+    SELECT e.program_id, e.status_id, COALESCE(c.gender, 'unknown'),
+           COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0), COUNT(*)
+    FROM enrollments e JOIN clients c ON c.id = e.client_id
+    GROUP BY 1, 2, 3, 4
+    """,
+)
+REGISTRATIONS = (
+    'report_registrations',
+    "SELECT month, clients FROM report_registrations WHERE clients > 0",
+    """
+    SELECT strftime('%Y-%m', registered_at), COUNT(*) FROM clients
+    WHERE registered_at IS NOT NULL GROUP BY 1
+    """,
+)
+ROLLUPS = [PROGRAM_STATUS, PROGRAM_DEMOGRAPHICS, REGISTRATIONS]
+
+
+def rollups_available():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    row = db.session.execute(
+        text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (:a, :b, :c)"),
+        {'a': PROGRAM_STATUS[0], 'b': PROGRAM_DEMOGRAPHICS[0], 'c': REGISTRATIONS[0]}
+    ).scalar()
+    return row == len(ROLLUPS)
+
+
+def rollup_rows(rollup, use_rollup):
+    _, rollup_sql, live_sql = rollup
+    return db.session.execute(text(rollup_sql if use_rollup else live_sql)).all()
+
+
+def refresh_rollups():
+    """Rebuilds every rollup from the live tables, in one transaction"""
+    for table, _, live_sql in ROLLUPS:
+        db.session.execute(text(f"DELETE FROM {table}"))
+        db.session.execute(text(f"INSERT INTO {table} {live_sql}"))
+    db.session.commit()
+
+
+def age_band_index(birth_year, today=None):
+    """Index into AGE_BANDS for a birth year, using the same age rule as the client search (year difference)"""
+    age = (today or date.today()).year - birth_year
+    for index, (lower, upper) in enumerate(AGE_BANDS):
+        if upper is None or age <= upper:
+            return index
+    return len(AGE_BANDS) - 1
+
+
+def _rate(part, total):
+    return round(100.0 * part / total, 1) if total else 0.0
+
+
+def _month_keys(today, months):
+    year, month = today.year, today.month
+    keys = []
+    for _ in range(months):
+        keys.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return keys[::-1]
+
+
+def build_reports(today=None):
+    """
+    Returns everything the reports page shows
+        programs       per program enrollment counts with completion and dropout rates
+        demographics   active enrollments by age band (rows) and gender (columns), overall and per program
+        registrations  clients registered per month over the last TREND_MONTHS months
+    The counters are flat arrays indexed by position, filled in one pass over the grouped rows
+    """
+    today = today or date.today()
+    use_rollup = rollups_available()
+
+    programs = Program.query.order_by(Program.name).all()
+    position = {program.id: index for index, program in enumerate(programs)}
+    n_programs = len(programs)
+
+    # status counts: program index * 3 + (status - 1)
+    status_counts = array('l', [0] * (n_programs * 3))
+    for program_id, status_id, count in rollup_rows(PROGRAM_STATUS, use_rollup):
+        if program_id in position and status_id in (ENROLLED, COMPLETED, DROPPED):
+            status_counts[position[program_id] * 3 + status_id - 1] += count
+
+    # demographics of active enrollments: (program index * bands + band) * genders + gender
+    n_bands, n_genders = len(AGE_BANDS), len(GENDERS)
+    gender_index = {gender: index for index, gender in enumerate(GENDERS)}
+    demographics = array('l', [0] * (n_programs * n_bands * n_genders))
+    for program_id, status_id, gender, birth_year, count in rollup_rows(PROGRAM_DEMOGRAPHICS, use_rollup):
+        if status_id != ENROLLED or program_id not in position:
+            continue
+        band = age_band_index(birth_year, today) if birth_year else n_bands - 1
+        g = gender_index.get((gender or 'unknown').lower(), gender_index['unknown'])
+        demographics[(position[program_id] * n_bands + band) * n_genders + g] += count
+
+    program_reports = []
+    totals = array('l', [0] * (n_bands * n_genders))
+    for index, program in enumerate(programs):
+        enrolled, completed, dropped = status_counts[index * 3:index * 3 + 3]
+        total = enrolled + completed + dropped
+        block = demographics[index * n_bands * n_genders:(index + 1) * n_bands * n_genders]
+        for cell, count in enumerate(block):
+            totals[cell] += count
+        program_reports.append({
+            'id': program.id,
+            'name': program.name,
+            'enrolled': enrolled,
+            'completed': completed,
+            'dropped': dropped,
+            'total': total,
+            'completion_rate': _rate(completed, total),
+            'dropout_rate': _rate(dropped, total),
+            'demographics': [list(block[b * n_genders:(b + 1) * n_genders]) for b in range(n_bands)],
+        })
+
+    months = _month_keys(today, TREND_MONTHS)
+    month_index = {month: index for index, month in enumerate(months)}
+    registrations = array('l', [0] * len(months))
+    for month, count in rollup_rows(REGISTRATIONS, use_rollup):
+        if month in month_index:
+            registrations[month_index[month]] += count
+
+    return {
+        'programs': program_reports,
+        'age_bands': [f"{lower}-{upper}" if upper is not None else f"{lower}+" for lower, upper in AGE_BANDS],
+        'genders': GENDERS,
+        'demographics': [list(totals[b * n_genders:(b + 1) * n_genders]) for b in range(n_bands)],
+        'registrations': list(zip(months, registrations)),
+    }
@@ -1,10 +1,26 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, session
+from flask import Blueprint, render_template, flash, redirect, url_for, request, session, abort, Response, stream_with_context
 from app.forms import ClientRegistrationForm, LoginForm
-from werkzeug.security import check_password_hash, generate_password_hash
 from app.model import User, Client, db, Program, Enrollment, Appointment
-from app.utils import login_required, admin_required, doctor_required
+from app.utils import login_required, admin_required, doctor_required, stream_page
+from app.stats import get_dashboard_stats, invalidate_dashboard_stats
+from app.profiles import load_client_profile_or_404, invalidate_client_profile, PROFILE_QUERY_COUNT
+from app.pagination import parse_page
+from app.importer import import_clients, detect_format
+from app.reports import build_reports
+from app.logins import last_login_buffer
+from app.user_cache import invalidate_user
+from app.passwords import hash_password, verify_password, PasswordHashingBusy
+from app.metrics import request_metrics
+from app.querybudget import query_budget
+from app.catalog import get_program_catalog
+from app.statuses import StatusId
+from app.exporter import stream_export, export_filename, EXPORTS, FORMATS as EXPORT_FORMATS
 from datetime import datetime, timedelta
+import csv
+import io
+import os
 from sqlalchemy import func
+from sqlalchemy.orm import load_only
 
 from flask_login import login_user, current_user, logout_user
 
@@ -21,29 +37,20 @@ It requires the user to be logged in
 @main.route('/')
 @login_required # This ensures that the user is logged in
 def index():
-    # Get basic statistics for all users
-    total_programs = Program.query.count()
-    total_clients = Client.query.count()
-    active_enrollments = Enrollment.query.filter_by(status_id=1).count()  # Assuming status_id 1 is active
+    # Get all the statistics in one query (cached for a few seconds)
+    stats = get_dashboard_stats()
 
     # Initialize admin statistics
     admin_stats = {}
     
-    # If user is admin, calculate additional statistics
+    # If user is admin, pass the additional statistics
     if current_user.is_authenticated and current_user.role == 'admin':
-        # Total users
-        admin_stats['total_users'] = User.query.count()
-        
-        # Active users (users who have logged in within the last 7 days)
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        admin_stats['active_users'] = User.query.filter(User.last_login >= seven_days_ago).count()
-        
-        # Admin users
-        admin_stats['admin_users'] = User.query.filter_by(role='admin').count()
-        
-        # New users in last 24 hours
-        one_day_ago = datetime.utcnow() - timedelta(days=1)
-        admin_stats['new_users_24h'] = User.query.filter(User.created_at >= one_day_ago).count()
+        admin_stats = {
+            'total_users': stats['total_users'],
+            'active_users': stats['active_users'],  # logged in within the last 7 days
+            'admin_users': stats['admin_users'],
+            'new_users_24h': stats['new_users_24h'],  # created in the last 24 hours
+        }
 
     # Get recent activities (last 5 activities)
     recent_activities = [
@@ -56,9 +63,9 @@ def index():
     ]
 
     return render_template('index.html',
-                         total_programs=total_programs,
-                         total_clients=total_clients,
-                         active_enrollments=active_enrollments,
+                         total_programs=stats['total_programs'],
+                         total_clients=stats['total_clients'],
+                         active_enrollments=stats['active_enrollments'],
                          recent_activities=recent_activities,
                          **admin_stats)
 
@@ -77,10 +84,19 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
-            # Update last_login timestamp
-            user.last_login = datetime.utcnow()
-            db.session.commit()
+        try:
+            valid = user is not None and verify_password(user, form.password.data)
+        except PasswordHashingBusy:
+            flash('The server is busy, please try again in a moment', 'danger')
+            return render_template('login.html', form=form), 503
+
+        if valid:
+            # Save the upgraded password hash if verify_password rehashed it
+            if db.session.is_modified(user):
+                db.session.commit()
+
+            # Record the last_login timestamp, it is written to the database in the background
+            last_login_buffer.record(user.id)
             
             login_user(user)
             flash('Login successful!', 'success')
@@ -111,7 +127,7 @@ It requires the user to be logged in
 @main.route('/create-program')
 @login_required # This ensures that the user is logged in before creating a program
 def create_program():
-    programs = Program.query.all() # Get all programs
+    programs = get_program_catalog().programs # All programs, from this worker's catalog snapshot
     return render_template('create_program.html', programs=programs)
 
 
@@ -146,6 +162,7 @@ def add_program():
         program = Program(name=name, description=description, start_date=start_date, duration=duration)
         db.session.add(program)
         db.session.commit()
+        invalidate_dashboard_stats()
         flash('Program added successfully', 'success')
         return redirect(url_for('main.create_program'))
     else:
@@ -183,6 +200,7 @@ def register_client():
         )
         db.session.add(new_client)
         db.session.commit()
+        invalidate_dashboard_stats()
         flash("Client registered successfully!", "success")
         return redirect(url_for('main.register_client'))
 
@@ -208,7 +226,7 @@ It requires the user to be logged in
 @main.route('/search-client' , methods=['GET', 'POST'])
 @login_required # This ensures that the user is logged in before searching for a client
 def search_client():
-    programs = Program.query.all()
+    programs = get_program_catalog().programs
     return render_template('search_client.html', programs=programs)
 
 
@@ -219,12 +237,15 @@ It requires the user to be logged in
 """
 @main.route('/client/<client_id>')
 @login_required # This ensures that the user is logged in before viewing a client's profile
+@query_budget(PROFILE_QUERY_COUNT) # Rendering the template must not lazy load anything
 def client_profile(client_id):
-    client = Client.query.get_or_404(client_id)
-    enrollments = Enrollment.query.filter_by(client_id=client_id, status_id=1).all()
-    appointments = Appointment.query.filter_by(client_id=client_id).all()
-    dropped_enrollments = Enrollment.query.filter_by(client_id=client_id, status_id=3).all()
-    return render_template('client_profile.html', client=client, enrollments=enrollments, appointments=appointments, dropped_enrollments=dropped_enrollments)
+    # Client, enrollments and appointments are loaded together in a fixed number of queries
+    profile = load_client_profile_or_404(client_id)
+    return render_template('client_profile.html',
+                         client=profile['client'],
+                         enrollments=profile['enrollments'],
+                         appointments=profile['appointments'],
+                         dropped_enrollments=profile['dropped_enrollments'])
 
 
 """   Remove enrollment page @ main.route('/remove-enrollment/<enrollment_id>')
@@ -236,10 +257,11 @@ It requires the user to be logged in
 @login_required # This ensures that the user is logged in before removing an enrollment
 def remove_enrollment(enrollment_id):
     enrollment = Enrollment.query.get_or_404(enrollment_id)
-    if enrollment.status_id == 1:
-        #change status to 3 (Dropped)
-        enrollment.status_id = 3
+    if enrollment.status_id == StatusId.ENROLLED:
+        enrollment.status_id = StatusId.DROPPED
         db.session.commit() 
+        invalidate_dashboard_stats()
+        invalidate_client_profile(enrollment.client_id)
         flash('Enrollment removed successfully', 'success')
         return redirect(url_for('main.client_profile', client_id=enrollment.client_id))
     else:
@@ -249,15 +271,86 @@ def remove_enrollment(enrollment_id):
 
 """   View clients page @ main.route('/admin/clients')
 This is the view clients page of the application
-It allows the user to view all clients
+It allows the user to view all clients, one page at a time
+Only the columns shown in the table are loaded and the page is streamed as the rows are fetched
 It requires the user to be logged in
 """
 @main.route('/admin/clients')
 @login_required # This ensures that the user is logged in before viewing all clients
 @admin_required # This ensures that the user is an admin before viewing all clients
 def view_clients():
-    clients = Client.query.all()
-    return render_template('view_clients.html', clients=clients)
+    pagination = parse_page(request.args)
+    clients = pagination.rows(Client.query.options(
+        load_only(Client.id, Client.full_name, Client.date_of_birth, Client.gender,
+                  Client.phone, Client.email, Client.registered_at)
+    ).order_by(Client.id).yield_per(100))
+
+    return stream_page('view_clients.html',
+                         clients=clients,
+                         pagination=pagination,
+                         total_clients=get_dashboard_stats()['total_clients'],
+                         last_updated=datetime.utcnow().strftime('%Y-%m-%d %H:%M'))
+
+
+"""   Import clients page @ main.route('/admin/clients/import')
+This is the import clients endpoint of the application
+It allows an admin to upload a CSV or JSONL file of clients
+Every row is validated like the register client form, rejected rows are reported back
+It requires the user to be logged in
+"""
+@main.route('/admin/clients/import', methods=['POST'])
+@login_required # This ensures that the user is logged in before importing clients
+@admin_required # This ensures that the user is an admin before importing clients
+def import_clients_upload():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Select a CSV or JSONL file to import', 'danger')
+        return redirect(url_for('main.view_clients'))
+
+    # The upload is read as a text stream, one record at a time
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_clients(stream, detect_format(upload.filename), registered_by=current_user.id)
+    except (UnicodeDecodeError, csv.Error) as e:
+        flash(f'Could not read the file: {e}', 'danger')
+        return redirect(url_for('main.view_clients'))
+    invalidate_dashboard_stats()
+
+    flash(f"Imported {result['imported']} clients, rejected {result['rejected']}", 'success' if not result['rejected'] else 'warning')
+    for rejection in result['rejections'][:10]:
+        errors = '; '.join(f"{field}: {', '.join(messages)}" for field, messages in rejection['errors'].items())
+        flash(f"Line {rejection['line']}: {errors}", 'danger')
+    return redirect(url_for('main.view_clients'))
+
+
+"""   Export page @ main.route('/admin/export/<entity>')
+This is the export endpoint of the application
+It streams all clients, enrollments or appointments as a CSV or NDJSON download (format=csv|ndjson)
+The rows can be filtered like the client search (q, program, age) and gzip compressed (gzip=1)
+It requires the user to be logged in
+"""
+@main.route('/admin/export/<entity>')
+@login_required # This ensures that the user is logged in before exporting
+@admin_required # This ensures that the user is an admin before exporting
+def export_data(entity):
+    if entity not in EXPORTS:
+        abort(404)
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash(f'Unsupported export format: {fmt}', 'danger')
+        return redirect(url_for('main.view_clients'))
+    gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    chunks = stream_export(entity, fmt=fmt, gzip=gzip,
+                           search_term=request.args.get('q', ''),
+                           program_id=request.args.get('program', ''),
+                           age=request.args.get('age', ''))
+
+    mimetype = 'application/gzip' if gzip else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(entity, fmt, gzip)}'
+    return response
 
 
 """   Edit client page @ main.route('/edit-client/<client_id>')
@@ -279,6 +372,7 @@ def edit_client(client_id):
             client.address = request.form.get('address')
             client.medical_history = request.form.get('medical_history')
             db.session.commit()
+            invalidate_client_profile(client.id)
             flash('Client updated successfully', 'success')
             return redirect(url_for('main.view_clients'))
         except Exception as e:
@@ -288,10 +382,19 @@ def edit_client(client_id):
 
 
 
+# Users query for the admin tables
+# Loads only the columns the tables show, so password hashes never leave the database
+def user_table_query():
+    return User.query.options(
+        load_only(User.id, User.username, User.email, User.role, User.phone, User.created_at)
+    ).order_by(User.id)
+
+
 """   Manage users page @ main.route('/manage-users')
 This is the manage users page of the application
-It allows the user to manage all users
+It allows the user to manage all users, one page at a time
 It also allows the user to add a new user
+Only the columns shown in the table are loaded (never the password hash) and the page is streamed
 It requires the user to be logged in
 """
 @main.route('/manage-users')
@@ -304,8 +407,9 @@ def manage_users():
         flash('You are not authorized to manage users', 'danger')
         return redirect(url_for('main.index'))
     
-    users = User.query.all()
-    return render_template('manage_users.html', users=users)
+    pagination = parse_page(request.args)
+    users = pagination.rows(user_table_query().yield_per(100))
+    return stream_page('manage_users.html', users=users, pagination=pagination)
 
 
 """   Add user page @ main.route('/add-user')
@@ -336,16 +440,24 @@ def add_user():
         flash('Username already exists', 'danger')
         return redirect(url_for('main.manage_users'))
 
+    try:
+        password_hash = hash_password(password)
+    except PasswordHashingBusy:
+        flash('The server is busy, please try again in a moment', 'danger')
+        return redirect(url_for('main.manage_users'))
+
     # Create new user
     new_user = User(
         username=username,
         email=email,
-        password_hash=generate_password_hash(password),
+        password_hash=password_hash,
         role=role,
         phone=phone
     )
     db.session.add(new_user)
     db.session.commit()
+    invalidate_dashboard_stats()
+    invalidate_user(new_user.id)
 
     flash('User added successfully', 'success')
     return redirect(url_for('main.manage_users'))
@@ -382,6 +494,10 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    invalidate_dashboard_stats()
+    # Profiles show the doctor of each appointment by username
+    invalidate_client_profile(None)
+    invalidate_user(user_id)
     
     flash('User deleted successfully', 'success')
     return redirect(url_for('main.manage_users'))
@@ -390,6 +506,7 @@ def delete_user(user_id):
 """   View user page @ main.route('/view-user')
 This is the view user page of the application
 It allows the user to view a user's profile
+Without a user_id it lists every user, one page at a time
 It requires the user to be logged in
 """
 @main.route('/view-user')
@@ -402,16 +519,25 @@ def view_user():
         flash('You are not authorized to view a user', 'danger')
         return redirect(url_for('main.manage_users'))
     
-    users = User.query.all()
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        users = user_table_query().filter(User.id == user_id).all()
+        return render_template('view_user.html', users=users)
+
+    pagination = parse_page(request.args)
+    users = pagination.rows(user_table_query().yield_per(100))
     # client_profile = None
     # if user.role == 'client':
     #     client_profile = Client.query.get(user.id)
-    return render_template('view_user.html', users=users)
+    return stream_page('view_user.html', users=users, pagination=pagination)
 
 
 """   Reports page @ main.route('/reports')
 This is the reports page of the application
 It allows the user to view the reports of the application
+    - enrollment, completion and dropout per program
+    - age and gender of the clients in active enrollments
+    - client registrations per month
 It requires the user to be logged in
 """
 @main.route('/reports')
@@ -423,7 +549,23 @@ def reports():
         flash('You are not authorized to view the reports', 'danger')
         return redirect(url_for('main.index'))
     
-    return render_template('reports.html')
+    # Built from the rollup tables, so the cost does not grow with the enrollments table
+    report = build_reports()
+    return render_template('reports.html', report=report)
+
+
+
+"""   Metrics @ main.route('/metrics')
+This is the metrics endpoint of the application, in Prometheus text format
+It shows request counts, latency, SQL statements and SQL time per endpoint for this worker process
+It requires the user to be an admin
+"""
+@main.route('/metrics')
+@login_required # This ensures that the user is logged in before viewing the metrics
+@admin_required # This ensures that the user is an admin before viewing the metrics
+def metrics():
+    return Response(request_metrics.render_prometheus(worker=os.getpid()),
+                    mimetype='text/plain; version=0.0.4')
 
 
 
@@ -457,6 +599,8 @@ def edit_program(program_id):
             program.duration = int(request.form.get('duration'))
 
             db.session.commit()
+            # Profiles show the program of each enrollment by name
+            invalidate_client_profile(None)
             flash('Program updated successfully', 'success')
             return redirect(url_for('main.create_program'))
         
@@ -484,5 +628,7 @@ def delete_program(program_id):
     program = Program.query.get_or_404(program_id)
     db.session.delete(program)
     db.session.commit()
+    invalidate_dashboard_stats()
+    invalidate_client_profile(None)
     flash('Program deleted successfully', 'success')
     return redirect(url_for('main.create_program'))
@@ -0,0 +1,153 @@
+import time
+from datetime import date, timedelta
+from sqlalchemy import text, select
+from app.model import db, Client, Enrollment
+
+
+# Full-text client search
+# Client names, phones and emails are mirrored into an SQLite FTS5 table (clients_fts)
+# The FTS table uses clients as its external content table so only the index is stored twice
+# Triggers on the clients table keep the index in sync on insert, update and delete
+# The table and triggers are created (and backfilled) by the add_clients_fts_search_index migration
+
+CLIENT_FTS_TABLE = 'clients_fts'
+
+# The default and maximum number of results returned by a ranked search
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Cache of whether the FTS table exists, keyed by engine url
+# Falls back to LIKE matching on databases that have not been migrated yet (or are not SQLite)
+# Only a found table is remembered for good; a missing one is looked up again after FTS_RECHECK_SECONDS,
+# so a worker started before `flask db upgrade` switches to the index without a restart
+FTS_RECHECK_SECONDS = 30
+_fts_available = {}  # engine url -> True, or the time.monotonic() when the table was last found missing
+
+
+def fts_available():
+    engine = db.engine
+    key = str(engine.url)
+    cached = _fts_available.get(key)
+    if cached is True:
+        return True
+    if engine.dialect.name != 'sqlite':
+        return False
+    if cached is not None and time.monotonic() - cached < FTS_RECHECK_SECONDS:
+        return False
+
+    row = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': CLIENT_FTS_TABLE}
+    ).first()
+    _fts_available[key] = True if row is not None else time.monotonic()
+    return row is not None
+
+
+def build_match_query(term):
+    """
+    Turn free text into an FTS5 MATCH expression
+    Every word becomes a quoted prefix token ("jo"* "ke"*) so that
+        - all words must match (implicit AND)
+        - the last word can still be half typed
+        - FTS5 operators and punctuation in the input are treated as plain text
+    Returns None when the term has nothing searchable in it
+    """
+    tokens = []
+    for word in term.split():
+        word = ''.join(ch for ch in word if ch.isalnum())
+        if word:
+            tokens.append(f'"{word}"*')
+    return ' '.join(tokens) if tokens else None
+
+
+def parse_limit(value, default=DEFAULT_SEARCH_LIMIT):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_SEARCH_LIMIT))
+
+
+def client_search_filter(term):
+    """
+    Returns a filter clause that restricts a Client query to clients matching the term
+    Uses the FTS index when available, otherwise a LIKE on the client's name
+    """
+    match = build_match_query(term)
+    if match is None or not fts_available():
+        return Client.full_name.ilike(f"%{term}%")
+    return Client.id.in_(
+        text(f"SELECT rowid FROM {CLIENT_FTS_TABLE} WHERE {CLIENT_FTS_TABLE} MATCH :match")
+        .bindparams(match=match)
+    )
+
+
+def client_search_filters(search_term='', program_id='', age=''):
+    """
+    Returns the list of filter clauses for the client search criteria
+        - search_term matches the client's name, phone or email
+        - program_id keeps clients with an enrollment in that program
+        - age is a 'lower-upper' band in years, ignored if it cannot be parsed
+    The program filter is a subquery rather than a join so a client is never returned twice
+    """
+    filters = []
+
+    if search_term:
+        filters.append(client_search_filter(search_term))
+
+    if program_id:
+        filters.append(Client.id.in_(
+            select(Enrollment.client_id).where(Enrollment.program_id == program_id)
+        ))
+
+    if age:
+        try:
+            ageLower, ageUpper = map(int, age.split('-'))
+
+            today = date.today()
+
+            # Person just turned age_upper -> born 'today - age_upper years'
+            dob_start = today - timedelta(days=ageUpper * 365)
+
+            # Person is about to turn age_lower -> born 'today - age_lower years'
+            dob_end = today - timedelta(days=(ageLower + 1) * 365)
+
+            filters.append(Client.date_of_birth.between(dob_start, dob_end))
+        except ValueError:
+            pass
+
+    return filters
+
+
+def search_clients_ranked(term, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Returns up to `limit` clients matching the term, best matches first
+    Ranking uses FTS5's bm25 with the name column weighted above phone and email
+    """
+    match = build_match_query(term)
+    if match is None:
+        return []
+
+    if not fts_available():
+        return (Client.query
+                .filter(Client.full_name.ilike(f"%{term}%"))
+                .order_by(Client.full_name)
+                .limit(limit)
+                .all())
+
+    rows = db.session.execute(
+        text(f"""
+            SELECT rowid FROM {CLIENT_FTS_TABLE}
+            WHERE {CLIENT_FTS_TABLE} MATCH :match
+            ORDER BY bm25({CLIENT_FTS_TABLE}, 10.0, 1.0, 1.0)
+            LIMIT :limit
+        """),
+        {'match': match, 'limit': limit}
+    ).all()
+    ids = [row[0] for row in rows]
+    if not ids:
+        return []
+
+    # Load the clients in one query and put them back in rank order
+    clients = {client.id: client for client in Client.query.filter(Client.id.in_(ids)).all()}
+    return [clients[client_id] for client_id in ids if client_id in clients]
@@ -0,0 +1,263 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+from contextlib import contextmanager
+from sqlalchemy import bindparam, func, select, text
+from werkzeug.security import generate_password_hash
+from app.model import db, User, Client, Program, Enrollment, Appointment
+from app.reports import refresh_rollups, rollups_available
+from app.search import fts_available
+from app.catalog import bump_catalog_version
+from app.statuses import StatusId
+from app.changes import change_log_available, log_rows_after
+
+
+# Synthetic dataset
+# Fills a database with generated programs, doctors, clients, enrollments and appointments for benchmarks
+# The same seed always produces the same rows, so benchmark runs on different machines load the same data
+# Rows are generated lazily and inserted with executemany in batches, one transaction per batch (SQLite only)
+# The per-row triggers (search index, report rollups, change log) would make up most of the load time, so on SQLite
+# they are dropped while loading and recreated from their own definitions afterwards, then the search index and the
+# rollups are rebuilt once and the new rows are appended to the change log; nothing else should write to the database
+# while it is being seeded
+# Point DATABASE_URL at a copy of the database (and run flask db upgrade) before seeding, see `flask seed-dataset`
+
+DEFAULT_VOLUMES = {
+    'programs': 20,
+    'doctors': 50,
+    'clients': 500_000,
+    'enrollments': 2_000_000,
+    'appointments': 1_000_000,
+}
+DEFAULT_SEED = 42
+DEFAULT_BATCH_SIZE = 20_000
+
+FIRST_NAMES = {
+    'female': ['Achieng', 'Akinyi', 'Wanjiru', 'Wambui', 'Njeri', 'Nyambura', 'Atieno', 'Awino', 'Chebet',
+               'Jepkosgei', 'Mwende', 'Mumbua', 'Kemunto', 'Moraa', 'Zawadi', 'Amina', 'Faith', 'Grace',
+               'Mercy', 'Brenda', 'Esther', 'Joy', 'Mary', 'Ann', 'Lucy', 'Sharon', 'Caroline', 'Purity'],
+    'male': ['Otieno', 'Ochieng', 'Omondi', 'Kamau', 'Mwangi', 'Njoroge', 'Kiprono', 'Kipchoge', 'Mutua',
+             'Musyoka', 'Onyango', 'Wafula', 'Barasa', 'Hassan', 'Juma', 'Brian', 'Kevin', 'Dennis',
+             'Peter', 'John', 'James', 'David', 'Moses', 'Samuel', 'Joseph', 'Daniel', 'Fabian', 'Collins'],
+}
+LAST_NAMES = ['Otieno', 'Odhiambo', 'Ouma', 'Kamau', 'Mwangi', 'Njoroge', 'Kariuki', 'Wanjiku', 'Maina',
+              'Kiprotich', 'Kiptoo', 'Cheruiyot', 'Mutua', 'Muthoka', 'Kilonzo', 'Wekesa', 'Wanyama',
+              'Nyongesa', 'Ali', 'Mohamed', 'Omar', 'Ndungu', 'Gitau', 'Mutahi', 'Chege', 'Onyango',
+              'Okoth', 'Achieng', 'Nyaga', 'Muriuki', 'Korir', 'Langat', 'Rotich', 'Bett', 'Karanja']
+PROGRAM_NAMES = ['TB', 'HIV', 'Malaria', 'Diabetes', 'Hypertension', 'Maternal Health', 'Child Immunization',
+                 'Nutrition', 'Family Planning', 'Mental Health', 'Cancer Screening', 'Asthma', 'Hepatitis B',
+                 'Sickle Cell', 'Eye Care', 'Dental Care', 'Physiotherapy', 'Kidney Care', 'Epilepsy',
+                 'Smoking Cessation']
+
+# (share, youngest age, oldest age) of the clients
+AGE_DISTRIBUTION = [(0.25, 0, 18), (0.30, 19, 30), (0.28, 31, 50), (0.17, 51, 90)]
+GENDER_WEIGHTS = {'female': 0.54, 'male': 0.46}
+ENROLLMENT_STATUS_WEIGHTS = {StatusId.ENROLLED: 0.55, StatusId.COMPLETED: 0.30, StatusId.DROPPED: 0.15}
+APPOINTMENT_STATUS_WEIGHTS = {StatusId.PENDING: 0.35, StatusId.CONFIRMED: 0.55, StatusId.CANCELLED: 0.10}
+
+# Clients are registered over this many days before the seed's reference date
+REGISTRATION_DAYS = 3 * 365
+# A fixed reference date, so the data does not depend on the day it is generated
+REFERENCE_DATE = date(2026, 1, 1)
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sql_value(value):
+    # The same text formats SQLAlchemy's SQLite Date and DateTime types store
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='microseconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _insert(model, rows, batch_size):
+    # Plain executemany on the driver, SQLAlchemy's per-value bind processing would double the load time
+    count = 0
+    statement = None
+    for batch in _batches(rows, batch_size):
+        if statement is None:
+            columns = list(batch[0])
+            statement = (f'INSERT INTO {model.__tablename__} ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" for _ in columns)})')
+        db.session.connection().exec_driver_sql(
+            statement, [tuple(_sql_value(row[column]) for column in columns) for row in batch]
+        )
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+@contextmanager
+def suspended_triggers(tables):
+    """Drops the triggers on the tables and recreates them on exit, even if loading failed"""
+    if db.engine.dialect.name != 'sqlite':
+        yield
+        return
+    triggers = db.session.execute(
+        text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN :tables")
+            .bindparams(bindparam('tables', expanding=True)),
+        {'tables': list(tables)}
+    ).all()
+    for name, _ in triggers:
+        db.session.execute(text(f'DROP TRIGGER "{name}"'))
+    db.session.commit()
+    try:
+        yield
+    finally:
+        db.session.rollback()
+        for _, sql in triggers:
+            db.session.execute(text(sql))
+        db.session.commit()
+
+
+def rebuild_derived_tables():
+    """Brings the search index, the report rollups and the program catalog version in line after a trigger-less load"""
+    bump_catalog_version()
+    db.session.commit()
+    if fts_available():
+        db.session.execute(text("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    if rollups_available():
+        refresh_rollups()
+
+
+def _weighted(rng, weights, k):
+    return rng.choices(list(weights), weights=list(weights.values()), k=k)
+
+
+def generate_programs(rng, count):
+    for i in range(count):
+        name = PROGRAM_NAMES[i % len(PROGRAM_NAMES)]
+        if i >= len(PROGRAM_NAMES):
+            name = f'{name} {i // len(PROGRAM_NAMES) + 1}'
+        yield {
+            'name': name,
+            'description': f'A {name} program',
+            'start_date': REFERENCE_DATE - timedelta(days=rng.randint(0, REGISTRATION_DAYS)),
+            'duration': rng.choice([4, 8, 12, 26, 52]),
+        }
+
+
+def generate_doctors(rng, count, password_hash):
+    for i in range(count):
+        gender = _weighted(rng, GENDER_WEIGHTS, 1)[0]
+        first, last = rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES)
+        yield {
+            'username': f'dr.{first.lower()}.{last.lower()}.{i}',
+            'email': f'dr.{first.lower()}.{i}@example.com',
+            'phone': f'07{rng.randint(0, 99_999_999):08d}',
+            'password_hash': password_hash,
+            'role': 'doctor',
+            'created_at': datetime.combine(REFERENCE_DATE, datetime.min.time()) - timedelta(days=rng.randint(0, 365)),
+            'last_login': None,
+        }
+
+
+def generate_clients(rng, count, first_id, registrar_ids):
+    for client_id in range(first_id, first_id + count):
+        gender = _weighted(rng, GENDER_WEIGHTS, 1)[0]
+        _, youngest, oldest = rng.choices(AGE_DISTRIBUTION, weights=[band[0] for band in AGE_DISTRIBUTION])[0]
+        first, last = rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES)
+        registered_at = datetime.combine(REFERENCE_DATE, datetime.min.time()) - timedelta(
+            days=rng.randint(0, REGISTRATION_DAYS), seconds=rng.randint(0, 86_399))
+        yield {
+            'id': client_id,
+            'full_name': f'{first} {last}',
+            'date_of_birth': REFERENCE_DATE - timedelta(days=rng.randint(youngest * 365, oldest * 365 + 364)),
+            'gender': gender,
+            'phone': f'07{rng.randint(0, 99_999_999):08d}',
+            'email': f'{first.lower()}.{last.lower()}{client_id}@example.com',
+            'registered_at': registered_at,
+            'registered_by': rng.choice(registrar_ids),
+        }
+
+
+def generate_enrollments(rng, count, client_ids, programs):
+    # Each client is enrolled in a few distinct programs; clients are picked at random, so some have none
+    program_ids = list(programs)
+    made = 0
+    while made < count:
+        client_id = rng.choice(client_ids)
+        picks = rng.sample(program_ids, min(len(program_ids), rng.randint(1, 4), count - made))
+        for program_id, status_id in zip(picks, _weighted(rng, ENROLLMENT_STATUS_WEIGHTS, len(picks))):
+            enrolled = REFERENCE_DATE - timedelta(days=rng.randint(0, REGISTRATION_DAYS))
+            yield {
+                'client_id': client_id,
+                'program_id': program_id,
+                'status_id': status_id,
+                'enrollment_date': enrolled,
+                'start_date': enrolled,
+                'end_date': enrolled + timedelta(weeks=programs[program_id]),
+                'notes': None,
+            }
+        made += len(picks)
+
+
+def generate_appointments(rng, count, client_ids, program_ids, doctor_ids):
+    for status_id in _weighted(rng, APPOINTMENT_STATUS_WEIGHTS, count):
+        yield {
+            'client_id': rng.choice(client_ids),
+            'doctor_id': rng.choice(doctor_ids),
+            'program_id': rng.choice(program_ids),
+            'appointment_date': REFERENCE_DATE + timedelta(days=rng.randint(-365, 90)),
+            'status_id': status_id,
+            'notes': None,
+        }
+
+
+def seed_dataset(volumes=None, seed=DEFAULT_SEED, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Adds a generated dataset to the database and returns {table: (rows, seconds)}
+    volumes overrides DEFAULT_VOLUMES, progress(table, rows, seconds) is called after each table
+    Generated doctors have the password 'doctor123'
+    """
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    rng = random.Random(seed)
+    timings = {}
+
+    def load(table, model, rows):
+        started = time.perf_counter()
+        count = _insert(model, rows, batch_size)
+        timings[table] = (count, time.perf_counter() - started)
+        if progress:
+            progress(table, *timings[table])
+
+    # The change log triggers are dropped too, the new rows are logged once loading is done
+    max_ids = {model.__tablename__: db.session.scalar(select(func.max(model.id))) or 0
+               for model in (Client, Enrollment, Appointment)}
+
+    with suspended_triggers(['clients', 'enrollments', 'appointments']):
+        # One hash for every doctor, hashing each would take longer than the whole load
+        load('programs', Program, generate_programs(rng, volumes['programs']))
+        load('doctors', User, generate_doctors(rng, volumes['doctors'], generate_password_hash('doctor123')))
+
+        programs = dict(db.session.execute(select(Program.id, Program.duration)).all())
+        doctor_ids = db.session.scalars(select(User.id).where(User.role.in_(['admin', 'doctor']))).all()
+        first_id = (db.session.scalar(select(func.max(Client.id))) or 0) + 1
+        load('clients', Client, generate_clients(rng, volumes['clients'], first_id, doctor_ids))
+
+        client_ids = range(first_id, first_id + volumes['clients'])
+        if client_ids and programs:
+            load('enrollments', Enrollment, generate_enrollments(rng, volumes['enrollments'], client_ids, programs))
+            load('appointments', Appointment, generate_appointments(
+                rng, volumes['appointments'], client_ids, list(programs), doctor_ids))
+
+    started = time.perf_counter()
+    rebuild_derived_tables()
+    if change_log_available():
+        log_rows_after(max_ids)
+    timings['search index, rollups and change log'] = (None, time.perf_counter() - started)
+    if progress:
+        progress('search index, rollups and change log', None, timings['search index, rollups and change log'][1])
+    return timings
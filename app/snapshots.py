@@ -0,0 +1,112 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import delete, func, insert, select
+from app.model import db, User, Client, Program, Appointment, DailySnapshot, DailyProgramSnapshot
+from app.reports import PROGRAM_STATUS, ENROLLED, COMPLETED, DROPPED, rollups_available, rollup_rows
+
+
+# Daily snapshots
+# The dashboard counters are point in time, so their history is kept as one compact row per day
+# (daily_snapshots) and one row per day per program (daily_program_snapshots)
+# take_daily_snapshot() is run nightly by `flask snapshot-daily` (or on demand) and can be re-run for the same day
+#   - schedule it shortly before midnight, e.g. with cron: 55 23 * * *  cd /srv/app && FLASK_APP=run.py flask snapshot-daily
+#   - a run also snapshots every day missed since the last snapshot (at most MAX_BACKFILL_DAYS), so a failed or
+#     skipped run leaves no gap in /api/trends; new clients, totals and appointments of a backfilled day are exact,
+#     its enrollment counts are the ones at the time of the backfill (the rollups only know the current counts)
+# Trends are then read back with one indexed range scan over the snapshot tables
+
+MAX_BACKFILL_DAYS = 366
+
+def take_daily_snapshot(day=None):
+    """
+    Writes (or rewrites) the snapshot rows for a day
+    The enrollment counts are the counts at the time the snapshot is taken, so a day should be
+    snapshotted at the end of that day; new clients and appointments are always for the given day
+    """
+    day = day or date.today()
+    day_start = datetime.combine(day, time.min)
+    day_end = day_start + timedelta(days=1)
+
+    # Enrollment counts per program and status, read from the report rollup
+    status_counts = {}
+    for program_id, status_id, count in rollup_rows(PROGRAM_STATUS, rollups_available()):
+        status_counts[(program_id, status_id)] = count
+
+    appointments = dict(db.session.execute(
+        select(Appointment.program_id, func.count())
+        .where(Appointment.appointment_date == day)
+        .group_by(Appointment.program_id)
+    ).all())
+
+    totals = db.session.execute(select(
+        select(func.count()).select_from(Client)
+            .where(Client.registered_at < day_end).scalar_subquery(),
+        select(func.count()).select_from(Client)
+            .where(Client.registered_at >= day_start, Client.registered_at < day_end).scalar_subquery(),
+        select(func.count()).select_from(User)
+            .where(User.last_login >= day_end - timedelta(days=7), User.last_login < day_end).scalar_subquery(),
+    )).one()
+
+    program_ids = db.session.scalars(select(Program.id)).all()
+    program_rows = [
+        {
+            'program_id': program_id,
+            'day': day,
+            'active_enrollments': status_counts.get((program_id, ENROLLED), 0),
+            'completed_enrollments': status_counts.get((program_id, COMPLETED), 0),
+            'dropped_enrollments': status_counts.get((program_id, DROPPED), 0),
+            'appointments': appointments.get(program_id, 0),
+        }
+        for program_id in program_ids
+    ]
+
+    db.session.execute(delete(DailyProgramSnapshot).where(DailyProgramSnapshot.day == day))
+    db.session.execute(delete(DailySnapshot).where(DailySnapshot.day == day))
+    if program_rows:
+        db.session.execute(insert(DailyProgramSnapshot), program_rows)
+    db.session.add(DailySnapshot(
+        day=day,
+        total_clients=totals[0],
+        new_clients=totals[1],
+        active_users=totals[2],
+        active_enrollments=sum(c for (_, s), c in status_counts.items() if s == ENROLLED),
+        completed_enrollments=sum(c for (_, s), c in status_counts.items() if s == COMPLETED),
+        dropped_enrollments=sum(c for (_, s), c in status_counts.items() if s == DROPPED),
+        appointments=sum(appointments.values()),
+        taken_at=datetime.utcnow(),
+    ))
+    db.session.commit()
+    return day
+
+
+def missing_snapshot_days(until=None, max_days=MAX_BACKFILL_DAYS):
+    """The days after the last snapshot up to and including until (today by default), oldest first"""
+    until = until or date.today()
+    last = db.session.scalar(select(func.max(DailySnapshot.day)).where(DailySnapshot.day <= until))
+    first = max(last + timedelta(days=1), until - timedelta(days=max_days - 1)) if last else until
+    return [first + timedelta(days=n) for n in range((until - first).days + 1)]
+
+
+def take_missing_snapshots(until=None, max_days=MAX_BACKFILL_DAYS):
+    """Snapshots every day missed since the last snapshot and until itself (re-taken if it exists), returns the days"""
+    until = until or date.today()
+    days = [day for day in missing_snapshot_days(until, max_days) if day != until]
+    for day in days:
+        take_daily_snapshot(day)
+    take_daily_snapshot(until)
+    return days + [until]
+
+
+def snapshot_range(start, end):
+    """System wide snapshots from start to end (inclusive), oldest first"""
+    return DailySnapshot.query.filter(
+        DailySnapshot.day >= start, DailySnapshot.day <= end
+    ).order_by(DailySnapshot.day).all()
+
+
+def program_snapshot_range(program_id, start, end):
+    """One program's snapshots from start to end (inclusive), oldest first"""
+    return DailyProgramSnapshot.query.filter(
+        DailyProgramSnapshot.program_id == program_id,
+        DailyProgramSnapshot.day >= start,
+        DailyProgramSnapshot.day <= end
+    ).order_by(DailyProgramSnapshot.day).all()
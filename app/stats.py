@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, func, or_
+from app.cache import TTLCache
+from app.model import db, User, Client, Program, Enrollment
+from app.logins import last_login_buffer
+from app.invalidation import invalidation_bus
+from app.statuses import StatusId
+
+
+# Dashboard statistics
+# All the counters on the index page are computed in one aggregate query
+# and kept in a short lived per-process cache
+# Views that change any of the counted tables call invalidate_dashboard_stats() after committing,
+# the other workers drop theirs when the change reaches them on the invalidation bus
+
+DEFAULT_DASHBOARD_STATS_TTL = 30  # seconds
+
+_stats_cache = TTLCache(ttl=DEFAULT_DASHBOARD_STATS_TTL)
+_STATS_KEY = 'dashboard'
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def compute_dashboard_stats():
+    """
+    Runs one SELECT of scalar subqueries, one per counter
+    Every subquery is answered from an index (see flask check-query-plans)
+    Logins that have not been written to users.last_login yet are counted from the login buffer
+    """
+    now = datetime.utcnow()
+    seven_days_ago = now - timedelta(days=7)
+    one_day_ago = now - timedelta(days=1)
+
+    counters = [
+        _count(Program).label('total_programs'),
+        _count(Client).label('total_clients'),
+        _count(Enrollment, Enrollment.status_id == StatusId.ENROLLED).label('active_enrollments'),
+        _count(User).label('total_users'),
+        _count(User, User.last_login >= seven_days_ago).label('active_users'),
+        _count(User, User.role == 'admin').label('admin_users'),
+        _count(User, User.created_at >= one_day_ago).label('new_users_24h'),
+    ]
+
+    # Users with a recent pending login that the database does not count as active yet
+    pending_ids = [user_id for user_id, when in last_login_buffer.pending_logins().items() if when >= seven_days_ago]
+    if pending_ids:
+        counters.append(_count(
+            User,
+            User.id.in_(pending_ids),
+            or_(User.last_login < seven_days_ago, User.last_login.is_(None))
+        ).label('pending_active_users'))
+
+    stats = dict(db.session.execute(select(*counters)).one()._mapping)
+    stats['active_users'] += stats.pop('pending_active_users', 0)
+    return stats
+
+
+def get_dashboard_stats():
+    ttl = current_app.config.get('DASHBOARD_STATS_TTL', DEFAULT_DASHBOARD_STATS_TTL)
+    stats = _stats_cache.get(_STATS_KEY)
+    if stats is None:
+        stats = compute_dashboard_stats()
+        _stats_cache.set(_STATS_KEY, stats, ttl=ttl)
+    return stats
+
+
+def invalidate_dashboard_stats():
+    _stats_cache.invalidate(_STATS_KEY)
+
+
+# Changes to any counted table, committed in this worker or another one (see app/invalidation.py)
+for _entity in ('dashboard', 'user', 'client', 'enrollment', 'program'):
+    invalidation_bus.subscribe(_entity, lambda entity_id: invalidate_dashboard_stats())
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from enum import IntEnum
+from types import MappingProxyType
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from app.model import db, Status
+
+
+# Status registry
+# The status table is a fixed list of eight rows (see the Status model), so instead of joining or lazy loading
+# it for every enrollment and appointment, the rows are read once when the app starts and names are resolved
+# in memory from the status_id column
+#   - StatusId gives the ids names in code, e.g. Enrollment.status_id == StatusId.ENROLLED
+#   - status_name(status_id) is also available in the templates
+#   - the names come from the database, DEFAULT_STATUSES is only used when the table cannot be read
+# Adding or renaming a status needs a restart of the workers
+
+class StatusId(IntEnum):
+    # status for enrollment
+    ENROLLED = 1
+    COMPLETED = 2
+    DROPPED = 3
+    # appointment notification
+    SENT = 4
+    READ = 5
+    # appointment status
+    PENDING = 6
+    CONFIRMED = 7
+    CANCELLED = 8
+
+
+StatusInfo = namedtuple('StatusInfo', ['id', 'name', 'description'])
+
+DEFAULT_STATUSES = (
+    StatusInfo(StatusId.ENROLLED, 'Enrolled', 'Enrolled in the program'),
+    StatusInfo(StatusId.COMPLETED, 'Completed', 'Completed the program'),
+    StatusInfo(StatusId.DROPPED, 'Dropped', 'Dropped out of the program'),
+    StatusInfo(StatusId.SENT, 'sent', 'sent appointment'),
+    StatusInfo(StatusId.READ, 'is-read', 'is-read appointment'),
+    StatusInfo(StatusId.PENDING, 'Pending', 'Pending appointment'),
+    StatusInfo(StatusId.CONFIRMED, 'Confirmed', 'Confirmed appointment'),
+    StatusInfo(StatusId.CANCELLED, 'Cancelled', 'Cancelled appointment'),
+)
+
+UNKNOWN_STATUS = 'N/A'
+
+
+class StatusRegistry:
+
+    def __init__(self, statuses=DEFAULT_STATUSES):
+        self._statuses = MappingProxyType({status.id: status for status in statuses})
+
+    def init_app(self, app):
+        with app.app_context():
+            try:
+                rows = db.session.execute(select(Status.id, Status.name, Status.description)).all()
+            except OperationalError:
+                rows = []
+            db.session.remove()
+        if rows:
+            self._statuses = MappingProxyType({row.id: StatusInfo(*row) for row in rows})
+        app.add_template_global(status_name)
+
+    def get(self, status_id):
+        return self._statuses.get(status_id)
+
+    def name(self, status_id):
+        status = self._statuses.get(status_id)
+        return status.name if status is not None else UNKNOWN_STATUS
+
+    def __iter__(self):
+        return iter(self._statuses.values())
+
+
+status_registry = StatusRegistry()
+
+
+def status_name(status_id):
+    return status_registry.name(status_id)
@@ -0,0 +1,255 @@
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from flask import g, request
+from flask_login import current_user
+from app.benchmarks import percentile
+from app.model import User
+
+
+# Traffic recording
+# With TRAFFIC_LOG set (a file path) every request is appended to that file as one compact JSON line:
+#   {"t": start time, "m": method, "p": path, "a": query args, "j": JSON body, "r": user role,
+#    "e": endpoint, "s": status, "ms": server time}
+#   - only JSON bodies up to TRAFFIC_MAX_BODY bytes are kept, form posts (logins, registrations) are recorded
+#     without their body so no passwords or registration forms are written
+#   - free text query args (REDACTED_ARGS, the search box) are written as REDACTED, since people search by name,
+#     phone number or email; replayed searches therefore look for a term that matches nothing
+#   - the log still holds patient data: paths carry client ids and the enrollment bodies pair client ids with
+#     program ids, so it shows who is enrolled in what once joined with the database. Keep it where the database
+#     is kept, with the same access, and delete it when the replay is done
+#   - TRAFFIC_SAMPLE (0 to 1, default 1) records a share of the requests
+#   - each gunicorn worker appends whole lines to the same file
+#
+# Traffic replay
+# replay_traffic() sends the recorded requests again, against this app through the test client
+# or against a running server (e.g. a local gunicorn), keeping their relative timing (sped up by a factor)
+# on a thread pool, and reports throughput, latency percentiles and error rates per endpoint
+# A request recorded for a role is sent with a session for the first user with that role,
+# and change feed requests are sent with the feed token (CHANGE_FEED_TOKEN, or the one given to replay_traffic)
+
+DEFAULT_SAMPLE = 1.0
+DEFAULT_MAX_BODY = 64 * 1024
+SKIPPED_ENDPOINTS = ('static', 'main.metrics')
+REDACTED_ARGS = ('q',)
+REDACTED = 'REDACTED'
+FEED_ENDPOINTS = ('api.get_changes',)
+
+
+def redact_args(args):
+    """The query args as {name: [values]}, with the free text ones replaced by REDACTED"""
+    return {name: [REDACTED] * len(values) if name in REDACTED_ARGS else values
+            for name, values in args.to_dict(flat=False).items()}
+
+
+class TrafficRecorder:
+
+    def __init__(self):
+        self.path = None
+        self.sample = DEFAULT_SAMPLE
+        self.max_body = DEFAULT_MAX_BODY
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.path = app.config.get('TRAFFIC_LOG')
+        if not self.path:
+            return
+        self.sample = float(app.config.get('TRAFFIC_SAMPLE', DEFAULT_SAMPLE))
+        self.max_body = int(app.config.get('TRAFFIC_MAX_BODY', DEFAULT_MAX_BODY))
+        app.before_request(self._start_request)
+        app.after_request(self._record)
+
+    def _start_request(self):
+        if self.sample >= 1 or random.random() < self.sample:
+            g.traffic_started = (time.time(), time.perf_counter())
+
+    def _record(self, response):
+        started = g.pop('traffic_started', None)
+        if started is None or request.endpoint in SKIPPED_ENDPOINTS:
+            return response
+
+        entry = {
+            't': round(started[0], 3),
+            'm': request.method,
+            'p': request.path,
+            'e': request.endpoint,
+            's': response.status_code,
+            'ms': round((time.perf_counter() - started[1]) * 1000, 1),
+            'r': current_user.role if current_user.is_authenticated else None,
+        }
+        if request.args:
+            entry['a'] = redact_args(request.args)
+        if request.is_json and (request.content_length or 0) <= self.max_body:
+            body = request.get_json(silent=True)
+            if body is not None:
+                entry['j'] = body
+        self.write(entry)
+        return response
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            # Opened once per process (gunicorn forks the workers after the app is created)
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, 'a', buffering=1, encoding='utf-8')
+                self._pid = os.getpid()
+            self._file.write(line)
+
+
+traffic_recorder = TrafficRecorder()
+
+
+def read_traffic(path, limit=None):
+    """The recorded requests in the order they were made"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record['t'])
+    return records[:limit] if limit else records
+
+
+def session_cookies(app, roles):
+    """A signed session cookie, per role, logged in as the first user with that role"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = {}
+    with app.app_context():
+        for role in roles:
+            user = User.query.filter_by(role=role).order_by(User.id).first()
+            if user is not None:
+                cookies[role] = serializer.dumps({'_user_id': str(user.id), '_fresh': True})
+    return cookies
+
+
+def request_headers(record, cookies, cookie_name, feed_token=None):
+    """The session cookie for the record's role, and the bearer token for the change feed"""
+    headers = {}
+    if record.get('r') in cookies:
+        headers['Cookie'] = f"{cookie_name}={cookies[record['r']]}"
+    if feed_token and record.get('e') in FEED_ENDPOINTS:
+        headers['Authorization'] = f'Bearer {feed_token}'
+    return headers
+
+
+class _TestClientTarget:
+    """Sends requests through the app's test client, one client per thread"""
+
+    def __init__(self, app, cookies, feed_token=None):
+        self.app = app
+        self.cookies = cookies
+        self.feed_token = feed_token
+        self.cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+        self._local = threading.local()
+
+    def send(self, record):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self.app.test_client(use_cookies=False)
+        headers = request_headers(record, self.cookies, self.cookie_name, self.feed_token)
+        response = http.open(record['p'], method=record['m'], query_string=record.get('a'),
+                             json=record.get('j'), headers=headers)
+        response.get_data()
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect is the response being measured, following it would time a second request
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class _HTTPTarget:
+    """Sends requests to a running server, e.g. http://127.0.0.1:8000"""
+
+    def __init__(self, base_url, cookies, cookie_name='session', feed_token=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = cookies
+        self.cookie_name = cookie_name
+        self.feed_token = feed_token
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def send(self, record):
+        url = self.base_url + record['p']
+        if record.get('a'):
+            url += '?' + urlencode(record['a'], doseq=True)
+        data, headers = None, request_headers(record, self.cookies, self.cookie_name, self.feed_token)
+        if 'j' in record:
+            data = json.dumps(record['j']).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(url, data=data, headers=headers, method=record['m'])
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def replay_traffic(app, records, concurrency=8, speedup=1.0, target_url=None, feed_token=None):
+    """
+    Replays the records and returns (summary, {endpoint: stats})
+    speedup 2 sends the requests twice as fast as they were recorded, 0 sends them as fast as possible
+    feed_token is sent to the change feed, this app's CHANGE_FEED_TOKEN by default
+    Errors are 5xx responses and requests that failed to send; 4xx responses are counted separately
+    """
+    cookies = session_cookies(app, {record['r'] for record in records if record.get('r')})
+    feed_token = feed_token or app.config.get('CHANGE_FEED_TOKEN')
+    if target_url:
+        target = _HTTPTarget(target_url, cookies, app.config.get('SESSION_COOKIE_NAME', 'session'), feed_token)
+    else:
+        target = _TestClientTarget(app, cookies, feed_token)
+
+    results = []  # (endpoint, seconds, status or None)
+    lock = threading.Lock()
+
+    def send(record):
+        started = time.perf_counter()
+        try:
+            status = target.send(record)
+        except Exception:
+            status = None
+        with lock:
+            results.append((record.get('e') or 'unmatched', time.perf_counter() - started, status))
+
+    started = time.perf_counter()
+    first = records[0]['t'] if records else 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speedup:
+                delay = (record['t'] - first) / speedup - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, record)
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint in sorted({endpoint for endpoint, _, _ in results}):
+        rows = [(seconds, status) for e, seconds, status in results if e == endpoint]
+        latencies = [seconds for seconds, _ in rows]
+        endpoints[endpoint] = {
+            'requests': len(rows),
+            'per_second': round(len(rows) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'errors': sum(1 for _, status in rows if status is None or status >= 500),
+            'client_errors': sum(1 for _, status in rows if status is not None and 400 <= status < 500),
+        }
+    summary = {
+        'requests': len(results),
+        'seconds': round(elapsed, 2),
+        'per_second': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'errors': sum(stats['errors'] for stats in endpoints.values()),
+    }
+    return summary, endpoints
@@ -0,0 +1,84 @@
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app.model import db, User
+from app.invalidation import invalidation_bus
+
+
+# Logged in user cache
+# Flask-Login's user_loader runs on every authenticated request (including every fetch() to the JSON api)
+# Instead of loading the full User row each time, a small record (id, username, role) is cached per process
+#   - entries expire after USER_CACHE_TTL seconds, so changes made in another gunicorn worker
+#     (a deleted user or a new role) are picked up within that time
+#   - the worker that makes the change evicts the entry straight away, either with invalidate_user()
+#     or from the flush listener below when a User row is updated or deleted through the ORM
+#   - the other workers evict it when they see the change on the invalidation bus (see app/invalidation.py)
+#   - the records are plain objects, never ORM instances, so nothing is merged back into the session
+
+DEFAULT_USER_CACHE_TTL = 30  # seconds
+DEFAULT_USER_CACHE_SIZE = 1024
+
+_user_cache = None
+
+
+class CachedUser(UserMixin):
+    """The parts of a User that the views use through current_user"""
+
+    __slots__ = ('id', 'username', 'role')
+
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    def __repr__(self):
+        return f"<CachedUser {self.id} {self.username} ({self.role})>"
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = TTLCache(
+            ttl=current_app.config.get('USER_CACHE_TTL', DEFAULT_USER_CACHE_TTL),
+            maxsize=current_app.config.get('USER_CACHE_SIZE', DEFAULT_USER_CACHE_SIZE),
+        )
+    return _user_cache
+
+
+def load_cached_user(user_id):
+    cache = get_user_cache()
+    user = cache.get(user_id)
+    if user is None:
+        row = db.session.execute(
+            select(User.id, User.username, User.role).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        user = CachedUser(row.id, row.username, row.role)
+        cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id):
+    if _user_cache is None:
+        return
+    if user_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.invalidate(int(user_id))
+
+
+invalidation_bus.subscribe('user', invalidate_user)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_users(session, flush_context):
+    # Role changes and deletes made anywhere (views, cli commands) evict the cached record
+    # A rollback afterwards only costs a cache miss
+    if _user_cache is None:
+        return
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            _user_cache.invalidate(obj.id)
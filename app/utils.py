@@ -1,5 +1,5 @@
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, get_flashed_messages, stream_template
 from flask_login import current_user
 
 def login_required(f):
@@ -31,4 +31,12 @@ def doctor_required(f):
             flash("You need to be logged in to access this page.", "warning")
             return redirect(url_for('main.login'))
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+# Streams a template to the client while it renders
+# The session cookie is sent before the body, so flashed messages are popped here (and cached for
+# the template) instead of while streaming, otherwise they would be shown again on the next page
+def stream_page(template_name, **context):
+    get_flashed_messages()
+    return stream_template(template_name, **context)
@@ -0,0 +1,72 @@
+"""Add clients_fts full-text search index
+
+Revision ID: 3c1f9a2e7b41
+Revises: a6ec8a380125
+Create Date: 2026-10-18 09:12:40.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a2e7b41'
+down_revision = 'a6ec8a380125'
+branch_labels = None
+depends_on = None
+
+
+# The FTS table mirrors clients.full_name, phone and email (external content table)
+# and the triggers keep it in sync on insert, update and delete
+CLIENT_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+        full_name, phone, email,
+        content='clients', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clients_fts_ai AFTER INSERT ON clients BEGIN
+        INSERT INTO clients_fts(rowid, full_name, phone, email)
+        VALUES (new.id, new.full_name, new.phone, new.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clients_fts_ad AFTER DELETE ON clients BEGIN
+        INSERT INTO clients_fts(clients_fts, rowid, full_name, phone, email)
+        VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clients_fts_au AFTER UPDATE OF full_name, phone, email ON clients BEGIN
+        INSERT INTO clients_fts(clients_fts, rowid, full_name, phone, email)
+        VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+        INSERT INTO clients_fts(rowid, full_name, phone, email)
+        VALUES (new.id, new.full_name, new.phone, new.email);
+    END
+    """,
+]
+
+
+def upgrade():
+    # FTS5 is SQLite only, other databases keep using LIKE searches
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for statement in CLIENT_FTS_DDL:
+        op.execute(statement)
+
+    # Backfill the index with the clients that already exist
+    op.execute("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS clients_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS clients_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS clients_fts_ai")
+    op.execute("DROP TABLE IF EXISTS clients_fts")
@@ -0,0 +1,54 @@
+"""Add indexes for hot lookup paths
+
+Revision ID: 8b27d4e1c9f0
+Revises: 3c1f9a2e7b41
+Create Date: 2026-10-18 10:05:11.842716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b27d4e1c9f0'
+down_revision = '3c1f9a2e7b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_username', ['username'], unique=False)
+        batch_op.create_index('ix_users_last_login', ['last_login'], unique=False)
+        batch_op.create_index('ix_users_created_at', ['created_at'], unique=False)
+        batch_op.create_index('ix_users_role', ['role'], unique=False)
+
+    with op.batch_alter_table('clients', schema=None) as batch_op:
+        batch_op.create_index('ix_clients_date_of_birth', ['date_of_birth'], unique=False)
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollments_client_status', ['client_id', 'status_id'], unique=False)
+        batch_op.create_index('ix_enrollments_program_status', ['program_id', 'status_id', 'client_id'], unique=False)
+        batch_op.create_index('ix_enrollments_status', ['status_id'], unique=False)
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_client_date', ['client_id', 'appointment_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_client_date')
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_status')
+        batch_op.drop_index('ix_enrollments_program_status')
+        batch_op.drop_index('ix_enrollments_client_status')
+
+    with op.batch_alter_table('clients', schema=None) as batch_op:
+        batch_op.drop_index('ix_clients_date_of_birth')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_role')
+        batch_op.drop_index('ix_users_created_at')
+        batch_op.drop_index('ix_users_last_login')
+        batch_op.drop_index('ix_users_username')
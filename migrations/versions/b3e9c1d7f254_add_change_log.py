@@ -0,0 +1,119 @@
+"""Add change log
+
+Revision ID: b3e9c1d7f254
+Revises: a7d3f5b2c8e1
+Create Date: 2026-10-18 20:12:37.604518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9c1d7f254'
+down_revision = 'a7d3f5b2c8e1'
+branch_labels = None
+depends_on = None
+
+
+# Every insert, update and delete of a client, enrollment or appointment appends a row to change_log
+# in the same transaction, whichever way it was written (ORM, bulk insert, import)
+CHANGE_LOG_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_clients_ai AFTER INSERT ON clients BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('client', new.id, new.id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_clients_au AFTER UPDATE ON clients BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('client', new.id, new.id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_clients_ad AFTER DELETE ON clients BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('client', old.id, old.id, 'delete', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_enrollments_ai AFTER INSERT ON enrollments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('enrollment', new.id, new.client_id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_enrollments_au AFTER UPDATE ON enrollments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('enrollment', new.id, new.client_id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_enrollments_ad AFTER DELETE ON enrollments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('enrollment', old.id, old.client_id, 'delete', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_appointments_ai AFTER INSERT ON appointments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('appointment', new.id, new.client_id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_appointments_au AFTER UPDATE ON appointments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('appointment', new.id, new.client_id, 'upsert', CURRENT_TIMESTAMP);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_appointments_ad AFTER DELETE ON appointments BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        VALUES ('appointment', old.id, old.client_id, 'delete', CURRENT_TIMESTAMP);
+    END
+    """,
+]
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=True),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('seq'),
+    sqlite_autoincrement=True
+    )
+
+    # Triggers are SQLite syntax, like the report rollups
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for statement in CHANGE_LOG_TRIGGERS:
+        op.execute(statement)
+
+    # The existing rows start the log, so a mirror that reads it from the beginning gets everything
+    op.execute("""
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'client', id, id, 'upsert', CURRENT_TIMESTAMP FROM clients ORDER BY id
+    """)
+    op.execute("""
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'enrollment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM enrollments ORDER BY id
+    """)
+    op.execute("""
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'appointment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM appointments ORDER BY id
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('clients', 'enrollments', 'appointments'):
+            for trigger in (f'change_log_{table}_ai', f'change_log_{table}_au', f'change_log_{table}_ad'):
+                op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    op.drop_table('change_log')
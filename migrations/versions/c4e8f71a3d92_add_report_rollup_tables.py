@@ -0,0 +1,166 @@
+"""Add report rollup tables
+
+Revision ID: c4e8f71a3d92
+Revises: 8b27d4e1c9f0
+Create Date: 2026-10-18 13:41:27.506114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8f71a3d92'
+down_revision = '8b27d4e1c9f0'
+branch_labels = None
+depends_on = None
+
+
+# The rollups are kept up to date by triggers, every write adjusts the counts it touches
+#   report_program_status        enrollments per program and status
+#   report_program_demographics  enrollments per program, status, client gender and client birth year
+#   report_registrations         clients registered per month
+ROLLUP_TRIGGERS = [
+    # enrollments
+    """
+    CREATE TRIGGER IF NOT EXISTS report_enrollments_ai AFTER INSERT ON enrollments BEGIN
+        INSERT INTO report_program_status (program_id, status_id, enrollments)
+        VALUES (new.program_id, new.status_id, 1)
+        ON CONFLICT (program_id, status_id) DO UPDATE SET enrollments = enrollments + 1;
+
+        INSERT INTO report_program_demographics (program_id, status_id, gender, birth_year, enrollments)
+        SELECT new.program_id, new.status_id, COALESCE(c.gender, 'unknown'),
+               COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0), 1
+        FROM clients c WHERE c.id = new.client_id
+        ON CONFLICT (program_id, status_id, gender, birth_year) DO UPDATE SET enrollments = enrollments + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_enrollments_ad AFTER DELETE ON enrollments BEGIN
+        UPDATE report_program_status SET enrollments = enrollments - 1
+        WHERE program_id = old.program_id AND status_id = old.status_id;
+
+        UPDATE report_program_demographics SET enrollments = enrollments - 1
+        WHERE program_id = old.program_id AND status_id = old.status_id
+          AND (gender, birth_year) = (
+              SELECT COALESCE(c.gender, 'unknown'), COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0)
+              FROM clients c WHERE c.id = old.client_id
+          );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_enrollments_au AFTER UPDATE OF client_id, program_id, status_id ON enrollments BEGIN
+        UPDATE report_program_status SET enrollments = enrollments - 1
+        WHERE program_id = old.program_id AND status_id = old.status_id;
+
+        INSERT INTO report_program_status (program_id, status_id, enrollments)
+        VALUES (new.program_id, new.status_id, 1)
+        ON CONFLICT (program_id, status_id) DO UPDATE SET enrollments = enrollments + 1;
+
+        UPDATE report_program_demographics SET enrollments = enrollments - 1
+        WHERE program_id = old.program_id AND status_id = old.status_id
+          AND (gender, birth_year) = (
+              SELECT COALESCE(c.gender, 'unknown'), COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0)
+              FROM clients c WHERE c.id = old.client_id
+          );
+
+        INSERT INTO report_program_demographics (program_id, status_id, gender, birth_year, enrollments)
+        SELECT new.program_id, new.status_id, COALESCE(c.gender, 'unknown'),
+               COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0), 1
+        FROM clients c WHERE c.id = new.client_id
+        ON CONFLICT (program_id, status_id, gender, birth_year) DO UPDATE SET enrollments = enrollments + 1;
+    END
+    """,
+    # clients
+    """
+    CREATE TRIGGER IF NOT EXISTS report_clients_ai AFTER INSERT ON clients
+    WHEN new.registered_at IS NOT NULL BEGIN
+        INSERT INTO report_registrations (month, clients)
+        VALUES (strftime('%Y-%m', new.registered_at), 1)
+        ON CONFLICT (month) DO UPDATE SET clients = clients + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS report_clients_ad AFTER DELETE ON clients
+    WHEN old.registered_at IS NOT NULL BEGIN
+        UPDATE report_registrations SET clients = clients - 1
+        WHERE month = strftime('%Y-%m', old.registered_at);
+    END
+    """,
+    # a client's gender or date of birth changing moves all of their enrollments to another bucket
+    """
+    CREATE TRIGGER IF NOT EXISTS report_clients_au AFTER UPDATE OF gender, date_of_birth ON clients BEGIN
+        INSERT INTO report_program_demographics (program_id, status_id, gender, birth_year, enrollments)
+        SELECT e.program_id, e.status_id, COALESCE(old.gender, 'unknown'),
+               COALESCE(CAST(strftime('%Y', old.date_of_birth) AS INTEGER), 0), -COUNT(*)
+        FROM enrollments e WHERE e.client_id = old.id
+        GROUP BY e.program_id, e.status_id
+        ON CONFLICT (program_id, status_id, gender, birth_year) DO UPDATE SET enrollments = enrollments + excluded.enrollments;
+
+        INSERT INTO report_program_demographics (program_id, status_id, gender, birth_year, enrollments)
+        SELECT e.program_id, e.status_id, COALESCE(new.gender, 'unknown'),
+               COALESCE(CAST(strftime('%Y', new.date_of_birth) AS INTEGER), 0), COUNT(*)
+        FROM enrollments e WHERE e.client_id = new.id
+        GROUP BY e.program_id, e.status_id
+        ON CONFLICT (program_id, status_id, gender, birth_year) DO UPDATE SET enrollments = enrollments + excluded.enrollments;
+    END
+    """,
+]
+
+
+def upgrade():
+    op.create_table('report_program_status',
+    sa.Column('program_id', sa.Integer(), nullable=False),
+    sa.Column('status_id', sa.Integer(), nullable=False),
+    sa.Column('enrollments', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('program_id', 'status_id')
+    )
+    op.create_table('report_program_demographics',
+    sa.Column('program_id', sa.Integer(), nullable=False),
+    sa.Column('status_id', sa.Integer(), nullable=False),
+    sa.Column('gender', sa.String(length=10), nullable=False),
+    sa.Column('birth_year', sa.Integer(), nullable=False),
+    sa.Column('enrollments', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('program_id', 'status_id', 'gender', 'birth_year')
+    )
+    op.create_table('report_registrations',
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('clients', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('month')
+    )
+
+    # Triggers and the upserts they use are SQLite syntax, other databases rebuild with flask refresh-reports
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for statement in ROLLUP_TRIGGERS:
+        op.execute(statement)
+
+    # Backfill the rollups from the existing rows
+    op.execute("""
+        INSERT INTO report_program_status (program_id, status_id, enrollments)
+        SELECT program_id, status_id, COUNT(*) FROM enrollments GROUP BY program_id, status_id
+    """)
+    op.execute("""
+        INSERT INTO report_program_demographics (program_id, status_id, gender, birth_year, enrollments)
+        SELECT e.program_id, e.status_id, COALESCE(c.gender, 'unknown'),
+               COALESCE(CAST(strftime('%Y', c.date_of_birth) AS INTEGER), 0), COUNT(*)
+        FROM enrollments e JOIN clients c ON c.id = e.client_id
+        GROUP BY 1, 2, 3, 4
+    """)
+    op.execute("""
+        INSERT INTO report_registrations (month, clients)
+        SELECT strftime('%Y-%m', registered_at), COUNT(*) FROM clients
+        WHERE registered_at IS NOT NULL GROUP BY 1
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('report_clients_au', 'report_clients_ad', 'report_clients_ai',
+                        'report_enrollments_au', 'report_enrollments_ad', 'report_enrollments_ai'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    op.drop_table('report_registrations')
+    op.drop_table('report_program_demographics')
+    op.drop_table('report_program_status')
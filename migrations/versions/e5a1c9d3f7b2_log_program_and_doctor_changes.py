@@ -0,0 +1,69 @@
+"""Log program and doctor changes
+
+Revision ID: e5a1c9d3f7b2
+Revises: b3e9c1d7f254
+Create Date: 2026-10-18 22:41:09.318402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c9d3f7b2'
+down_revision = 'b3e9c1d7f254'
+branch_labels = None
+depends_on = None
+
+
+# The feed's enrollments and appointments carry their program name and doctor username, so renaming or deleting
+# a program or a user logs an upsert for every row that shows it, and a mirror picks up the new name
+DEPENDENT_ROW_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_programs_au AFTER UPDATE OF name ON programs
+    WHEN new.name IS NOT old.name BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'enrollment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM enrollments WHERE program_id = new.id;
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'appointment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM appointments WHERE program_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_programs_ad AFTER DELETE ON programs BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'enrollment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM enrollments WHERE program_id = old.id;
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'appointment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM appointments WHERE program_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_users_au AFTER UPDATE OF username ON users
+    WHEN new.username IS NOT old.username BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'appointment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM appointments WHERE doctor_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS change_log_users_ad AFTER DELETE ON users BEGIN
+        INSERT INTO change_log (entity, entity_id, client_id, op, changed_at)
+        SELECT 'appointment', id, client_id, 'upsert', CURRENT_TIMESTAMP FROM appointments WHERE doctor_id = old.id;
+    END
+    """,
+]
+
+
+def upgrade():
+    # Triggers are SQLite syntax, like the change log triggers they extend
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for statement in DEPENDENT_ROW_TRIGGERS:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for trigger in ('change_log_programs_au', 'change_log_programs_ad', 'change_log_users_au', 'change_log_users_ad'):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
@@ -0,0 +1,51 @@
+"""Update the registration rollup when registered_at changes
+
+Revision ID: f2b6d8a4c1e9
+Revises: e5a1c9d3f7b2
+Create Date: 2026-10-19 10:18:52.640317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d8a4c1e9'
+down_revision = 'e5a1c9d3f7b2'
+branch_labels = None
+depends_on = None
+
+
+# Editing or backfilling a client's registered_at moves them from the old month to the new one in
+# report_registrations, like the insert and delete triggers of the add_report_rollup_tables migration
+REGISTRATION_UPDATE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS report_clients_registered_au AFTER UPDATE OF registered_at ON clients
+    WHEN strftime('%Y-%m', old.registered_at) IS NOT strftime('%Y-%m', new.registered_at) BEGIN
+        UPDATE report_registrations SET clients = clients - 1
+        WHERE old.registered_at IS NOT NULL AND month = strftime('%Y-%m', old.registered_at);
+
+        INSERT INTO report_registrations (month, clients)
+        SELECT strftime('%Y-%m', new.registered_at), 1 WHERE new.registered_at IS NOT NULL
+        ON CONFLICT (month) DO UPDATE SET clients = clients + 1;
+    END
+"""
+
+
+def upgrade():
+    # Triggers are SQLite syntax, other databases rebuild with flask refresh-reports
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute(REGISTRATION_UPDATE_TRIGGER)
+    # Edits made before this trigger existed are not in the rollup yet
+    op.execute("DELETE FROM report_registrations")
+    op.execute("""
+        INSERT INTO report_registrations (month, clients)
+        SELECT strftime('%Y-%m', registered_at), COUNT(*) FROM clients
+        WHERE registered_at IS NOT NULL GROUP BY 1
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS report_clients_registered_au")
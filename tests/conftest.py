@@ -0,0 +1,77 @@
+import os
+import shutil
+from datetime import date, timedelta
+import pytest
+from flask_migrate import upgrade
+from app import create_app
+from app.model import db, User, Client, Program, Enrollment, Appointment
+from app.statuses import StatusId
+
+
+# The migrations start from the schema of instance/clients.db rather than an empty database,
+# so the tests run on a migrated copy of it in a temporary directory (the original is never opened)
+SOURCE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'clients.db')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('db') / 'clients.db'
+    shutil.copyfile(SOURCE_DB, db_path)
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv('DATABASE_URL', f'sqlite:///{db_path}')
+        env.setenv('CHANGE_FEED_TOKEN', 'test-feed-token')
+        env.delenv('TRAFFIC_LOG', raising=False)
+
+        # The app's caches and the invalidation bus look at the schema when they start, so migrate first
+        migration_app = create_app()
+        with migration_app.app_context():
+            upgrade()
+            db.session.remove()
+
+        app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, LAST_LOGIN_FLUSH_INTERVAL=0)
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def admin_id(app):
+    with app.app_context():
+        return db.session.scalar(db.select(User.id).where(User.role == 'admin').order_by(User.id))
+
+
+@pytest.fixture
+def admin_client(app, admin_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+    return client
+
+
+@pytest.fixture
+def profile_client_id(app, admin_id):
+    """A new client with active, completed and dropped enrollments and appointments with a doctor"""
+    with app.app_context():
+        doctor_id = db.session.scalar(db.select(User.id).where(User.role == 'doctor').order_by(User.id))
+        program_ids = db.session.scalars(db.select(Program.id).order_by(Program.id)).all()
+        today = date.today()
+        client = Client(full_name='Profile Test Client', date_of_birth=date(1990, 1, 1), gender='female',
+                        phone='0700000000', email='profile.test@example.com', registered_by=admin_id)
+        db.session.add(client)
+        db.session.flush()
+        for n, status_id in enumerate([StatusId.ENROLLED, StatusId.ENROLLED, StatusId.COMPLETED, StatusId.DROPPED]):
+            db.session.add(Enrollment(client_id=client.id, program_id=program_ids[n % len(program_ids)],
+                                      status_id=status_id, enrollment_date=today, start_date=today,
+                                      end_date=today + timedelta(days=30)))
+        # A program none of the enrollments use, so the appointments cannot borrow it from the identity map
+        program = Program(name='Profile Test Program', description='', start_date=today, duration=4)
+        db.session.add(program)
+        db.session.flush()
+        for n in range(3):
+            db.session.add(Appointment(client_id=client.id, doctor_id=doctor_id, program_id=program.id,
+                                       appointment_date=today + timedelta(days=n), status_id=StatusId.PENDING))
+        db.session.commit()
+        client_id = client.id
+        db.session.remove()
+    return client_id
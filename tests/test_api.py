@@ -0,0 +1,54 @@
+def test_bulk_enroll_without_login_is_a_json_401(client):
+    response = client.post('/api/enrollments/bulk', json={'items': [{'clientId': 1, 'programId': 1}]})
+    assert response.status_code == 401
+    assert response.json == {'error': 'Login required'}
+
+
+def test_bulk_enroll_reports_every_item(admin_client, profile_client_id):
+    response = admin_client.post('/api/enrollments/bulk', json={'items': [
+        {'clientId': profile_client_id, 'programId': 1},
+        {'clientId': profile_client_id, 'programId': 999999},
+    ]})
+    assert response.status_code == 200
+    assert [item['result'] for item in response.json['results']] == ['already_enrolled', 'program_not_found']
+
+
+def test_trends_without_login_is_a_json_401(client):
+    response = client.get('/api/trends')
+    assert response.status_code == 401
+    assert response.json == {'error': 'Login required'}
+
+
+FEED_ORIGIN = 'https://cemaexternalsite.netlify.app'
+
+
+def test_change_feed_preflight_is_answered_without_a_token(client):
+    response = client.options('/api/changes', headers={
+        'Origin': FEED_ORIGIN,
+        'Access-Control-Request-Method': 'GET',
+        'Access-Control-Request-Headers': 'authorization',
+    })
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == FEED_ORIGIN
+    assert 'authorization' in response.headers['Access-Control-Allow-Headers'].lower()
+
+
+def test_change_feed_without_a_token_is_a_401(client):
+    response = client.get('/api/changes', headers={'Origin': FEED_ORIGIN})
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    # The site can read why it was refused
+    assert response.headers['Access-Control-Allow-Origin'] == FEED_ORIGIN
+
+    response = client.get('/api/changes', headers={'Authorization': 'Bearer wrong-token'})
+    assert response.status_code == 401
+
+
+def test_change_feed_with_the_token(app, client):
+    response = client.get('/api/changes', headers={
+        'Origin': FEED_ORIGIN,
+        'Authorization': f"Bearer {app.config['CHANGE_FEED_TOKEN']}",
+    })
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == FEED_ORIGIN
+    assert 'cursor' in response.json
@@ -0,0 +1,43 @@
+import threading
+import pytest
+from app import passwords
+from app.passwords import PasswordHasher, PasswordHashingBusy
+
+
+def test_hashing_concurrency_is_bounded(monkeypatch):
+    hasher = PasswordHasher()
+    hasher.set_concurrency(1)
+    hasher.wait = 0.05
+    started, release = threading.Event(), threading.Event()
+
+    def slow_check(password_hash, password):
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(passwords, 'check_password_hash', slow_check)
+    first = threading.Thread(target=hasher.verify, args=('hash', 'password'))
+    first.start()
+    try:
+        assert started.wait(5)
+        # The only slot is taken, so a second login gives up after PASSWORD_HASH_WAIT
+        with pytest.raises(PasswordHashingBusy):
+            hasher.verify('hash', 'password')
+    finally:
+        release.set()
+        first.join()
+    assert hasher.verify('hash', 'password') is True
+
+
+def test_default_concurrency_leaves_a_thread_free():
+    assert passwords.default_hash_concurrency({'GUNICORN_THREADS': '4'}) == 3
+    assert passwords.default_hash_concurrency({}) == 1
+
+
+def test_set_method_resets_the_prefix():
+    hasher = PasswordHasher()
+    hasher.set_method('pbkdf2:sha256:1000')
+    old_hash = hasher.hash('secret')
+    assert not hasher.needs_rehash(old_hash)
+    hasher.set_method('pbkdf2:sha256:2000')
+    assert hasher.needs_rehash(old_hash)
@@ -0,0 +1,55 @@
+from flask import jsonify
+from app import profiles
+from app.model import db
+from app.profiles import load_client_profile, serialize_client_profile, invalidate_client_profile, PROFILE_QUERY_COUNT
+from app.querybudget import query_budget
+
+
+def test_profile_loads_in_a_fixed_number_of_queries(app, profile_client_id):
+    with app.app_context():
+        with query_budget(PROFILE_QUERY_COUNT, mode='raise', name='load_client_profile'):
+            profile = load_client_profile(profile_client_id)
+            # Serializing touches every relationship the profile shows, a lazy load would go over budget
+            data = serialize_client_profile(profile)
+            # and the profile page also shows the program of each appointment
+            appointment_programs = {appointment.program.name for appointment in profile['appointments']}
+        db.session.remove()
+
+    assert PROFILE_QUERY_COUNT == 3
+    assert len(data['active_enrollments']) == 2
+    assert len(data['dropped_enrollments']) == 1
+    assert len(profile['completed_enrollments']) == 1
+    assert len(data['appointments']) == 3
+    assert all(appointment['doctor'] != 'N/A' for appointment in data['appointments'])
+    assert appointment_programs == {'Profile Test Program'}
+
+
+def test_profile_api_sends_the_jsonify_body_and_etag(app, client, profile_client_id):
+    invalidate_client_profile(None)
+    first = client.get(f'/api/client/{profile_client_id}')
+    cached = client.get(f'/api/client/{profile_client_id}')
+    with app.app_context():
+        expected = jsonify(serialize_client_profile(load_client_profile(profile_client_id))).get_data()
+        db.session.remove()
+
+    assert first.status_code == cached.status_code == 200
+    assert first.get_data() == cached.get_data() == expected
+    assert first.headers['ETag'] == cached.headers['ETag']
+    assert client.get(f'/api/client/{profile_client_id}',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+
+def test_profile_invalidated_while_loading_is_not_cached(app, profile_client_id, monkeypatch):
+    invalidate_client_profile(None)
+
+    def load_then_invalidate(client_id):
+        profile = load_client_profile(client_id)
+        # A commit from another request lands while this one is still serializing
+        invalidate_client_profile(client_id)
+        return profile
+
+    monkeypatch.setattr(profiles, 'load_client_profile', load_then_invalidate)
+    with app.app_context():
+        assert profiles.get_client_profile_json(profile_client_id) is not None
+        db.session.remove()
+    assert profiles.get_profile_cache().get(profile_client_id) is None
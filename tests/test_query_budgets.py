@@ -0,0 +1,37 @@
+from app.querybudget import QueryBudgetExceeded, budget_mode
+
+
+def budgeted_get_rules(app):
+    """The GET routes that declare a query budget, with the client_id argument as their only parameter"""
+    rules = []
+    for rule in app.url_map.iter_rules():
+        budget = getattr(app.view_functions[rule.endpoint], 'query_budget', None)
+        if budget is not None and 'GET' in rule.methods and not rule.arguments - {'client_id'}:
+            rules.append(rule)
+    return rules
+
+
+def test_budgets_raise_under_test(app):
+    with app.app_context():
+        assert budget_mode() == 'raise'
+
+
+def test_budgeted_routes_stay_within_budget(app, admin_client, profile_client_id):
+    rules = budgeted_get_rules(app)
+    assert len(rules) == sum(1 for view in app.view_functions.values() if hasattr(view, 'query_budget'))
+
+    urls = app.url_map.bind('localhost')
+    # The change feed needs its token, the other routes ignore the header
+    headers = {'Authorization': f"Bearer {app.config['CHANGE_FEED_TOKEN']}"}
+    failures = []
+    for rule in rules:
+        url = urls.build(rule.endpoint, {'client_id': profile_client_id} if rule.arguments else {})
+        try:
+            response = admin_client.get(url, headers=headers)
+        except QueryBudgetExceeded as e:
+            failures.append(f'{rule.endpoint}\n{e}')
+            continue
+        # A route that answers with an error never ran the queries its budget is about
+        assert response.status_code < 400, f'{rule.endpoint} answered {response.status_code}'
+
+    assert not failures, '\n\n'.join(failures)
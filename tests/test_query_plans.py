@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import select
+from app.commands import hot_queries, explain_query_plan, full_table_scans
+from app.model import Client
+
+
+# Every hot lookup (see app/commands.py) must be answered from an index, a full table scan fails the build
+HOT_QUERIES = hot_queries()
+
+
+@pytest.mark.parametrize('route, description, statement', HOT_QUERIES,
+                         ids=[f'{route}: {description}' for route, description, _ in HOT_QUERIES])
+def test_hot_query_uses_an_index(app, route, description, statement):
+    with app.app_context():
+        plan = explain_query_plan(statement)
+    assert not full_table_scans(plan), f'{route}: {description} scans a table\n' + '\n'.join(plan)
+
+
+def test_full_table_scan_is_detected(app):
+    with app.app_context():
+        # gender has no index
+        plan = explain_query_plan(select(Client).where(Client.gender == 'x'))
+    assert full_table_scans(plan)
@@ -0,0 +1,33 @@
+from datetime import datetime
+from sqlalchemy import update
+from app.model import db, Client
+from app.reports import ROLLUPS, rollup_rows, refresh_rollups, rollups_available
+
+
+def rollup_mismatches():
+    """{table: (rollup rows, live rows)} for every rollup whose counts differ from the live GROUP BY"""
+    mismatched = {}
+    for rollup in ROLLUPS:
+        rollup_counts = {tuple(row[:-1]): row[-1] for row in rollup_rows(rollup, use_rollup=True)}
+        live_counts = {tuple(row[:-1]): row[-1] for row in rollup_rows(rollup, use_rollup=False)}
+        if rollup_counts != live_counts:
+            mismatched[rollup[0]] = (rollup_counts, live_counts)
+    return mismatched
+
+
+def test_registration_rollup_follows_registered_at_edits(app, profile_client_id):
+    with app.app_context():
+        assert rollups_available()
+        assert rollup_mismatches() == {}
+
+        # Moved to another month, cleared, then backfilled
+        for registered_at in [datetime(2020, 3, 15), None, datetime(2021, 7, 1)]:
+            db.session.execute(update(Client).where(Client.id == profile_client_id).values(registered_at=registered_at))
+            db.session.commit()
+            assert rollup_mismatches() == {}, registered_at
+
+        # and the triggers agree with a rebuild from the live tables
+        before = {rollup[0]: sorted(rollup_rows(rollup, use_rollup=True)) for rollup in ROLLUPS}
+        refresh_rollups()
+        assert {rollup[0]: sorted(rollup_rows(rollup, use_rollup=True)) for rollup in ROLLUPS} == before
+        db.session.remove()
@@ -0,0 +1,14 @@
+from app import search
+
+
+def test_missing_fts_table_is_looked_up_again(app, monkeypatch):
+    with app.app_context():
+        key = str(search.db.engine.url)
+        # As if this worker had checked before the migration ran
+        monkeypatch.setitem(search._fts_available, key, 0.0)
+        monkeypatch.setattr(search.time, 'monotonic', lambda: 1.0)
+        assert search.fts_available() is False
+
+        monkeypatch.setattr(search.time, 'monotonic', lambda: 1.0 + search.FTS_RECHECK_SECONDS)
+        assert search.fts_available() is True
+        assert search._fts_available[key] is True
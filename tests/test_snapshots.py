@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+from sqlalchemy import delete, select
+from app.model import db, DailySnapshot, DailyProgramSnapshot
+from app.snapshots import missing_snapshot_days, take_daily_snapshot, take_missing_snapshots
+
+
+def test_missed_days_are_backfilled(app):
+    today = date.today()
+    with app.app_context():
+        db.session.execute(delete(DailyProgramSnapshot))
+        db.session.execute(delete(DailySnapshot))
+        db.session.commit()
+        assert missing_snapshot_days(today) == [today]
+
+        take_daily_snapshot(today - timedelta(days=4))
+        assert missing_snapshot_days(today) == [today - timedelta(days=n) for n in (3, 2, 1, 0)]
+
+        days = take_missing_snapshots(today)
+        assert days == [today - timedelta(days=n) for n in (3, 2, 1, 0)]
+        snapshot_days = db.session.scalars(select(DailySnapshot.day).order_by(DailySnapshot.day)).all()
+        assert snapshot_days == [today - timedelta(days=n) for n in (4, 3, 2, 1, 0)]
+
+        # Running again the same night only re-takes today
+        assert take_missing_snapshots(today) == [today]
+        db.session.remove()
+
+
+def test_backfill_is_bounded(app):
+    today = date.today()
+    with app.app_context():
+        db.session.execute(delete(DailyProgramSnapshot))
+        db.session.execute(delete(DailySnapshot))
+        db.session.commit()
+        take_daily_snapshot(today - timedelta(days=100))
+        assert missing_snapshot_days(today, max_days=10)[0] == today - timedelta(days=9)
+        db.session.remove()
@@ -0,0 +1,18 @@
+from werkzeug.datastructures import MultiDict
+from app.traffic import redact_args, replay_traffic, REDACTED
+
+
+def test_search_terms_are_redacted():
+    args = MultiDict([('q', 'Jane Doe'), ('q', '0712345678'), ('program', '2'), ('limit', '20')])
+    assert redact_args(args) == {'q': [REDACTED, REDACTED], 'program': ['2'], 'limit': ['20']}
+
+
+def test_replay_sends_the_feed_token(app):
+    records = [{'t': 0, 'm': 'GET', 'p': '/api/changes', 'e': 'api.get_changes', 's': 200, 'ms': 1.0, 'r': None}]
+
+    summary, endpoints = replay_traffic(app, records, concurrency=1, speedup=0)
+    assert summary['errors'] == 0
+    assert endpoints['api.get_changes']['client_errors'] == 0
+
+    summary, endpoints = replay_traffic(app, records, concurrency=1, speedup=0, feed_token='wrong-token')
+    assert endpoints['api.get_changes']['client_errors'] == 1